@@ -1,41 +1,89 @@
+import dash
 from dash import Dash, html, dcc, dash_table, Input, Output, State
-import plotly.express as px
+import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
 from dash.exceptions import PreventUpdate
 import time
 from tickers_analysis import analyzer
+from price_cache import PriceCache
+from result_cache import ResultCache, make_key
+from data_preprocessing import DataPreprocessor
+from job_queue import JobQueue
+from pipeline import analysis_snapshot_reader
+from factor_engine import FACTOR_MODELS, factors_available
+from covariance_engine import CovarianceService
+from bootstrap_engine import BOOTSTRAP_CONFIDENCE
+from benchmark_engine import BENCHMARKS, DEFAULT_BENCHMARKS, grid_pivot
 import traceback
+import universe
+import json
+from flask import Response
+from metrics import registry
 
-start_time = time.time()
-
-app = Dash(__name__)
+# The portfolio risk panel is part of the results, its components only exist once an analysis is shown
+app = Dash(__name__, suppress_callback_exceptions=True)
 
 colors = {
     'background': '#F5F5DC',
     'text': '#111111'
 }
 
-# Function to get SP500 tickers
+# Function to get SP500 tickers (read once from the bundled data/sp500_tickers.json)
 def get_sp500_tickers():
-    try:
-        all_stocks = pd.read_html("data/sp500_components.html")[0]
-        
-        #get value at rows i, column 0 (first column)
-        all_tickers = [all_stocks.iloc[i, 0] for i in range(len(all_stocks))]
-        
-        # Create dropdown options
-        ticker_options = [{'label': ticker, 'value': ticker} for ticker in all_tickers]
-        return ticker_options
-    
-    except Exception as e:
-        print(f"Error loading tickers: {e}")
-        fallback_tickers = ["AAPL", "NVDA", "TSLA", "AMZN", "MSFT", "GOOG", "INTC"]
-        return [{'label': ticker, 'value': ticker} for ticker in fallback_tickers]
+    return universe.ticker_options(universe.DEFAULT_UNIVERSE)
 
 
 # Get ticker options
 ticker_options = get_sp500_tickers()
 
+# On-disk price cache shared by every analysis, only the missing tail of each series is downloaded
+price_cache = PriceCache()
+
+# LRU cache of finished analyses keyed on the normalized selection, entries expire at every market close
+result_cache = ResultCache()
+
+# Latest analysis snapshot published by pipeline.py, selections it covers are served without any download
+analysis_snapshot = analysis_snapshot_reader()
+
+# Covariance matrices of the analyzed selections, computed once and reused by every portfolio query
+covariance_service = CovarianceService()
+
+# all_info frames behind the server-side results tables, each page, sort and filter request is answered from here
+results_table_cache = ResultCache(max_entries=16)
+
+# Bootstrap confidence intervals of the betas of finished selections, computed by background jobs once the results are shown
+beta_interval_cache = ResultCache(max_entries=16)
+
+# Ticker x benchmark grids keyed on the selection and the benchmarks, changing the displayed statistic reuses them
+benchmark_grid_cache = ResultCache(max_entries=16)
+
+# Local worker pool running the analyses in the background, identical selections share one job
+job_queue = JobQueue(max_workers=2)
+
+# Result cache counters are exported with the metrics of the stages
+registry.register_collector('result_cache', result_cache.stats)
+registry.register_collector('results_table_cache', results_table_cache.stats)
+registry.register_collector('covariance_cache', covariance_service.stats)
+registry.register_collector('beta_interval_cache', beta_interval_cache.stats)
+registry.register_collector('benchmark_grid_cache', benchmark_grid_cache.stats)
+registry.register_collector('analysis_snapshot', lambda: {'version': analysis_snapshot.version})
+
+# Share of the work of each analysis stage, used for the progress percentage and the ETA
+JOB_STAGE_WEIGHTS = {'prices': 0.6, 'betas': 0.05, 'fundamentals': 0.35}
+
+# Rows of each page of the results table, only the current page is sent to the browser
+RESULTS_PAGE_SIZE = 10
+
+# Scatter points drawn with a ticker label, the others only show it on hover
+MAX_SCATTER_LABELS = 40
+
+# Number of tickers downloaded and analyzed per batch, each batch is shown as soon as it is ready
+ANALYSIS_BATCH_SIZE = 25
+
+# Resamples of the bootstrap behind the beta error bars of the scatter (see bootstrap_engine.py)
+SCATTER_BOOTSTRAP_RESAMPLES = 5000
+
 #app.layout is the UI components of the application
 app.layout = html.Div(style={'backgroundColor': colors['background']}, children=[
     #subtitle of the application, aligned to the center
@@ -100,6 +148,36 @@ app.layout = html.Div(style={'backgroundColor': colors['background']}, children=
                 style={'color': colors['text'], 'marginTop': '10px'}
             ),
         ], style={'width': '31%', 'display': 'inline-block', 'marginBottom': '20px'}),
+
+        # Rolling beta window selection with RadioItems
+        html.Div([
+            html.Label('Beta Over Time', style={'color': colors['text']}),
+            dcc.RadioItems(
+                id='rolling-radioitem',  # name of the feature
+                options=[
+                    {'label': '1 Year Rolling', 'value': 'rolling-1'},
+                    {'label': '3 Years Rolling', 'value': 'rolling-3'},
+                    {'label': 'Expanding', 'value': 'expanding'},
+                    {'label': 'EWMA (1 Year Half-Life)', 'value': 'ewma-1'}
+                ],
+                value='rolling-1',  # default value
+                style={'color': colors['text'], 'marginTop': '10px'}
+            ),
+        ], style={'width': '31%', 'display': 'inline-block', 'marginBottom': '20px'}),
+
+        # Factor model selection with RadioItems (factor returns are read from the local files in data/factors, hidden without them)
+        html.Div([
+            html.Label('Factor Model', style={'color': colors['text']}),
+            dcc.RadioItems(
+                id='factor-radioitem',  # name of the feature
+                options=[
+                    {'label': 'Fama-French 3 Factors', 'value': 'ff3'},
+                    {'label': 'Fama-French 5 Factors', 'value': 'ff5'}
+                ],
+                value='ff3',  # default value
+                style={'color': colors['text'], 'marginTop': '10px'}
+            ),
+        ], style={'width': '31%', 'display': 'inline-block' if factors_available() else 'none', 'marginBottom': '20px'}),
     
         # Ticker selection with dropdown
         html.Div([
@@ -128,7 +206,11 @@ app.layout = html.Div(style={'backgroundColor': colors['background']}, children=
         
         # Loading message and output container
         html.Div(id='loading-message', style={'color': colors['text'], 'marginTop': '10px'}),
-        html.Div(id='output-container', style={'color': colors['text'], 'marginTop': '20px'})
+        html.Div(id='output-container', style={'color': colors['text'], 'marginTop': '20px'}),
+
+        # Background job of the current analysis, polled every second while it runs
+        dcc.Store(id='job-store'),
+        dcc.Interval(id='job-poll', interval=1000, disabled=True)
     ])
 ])
 
@@ -151,17 +233,441 @@ def create_data_table(df):
         style_table={'overflowX': 'auto'},
     )
 
-# Callback for the "Run Analysis" button
+# Results table paged, sorted and filtered on the server (page_action='custom'), backed by the cached all_info
+# of the selection: the browser only receives the rows of the page it shows
+def create_results_table(all_info):
+    df = all_info.reset_index()
+    return dash_table.DataTable(
+        id='results-table',
+        data=df.iloc[:RESULTS_PAGE_SIZE].to_dict('records'),
+        columns=[{'name': col, 'id': col, 'type': 'numeric' if pd.api.types.is_numeric_dtype(df[col]) else 'text'} for col in df.columns],
+        style_cell={
+            'backgroundColor': colors['background'],
+            'color': colors['text'],
+            'textAlign': 'left',
+            'padding': '7px'
+        },
+        style_header={
+            'backgroundColor': '#333333',
+            'color': 'white',
+            'fontWeight': 'bold'
+        },
+        page_current=0,
+        page_size=RESULTS_PAGE_SIZE,
+        page_count=max(1, -(-len(df) // RESULTS_PAGE_SIZE)),
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+        style_table={'overflowX': 'auto'},
+    )
+
+# DataTable filter operators (filter_query syntax) and the pandas comparison of each
+FILTER_OPERATORS = [
+    ('ge ', lambda column, value: column >= value),
+    ('le ', lambda column, value: column <= value),
+    ('lt ', lambda column, value: column < value),
+    ('gt ', lambda column, value: column > value),
+    ('ne ', lambda column, value: column != value),
+    ('eq ', lambda column, value: column == value),
+    ('contains ', lambda column, value: column.astype(str).str.contains(str(value), case=False, regex=False)),
+    ('datestartswith ', lambda column, value: column.astype(str).str.startswith(str(value))),
+]
+
+# Column, operator and value of one filter_query term, e.g. "{Beta 5y 1mo} ge 1.2" or "{Ticker} contains AA"
+def split_filter_part(filter_part):
+    for operator, compare in FILTER_OPERATORS:
+        if operator in filter_part:
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+            value_part = value_part.strip()
+            if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', '`'):
+                value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            return name, compare, value
+    return None, None, None
+
+# Rows of a results df matching the table's filter_query, in the order of its sort_by
+def query_results(df, filter_query, sort_by):
+    for filter_part in (filter_query or '').split(' && '):
+        name, compare, value = split_filter_part(filter_part)
+        if name in df.columns:
+            df = df.loc[compare(df[name], value)]
+
+    if sort_by:
+        df = df.sort_values(
+            [column['column_id'] for column in sort_by],
+            ascending=[column['direction'] == 'asc' for column in sort_by],
+            na_position='last'
+        )
+    return df
+
+# Rolling/expanding/EWMA beta of the selected tickers over time
+def create_rolling_beta_chart(tickers_instance, rolling_mode):
+    # rolling_mode is "<mode>" or "<mode>-<years>", e.g. "rolling-3" or "expanding"
+    mode, _, years = rolling_mode.partition('-')
+    years = float(years) if years else 1
+
+    rolling_betas = tickers_instance.rolling_beta_all(mode=mode, window_years=years, halflife_years=years)
+    rolling_betas = rolling_betas.dropna(how='all')
+
+    if rolling_betas.empty:
+        return html.Div("Not enough data for the selected window, try a longer period or a shorter window")
+
+    # One WebGL line per ticker built straight from the columns (no long-format reshaping of the whole frame)
+    dates = rolling_betas.index
+    rolling_fig = go.Figure([
+        go.Scattergl(x=dates, y=rolling_betas[ticker].to_numpy(), mode='lines', name=ticker)
+        for ticker in rolling_betas.columns
+    ])
+
+    rolling_fig.update_layout(
+        title='Beta vs the Index Over Time',
+        xaxis_title='Date',
+        yaxis_title='Beta',
+        legend_title_text='Ticker',
+        plot_bgcolor=colors['background'],
+        paper_bgcolor=colors['background'],
+        font_color=colors['text']
+    )
+
+    return dcc.Graph(figure=rolling_fig)
+
+# Factor loadings, t-stats and R² of the selected tickers next to their CAPM beta
+def create_factor_table(tickers_instance, factor_model):
+    try:
+        factor_stats = tickers_instance.factor_model_all(model=factor_model)
+    except (OSError, ValueError) as e:
+        return html.Div(f"Factor exposures not available: {e}")
+
+    factor_names = FACTOR_MODELS[factor_model]
+    beta_col = f"Beta {tickers_instance.period} {tickers_instance.interval}"
+
+    factor_df = factor_stats.set_index('Ticker')
+    factor_df.insert(0, beta_col, tickers_instance.all_info[beta_col].reindex(factor_df.index))
+    factor_df[factor_names + ['R Squared']] = factor_df[factor_names + ['R Squared']].round(3)
+    factor_df[[f"t {name}" for name in factor_names]] = factor_df[[f"t {name}" for name in factor_names]].round(2)
+
+    return create_data_table(factor_df[[beta_col] + factor_names + [f"t {name}" for name in factor_names] + ['R Squared', 'Observations']])
+
+# Weights of the analyzed tickers (equal by default) and the covariance estimator of the portfolio risk
+def create_portfolio_panel(tickers_instance):
+    tickers = tickers_instance.ticker_names
+    equal_weight = round(100 / len(tickers), 2) if tickers else 0
+
+    return html.Div([
+        html.Label('Portfolio weights (%), normalized to add up to 100', style={'color': colors['text']}),
+        dash_table.DataTable(
+            id='weights-table',
+            data=[{'Ticker': ticker, 'Weight (%)': equal_weight} for ticker in tickers],
+            columns=[
+                {'name': 'Ticker', 'id': 'Ticker', 'editable': False},
+                {'name': 'Weight (%)', 'id': 'Weight (%)', 'type': 'numeric', 'editable': True}
+            ],
+            style_cell={
+                'backgroundColor': colors['background'],
+                'color': colors['text'],
+                'textAlign': 'left',
+                'padding': '7px'
+            },
+            style_header={
+                'backgroundColor': '#333333',
+                'color': 'white',
+                'fontWeight': 'bold'
+            },
+            page_size=10,
+        ),
+        dcc.RadioItems(
+            id='estimator-radioitem',  # name of the feature
+            options=[
+                {'label': 'Ledoit-Wolf Shrinkage', 'value': 'ledoit-wolf'},
+                {'label': 'Pairwise Sample Covariance', 'value': 'pairwise'}
+            ],
+            value='ledoit-wolf',  # default value
+            style={'color': colors['text'], 'marginTop': '10px'}
+        ),
+        html.Button('Compute Portfolio Risk', id='portfolio-button', style={
+            'backgroundColor': '#4CAF50',
+            'color': 'white',
+            'padding': '10px 15px',
+            'margin': '10px 0',
+            'border': 'none',
+            'borderRadius': '4px',
+            'cursor': 'pointer',
+            'fontSize': '16px'
+        }),
+        html.Div(id='portfolio-output', style={'color': colors['text'], 'marginTop': '10px'})
+    ])
+
+# Statistics of the benchmark grid that can be compared across benchmarks
+BENCHMARK_STATISTICS = ['Beta', 'Expected Monthly Returns (%)', "Jensen's Alpha (% per year)", 'R Squared']
+
+# Benchmarks to compare the betas against (the index of the analysis and the default ones preselected)
+def create_benchmark_panel(tickers_instance):
+    selected_benchmarks = list(dict.fromkeys([tickers_instance.index_name] + DEFAULT_BENCHMARKS))
+    labels = {**BENCHMARKS, **{ticker: ticker for ticker in selected_benchmarks if ticker not in BENCHMARKS}}
+
+    return html.Div([
+        html.Label('Benchmarks', style={'color': colors['text']}),
+        dcc.Dropdown(
+            id='benchmark-dropdown',
+            options=[{'label': f"{ticker} - {name}" if name != ticker else ticker, 'value': ticker} for ticker, name in labels.items()],
+            value=selected_benchmarks,
+            multi=True
+        ),
+        dcc.RadioItems(
+            id='benchmark-stat-radioitem',  # name of the feature
+            options=[{'label': statistic, 'value': statistic} for statistic in BENCHMARK_STATISTICS],
+            value='Beta',  # default value
+            style={'color': colors['text'], 'marginTop': '10px'}
+        ),
+        html.Button('Compare Benchmarks', id='benchmark-button', style={
+            'backgroundColor': '#4CAF50',
+            'color': 'white',
+            'padding': '10px 15px',
+            'margin': '10px 0',
+            'border': 'none',
+            'borderRadius': '4px',
+            'cursor': 'pointer',
+            'fontSize': '16px'
+        }),
+        html.Div(id='benchmark-output', style={'color': colors['text'], 'marginTop': '10px'}),
+        # Benchmarks of the last comparison and the job downloading them, polled like the analysis jobs
+        dcc.Store(id='benchmark-store'),
+        dcc.Interval(id='benchmark-poll', interval=1000, disabled=True)
+    ])
+
+# Tickers drawn with a label on the scatter: all of them for small selections, otherwise the max_labels points
+# furthest from the center of the cloud (the ones that stand out), the dense middle is left to the hover
+def scatter_labels(tickers, x, y, max_labels=MAX_SCATTER_LABELS):
+    tickers = np.asarray(tickers, dtype=object)
+    if len(tickers) <= max_labels:
+        return tickers
+
+    with np.errstate(invalid='ignore'):
+        distance = np.hypot((x - np.nanmedian(x)) / np.nanstd(x), (y - np.nanmedian(y)) / np.nanstd(y))
+    labeled = np.argsort(np.nan_to_num(distance, nan=-1.0))[-max_labels:]
+    labels = np.full(len(tickers), '', dtype=object)
+    labels[labeled] = tickers[labeled]
+    return labels
+
+# Create CAPM vs Beta scatter plot (one WebGL trace, so large universes stay responsive)
+# beta_intervals (bootstrap_engine output, one row per ticker) adds the confidence interval of each beta as an error bar
+def create_scatter_figure(all_info, beta_col, beta_intervals=None):
+    if "Expected Monthly Returns (%)" not in all_info.columns:
+        return None
+
+    tickers = all_info.index.to_numpy()
+    betas = all_info[beta_col].to_numpy(dtype=float)
+    expected_returns = all_info["Expected Monthly Returns (%)"].to_numpy(dtype=float)
+
+    error_x = None
+    hovertemplate = '%{hovertext}<br>Beta: %{x}<br>Expected Monthly Return (%): %{y}<extra></extra>'
+    customdata = None
+    if beta_intervals is not None:
+        bounds = beta_intervals.set_index('Ticker').reindex(tickers)[['Beta CI Low', 'Beta CI High']].to_numpy(dtype=float)
+        # Bars are drawn around the rounded beta of the table, so they are clipped at 0 on each side
+        error_x = dict(type='data', symmetric=False, array=np.clip(bounds[:, 1] - betas, 0, None),
+                       arrayminus=np.clip(betas - bounds[:, 0], 0, None), thickness=1, width=0, color='rgba(0, 0, 0, 0.35)')
+        customdata = bounds
+        hovertemplate = (f'%{{hovertext}}<br>Beta: %{{x}} ({BOOTSTRAP_CONFIDENCE * 100:.0f}% CI '
+                         '%{customdata[0]:.3f} to %{customdata[1]:.3f})<br>Expected Monthly Return (%): %{y}<extra></extra>')
+
+    scatter_fig = go.Figure(go.Scattergl(
+        x=betas,
+        y=expected_returns,
+        mode='markers+text',
+        text=scatter_labels(tickers, betas, expected_returns),
+        textposition='top center',
+        hovertext=tickers,
+        customdata=customdata,
+        hovertemplate=hovertemplate,
+        error_x=error_x,
+        marker=dict(size=12 if len(tickers) <= MAX_SCATTER_LABELS else 7, opacity=0.8)
+    ))
+
+    scatter_fig.update_layout(
+        title='CAPM Expected Return vs Beta',
+        xaxis_title='Beta',
+        yaxis_title='Expected Monthly Return (%)',
+        plot_bgcolor=colors['background'],
+        paper_bgcolor=colors['background'],
+        font_color=colors['text']
+    )
+
+    return scatter_fig
+
+# Download and compute the full analysis for a selection, returns the analyzer and the scatter figure
+# progress_callback(stage, done, total) receives the progress of the download and of each analysis stage
+# partial_callback(all_info_so_far) receives the rows analyzed so far after every batch of tickers
+def run_analysis(period, interval, selected_tickers, progress_callback=None, partial_callback=None):
+    # Create analyzer instance
+    tickers_instance = analyzer()
+    
+    tickers_instance.number_of_tickers = len(selected_tickers)
+    tickers_instance.period = period
+    tickers_instance.interval = interval
+    tickers_instance.index_processor.period = period
+    tickers_instance.index_processor.interval = interval
+    tickers_instance.index_processor.number_of_tickers = len(selected_tickers)
+    tickers_instance.index_processor.price_cache = price_cache
+    tickers_instance.progress_callback = progress_callback
+
+    # Streaming the analysis: the rows of each batch of tickers are published as soon as they are ready
+    analyzed_batches = []
+    for batch_info in tickers_instance.iter_analysis(selected_tickers, batch_size=ANALYSIS_BATCH_SIZE):
+        analyzed_batches.append(batch_info)
+        if partial_callback is not None:
+            partial_callback(pd.concat(analyzed_batches))
+
+    all_info = tickers_instance.all_info
+    if all_info is None:
+        raise ValueError("None of the selected tickers could be downloaded")
+
+    # Create visualizations (the beta error bars are added by the bootstrap job started once the results are shown)
+    beta_col = f"Beta {period} {interval}"
+    scatter_fig = create_scatter_figure(all_info, beta_col)
+
+    return tickers_instance, scatter_fig
+
+# Entry of the result cache for a finished analysis: the frames the results are rendered from and the scatter figure
+# The analyzer itself is not cached, it references the downloaders and the shared price cache, which are not part of the result
+def cached_analysis(tickers_instance, scatter_fig):
+    return {
+        'period': tickers_instance.period,
+        'interval': tickers_instance.interval,
+        'index_name': tickers_instance.index_name,
+        'risk_free': tickers_instance.risk_free,
+        'pairwise': tickers_instance.pairwise,
+        'returns_data': tickers_instance.returns_data,
+        'beta_stats': tickers_instance.beta_stats,
+        'all_info': tickers_instance.all_info,
+        'scatter_figure': scatter_fig
+    }
+
+# analyzer holding a cached analysis again, like AnalysisSnapshot.analyzer_for does for the snapshot
+def analyzer_from_cache(cached_result):
+    tickers_instance = analyzer()
+    tickers_instance.index_name = cached_result['index_name']
+    tickers_instance.period = tickers_instance.index_processor.period = cached_result['period']
+    tickers_instance.interval = tickers_instance.index_processor.interval = cached_result['interval']
+    tickers_instance.index_processor.price_cache = price_cache
+    tickers_instance.risk_free = cached_result['risk_free']
+    tickers_instance.pairwise = cached_result['pairwise']
+    tickers_instance.returns_data = cached_result['returns_data']
+    tickers_instance.get_stock_ticker_names()
+    tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = len(tickers_instance.ticker_names)
+    tickers_instance.beta_stats = cached_result['beta_stats']
+    tickers_instance.all_info = cached_result['all_info']
+    return tickers_instance
+
+# Components displayed for a finished analysis
+def render_results(tickers_instance, scatter_fig, rolling_mode, factor_model='ff3', selected_tickers=None):
+    all_info = tickers_instance.all_info
+
+    # The scatter polls the bootstrap job of its beta confidence intervals and redraws itself with the error bars
+    if scatter_fig is not None:
+        scatter_chart = html.Div([
+            dcc.Graph(id='capm-scatter', figure=scatter_fig),
+            html.Div(id='bootstrap-status', style={'color': colors['text'], 'fontSize': '12px'}),
+            dcc.Store(id='bootstrap-store'),
+            dcc.Interval(id='bootstrap-poll', interval=1000)
+        ])
+    else:
+        scatter_chart = html.Div("CAPM vs Beta chart not available")
+
+    # Beta over time line chart
+    rolling_chart = create_rolling_beta_chart(tickers_instance, rolling_mode)
+    
+    # Selection behind the results, the server-side table and the portfolio panel look their data up with it
+    selection = {
+        'period': tickers_instance.period,
+        'interval': tickers_instance.interval,
+        'tickers': list(selected_tickers or tickers_instance.ticker_names)
+    }
+    results_table_cache.put(selection_key(selection), all_info)
+
+    # Factor exposures only when the factor files of the interval are in data/factors
+    factor_section = []
+    if factors_available(tickers_instance.interval):
+        factor_section = [
+            html.H4('Factor Exposures', style={'color': colors['text'], 'marginTop': '20px'}),
+            create_factor_table(tickers_instance, factor_model)
+        ]
+
+    return html.Div([
+        dcc.Store(id='analysis-selection', data=selection),
+        html.H4('CAPM and Beta Analysis Results', style={'color': colors['text']}),
+        create_results_table(all_info),
+        html.H4('CAPM vs Beta Relationship', style={'color': colors['text'], 'marginTop': '20px'}),
+        scatter_chart,
+        html.H4('Beta Over Time', style={'color': colors['text'], 'marginTop': '20px'}),
+        rolling_chart,
+        *factor_section,
+        html.H4('Portfolio Risk', style={'color': colors['text'], 'marginTop': '20px'}),
+        create_portfolio_panel(tickers_instance),
+        html.H4('Benchmark Comparison', style={'color': colors['text'], 'marginTop': '20px'}),
+        create_benchmark_panel(tickers_instance)
+    ])
+
+# Components displayed while an analysis is still running: the table and scatter of the rows ready so far
+def render_partial_results(partial_info, beta_col):
+    scatter_fig = create_scatter_figure(partial_info, beta_col)
+    return html.Div([
+        html.H4(f'CAPM and Beta Analysis Results ({len(partial_info)} tickers so far)', style={'color': colors['text']}),
+        create_data_table(partial_info),
+        html.H4('CAPM vs Beta Relationship', style={'color': colors['text'], 'marginTop': '20px'}),
+        dcc.Graph(figure=scatter_fig) if scatter_fig is not None else html.Div("CAPM vs Beta chart not available")
+    ])
+
+def render_error(message, error_trace):
+    return html.Div([
+        html.H4('Error in Analysis', style={'color': '#FF6B6B'}),
+        html.Pre(f"Error: {message}", style={'color': '#FF6B6B'}),
+        html.Pre(error_trace, style={'color': '#FF6B6B', 'fontSize': '12px'})
+    ])
+
+# Progress line of a running job: tickers fetched, betas computed, fundamentals and ETA
+def progress_message(job_status):
+    if job_status['status'] == 'queued':
+        return "Analysis queued, waiting for a worker..."
+
+    progress = job_status['progress']
+    parts = []
+    for stage, label in [('prices', 'tickers fetched'), ('betas', 'betas computed'), ('fundamentals', 'fundamentals fetched')]:
+        if stage in progress:
+            done, total = progress[stage]
+            parts.append(f"{label}: {done}/{total}")
+
+    message = f"Running analysis ({job_status['fraction_done'] * 100:.0f}%)"
+    if parts:
+        message += " - " + ", ".join(parts)
+    if job_status['eta_seconds'] is not None:
+        message += f" - ETA {job_status['eta_seconds']:.0f}s"
+    return message
+
+# Callback for the "Run Analysis" button: serves cached results directly, otherwise starts a background job
 @app.callback(
     [Output('loading-message', 'children'),
-     Output('output-container', 'children')],
+     Output('output-container', 'children'),
+     Output('job-store', 'data'),
+     Output('job-poll', 'disabled')],
     [Input('run-button', 'n_clicks')],
     [State('period-radioitem', 'value'),
      State('interval-radioitem', 'value'),
-     State('ticker-dropdown', 'value')],
+     State('ticker-dropdown', 'value'),
+     State('rolling-radioitem', 'value'),
+     State('factor-radioitem', 'value')],
     prevent_initial_call=True
 )
-def update_output(n_clicks, period, interval, selected_tickers):
+def update_output(n_clicks, period, interval, selected_tickers, rolling_mode='rolling-1', factor_model='ff3'):
     if n_clicks is None:
         raise PreventUpdate
     
@@ -169,86 +675,327 @@ def update_output(n_clicks, period, interval, selected_tickers):
     if not selected_tickers or len(selected_tickers) == 0:
         return (
             html.Div("No tickers selected!"), 
-            html.Div("Please select tickers using the dropdown above before running the analysis.")
+            html.Div("Please select tickers using the dropdown above before running the analysis."),
+            None,
+            True
         )
 
-    # Show loading message
-    loading_message = f"Running analysis with {len(selected_tickers)} tickers, {period} period, {interval} interval..."
-    html.Div(loading_message)
-    
     try:
-        # Create analyzer instance
-        tickers_instance = analyzer()
-        
-        tickers_instance.number_of_tickers = len(selected_tickers)
-        tickers_instance.period = period
-        tickers_instance.interval = interval
-        tickers_instance.index_processor.period = period
-        tickers_instance.index_processor.interval = interval
-        tickers_instance.index_processor.number_of_tickers = len(selected_tickers)
+        index_name = DataPreprocessor().get_index_name()
 
-        #first calling the returns data to populate the returns df:
-        returns_data = tickers_instance.returns_all_tickers(selected_tickers)
+        # Selections covered by the nightly snapshot are answered from disk, with no network call
+        snapshot = analysis_snapshot.get()
+        if snapshot is not None and snapshot.covers(period, interval, selected_tickers, index_name):
+            tickers_instance = snapshot.analyzer_for(period, interval, selected_tickers)
+            scatter_fig = create_scatter_figure(tickers_instance.all_info, f"Beta {period} {interval}")
+            results = render_results(tickers_instance, scatter_fig, rolling_mode, factor_model, selected_tickers)
+            return html.Div(f"Analysis completed! (snapshot {snapshot.version})"), results, None, True
 
-        #fetching the ticker names:
-        ticker_names = tickers_instance.get_stock_ticker_names()
+        # Repeated selections are served from the in-process result cache
+        cache_key = make_key(selected_tickers, period, interval, index_name)
+        cached_result = result_cache.get(cache_key)
 
-        # Run the full analysis using the analyzer class
-        all_info = tickers_instance.run_all_analysis()
-        
-        # Create visualizations
-        # Beta comparison bar chart
-        beta_col = f"Beta {period} {interval}"
-        
-        
-        # Create CAPM vs Beta scatter plot
-        if "Expected Monthly Returns (%)" in all_info.columns:
-            capm_beta_df = all_info.reset_index()[['Ticker', "Expected Monthly Returns (%)", beta_col]]
-            capm_beta_df = capm_beta_df.rename(columns={
-                "Expected Monthly Returns (%)": 'Expected Return',
-                beta_col: 'Beta'
-            })
-            
-            scatter_fig = px.scatter(
-                capm_beta_df,
-                x='Beta',
-                y='Expected Return',
-                text='Ticker',
-                title='CAPM Expected Return vs Beta',
-                labels={'Beta': 'Beta', 'Expected Return': 'Expected Monthly Return (%)'}
-            )
-            
-            scatter_fig.update_traces(
-                textposition='top center',
-                marker=dict(size=12, opacity=0.8)
-            )
-            
-            scatter_fig.update_layout(
-                plot_bgcolor=colors['background'],
-                paper_bgcolor=colors['background'],
-                font_color=colors['text']
-            )
-            
-            scatter_chart = dcc.Graph(figure=scatter_fig)
-        else:
-            scatter_chart = html.Div("CAPM vs Beta chart not available")
-        
-        # Return components to display
-        return html.Div("Analysis completed!"), html.Div([
-            html.H4('CAPM and Beta Analysis Results', style={'color': colors['text']}),
-            create_data_table(all_info),
-            html.H4('CAPM vs Beta Relationship', style={'color': colors['text'], 'marginTop': '20px'}),
-            scatter_chart
-        ])
+        if cached_result is not None:
+            results = render_results(analyzer_from_cache(cached_result), cached_result['scatter_figure'], rolling_mode, factor_model, selected_tickers)
+            return html.Div("Analysis completed!"), results, None, True
+
+        # Same parameters as a queued or running job: that job is shared instead of starting a new one
+        job = job_queue.submit(
+            cache_key,
+            lambda job: run_analysis(period, interval, selected_tickers, progress_callback=job.report, partial_callback=job.publish),
+            stage_weights=JOB_STAGE_WEIGHTS,
+            on_done=lambda job: result_cache.put(job.key, cached_analysis(*job.result))
+        )
+
+        # Show loading message
+        loading_message = f"Running analysis with {len(selected_tickers)} tickers, {period} period, {interval} interval..."
+        return html.Div(loading_message), html.Div(), {'job_id': job.id, 'rolling_mode': rolling_mode, 'factor_model': factor_model, 'tickers': selected_tickers, 'beta_col': f"Beta {period} {interval}"}, False
     
     except Exception as e:
-        error_trace = traceback.format_exc()
-        return html.Div("Analysis completed with errors."), html.Div([
-            html.H4('Error in Analysis', style={'color': '#FF6B6B'}),
-            html.Pre(f"Error: {str(e)}", style={'color': '#FF6B6B'}),
-            html.Pre(error_trace, style={'color': '#FF6B6B', 'fontSize': '12px'})
-        ])
+        return html.Div("Analysis completed with errors."), render_error(str(e), traceback.format_exc()), None, True
+
+# Polling the background job: progress while it runs, the results (or the error) once it is finished
+@app.callback(
+    [Output('loading-message', 'children', allow_duplicate=True),
+     Output('output-container', 'children', allow_duplicate=True),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    [Input('job-poll', 'n_intervals')],
+    [State('job-store', 'data')],
+    prevent_initial_call=True
+)
+def poll_job(n_intervals, job_data):
+    if not job_data:
+        raise PreventUpdate
+
+    job = job_queue.get(job_data['job_id'])
+    if job is None:
+        return html.Div("Analysis job expired, please run the analysis again."), html.Div(), True
+
+    job_status = job.snapshot()
+
+    if job_status['status'] == 'done':
+        try:
+            tickers_instance, scatter_fig = job.result
+            return html.Div("Analysis completed!"), render_results(tickers_instance, scatter_fig, job_data['rolling_mode'], job_data['factor_model'], job_data['tickers']), True
+        except Exception as e:
+            return html.Div("Analysis completed with errors."), render_error(str(e), traceback.format_exc()), True
+
+    if job_status['status'] == 'error':
+        message, _, error_trace = job_status['error'].partition('\n')
+        return html.Div("Analysis completed with errors."), render_error(message, error_trace), True
+
+    # Rows of the tickers analyzed so far
+    if job.partial_result is not None:
+        return html.Div(progress_message(job_status)), render_partial_results(job.partial_result, job_data['beta_col']), False
+
+    return html.Div(progress_message(job_status)), dash.no_update, False
+
+def selection_key(selection):
+    return make_key(selection['tickers'], selection['period'], selection['interval'], DataPreprocessor().get_index_name())
+
+# Finished analysis of a selection, from the snapshot or the result cache (None once it expired)
+def find_analysis(period, interval, selected_tickers):
+    index_name = DataPreprocessor().get_index_name()
+    snapshot = analysis_snapshot.get()
+    if snapshot is not None and snapshot.covers(period, interval, selected_tickers, index_name):
+        return snapshot.analyzer_for(period, interval, selected_tickers)
+    cached_result = result_cache.get(make_key(selected_tickers, period, interval, index_name))
+    return analyzer_from_cache(cached_result) if cached_result is not None else None
+
+# Key of the beta confidence intervals of a selection, a new snapshot version may change the analysis behind it
+def beta_interval_key(selection):
+    return (analysis_snapshot.version, selection_key(selection))
+
+# Bootstrap of the betas of a finished selection, run by a background job
+# It stays in the job thread (workers=1): pool workers would be spawned and each of them would import this whole app again
+def bootstrap_selection(selection):
+    tickers_instance = find_analysis(selection['period'], selection['interval'], selection['tickers'])
+    if tickers_instance is None:
+        raise ValueError("Analysis expired, please run the analysis again.")
+    return tickers_instance.beta_bootstrap_all(resamples=SCATTER_BOOTSTRAP_RESAMPLES, workers=1)
+
+# Polling the bootstrap job of the displayed selection: the scatter is redrawn with the beta error bars once it is done
+# The first poll serves cached intervals or starts the job, the request thread never runs the bootstrap itself
+@app.callback(
+    [Output('capm-scatter', 'figure'),
+     Output('bootstrap-status', 'children'),
+     Output('bootstrap-store', 'data'),
+     Output('bootstrap-poll', 'disabled')],
+    [Input('bootstrap-poll', 'n_intervals')],
+    [State('bootstrap-store', 'data'),
+     State('analysis-selection', 'data')]
+)
+def update_beta_intervals(n_intervals, job_id, selection):
+    if not selection:
+        raise PreventUpdate
+
+    interval_key = beta_interval_key(selection)
+    beta_intervals = beta_interval_cache.get(interval_key)
+    if beta_intervals is None:
+        job = job_queue.get(job_id) if job_id else None
+        if job is None:
+            job = job_queue.submit(
+                ('bootstrap',) + interval_key,
+                lambda job: bootstrap_selection(selection),
+                on_done=lambda job: beta_interval_cache.put(interval_key, job.result)
+            )
+
+        job_status = job.snapshot()
+        if job_status['status'] == 'error':
+            message = job_status['error'].partition('\n')[0]
+            return dash.no_update, f"Beta confidence intervals not available: {message}", None, True
+        if job_status['status'] != 'done':
+            return dash.no_update, "Computing the beta confidence intervals...", job.id, False
+        beta_intervals = job.result
+
+    tickers_instance = find_analysis(selection['period'], selection['interval'], selection['tickers'])
+    if tickers_instance is None:
+        return dash.no_update, "Analysis expired, please run the analysis again.", None, True
+
+    beta_col = f"Beta {selection['period']} {selection['interval']}"
+    scatter_fig = create_scatter_figure(tickers_instance.all_info, beta_col, beta_intervals)
+    return scatter_fig, f"Error bars: {BOOTSTRAP_CONFIDENCE * 100:.0f}% bootstrap confidence intervals of the betas", None, True
+
+# Callback for the "Compute Portfolio Risk" button: beta, volatility and risk contributions of the entered weights
+@app.callback(
+    Output('portfolio-output', 'children'),
+    [Input('portfolio-button', 'n_clicks')],
+    [State('weights-table', 'data'),
+     State('estimator-radioitem', 'value'),
+     State('analysis-selection', 'data')],
+    prevent_initial_call=True
+)
+def update_portfolio(n_clicks, weights_rows, estimator, selection):
+    if n_clicks is None or not selection:
+        raise PreventUpdate
+
+    try:
+        tickers_instance = find_analysis(selection['period'], selection['interval'], selection['tickers'])
+        if tickers_instance is None:
+            return html.Div("Analysis expired, please run the analysis again.")
+
+        # Blank weights count as 0, the others are scaled to add up to 1
+        weights = {row['Ticker']: float(row['Weight (%)'] or 0) for row in weights_rows}
+        total_weight = sum(weights.values())
+        if total_weight <= 0:
+            return html.Div("The weights must add up to more than 0.")
+        weights = {ticker: weight / total_weight for ticker, weight in weights.items()}
+
+        # The covariance of the selection is computed on the first query only
+        risk_model = covariance_service.risk_model(tickers_instance, estimator)
+        portfolio = risk_model.portfolio(weights)
+
+        summary = f"Portfolio beta: {portfolio['beta']:.3f} - Annualized volatility: {portfolio['volatility'] * 100:.2f}%"
+        if risk_model.estimator == 'ledoit-wolf':
+            summary += f" - Shrinkage intensity: {risk_model.shrinkage:.3f}"
+
+        contributions = portfolio['contributions'].set_index('Ticker')
+        contributions['Weight'] = contributions['Weight'] * 100
+        contributions = contributions.rename(columns={'Weight': 'Weight (%)'}).round(3)
+
+        return html.Div([html.P(summary), create_data_table(contributions)])
+
+    except Exception as e:
+        return render_error(str(e), traceback.format_exc())
+
+def benchmark_grid_key(selection, benchmarks):
+    return (selection_key(selection), tuple(benchmarks))
+
+# Ticker x benchmark grid of a finished selection, run by a background job (benchmarks not in the price cache are downloaded)
+def compute_benchmark_grid(selection, benchmarks):
+    tickers_instance = find_analysis(selection['period'], selection['interval'], selection['tickers'])
+    if tickers_instance is None:
+        raise ValueError("Analysis expired, please run the analysis again.")
+
+    # Benchmark closes go through the shared price cache like the stocks
+    tickers_instance.index_processor.price_cache = price_cache
+    return tickers_instance.benchmark_grid_all(benchmarks)
+
+# One statistic of every ticker (rows) against each benchmark (columns)
+def render_benchmark_table(grid, benchmarks, statistic):
+    table = grid_pivot(grid, statistic).round(3)
+    missing = [benchmark for benchmark in benchmarks if benchmark not in table.columns]
+    children = [create_data_table(table)]
+    if missing:
+        children.insert(0, html.P(f"Could not download: {', '.join(missing)}"))
+    return html.Div(children)
+
+# Callback for the "Compare Benchmarks" button: serves a cached grid directly, otherwise starts a background job
+# The grid of all the selected benchmarks is computed in one pass, each benchmark is only downloaded once
+@app.callback(
+    [Output('benchmark-output', 'children'),
+     Output('benchmark-store', 'data'),
+     Output('benchmark-poll', 'disabled')],
+    [Input('benchmark-button', 'n_clicks')],
+    [State('benchmark-dropdown', 'value'),
+     State('benchmark-stat-radioitem', 'value'),
+     State('analysis-selection', 'data')],
+    prevent_initial_call=True
+)
+def update_benchmarks(n_clicks, benchmarks, statistic, selection):
+    if not selection:
+        raise PreventUpdate
+    if not benchmarks:
+        return html.Div("Select at least one benchmark."), None, True
+
+    try:
+        grid_key = benchmark_grid_key(selection, benchmarks)
+        grid = benchmark_grid_cache.get(grid_key)
+        if grid is not None:
+            return render_benchmark_table(grid, benchmarks, statistic), {'benchmarks': benchmarks}, True
+
+        # Same selection and benchmarks as a queued or running job: that job is shared
+        job = job_queue.submit(
+            ('benchmarks',) + grid_key,
+            lambda job: compute_benchmark_grid(selection, benchmarks),
+            on_done=lambda job: benchmark_grid_cache.put(grid_key, job.result)
+        )
+        return html.Div(f"Comparing against {len(benchmarks)} benchmarks..."), {'job_id': job.id, 'benchmarks': benchmarks}, False
+
+    except Exception as e:
+        return render_error(str(e), traceback.format_exc()), None, True
+
+# Polling the benchmark job: the table once the grid is ready (or the error)
+@app.callback(
+    [Output('benchmark-output', 'children', allow_duplicate=True),
+     Output('benchmark-poll', 'disabled', allow_duplicate=True)],
+    [Input('benchmark-poll', 'n_intervals')],
+    [State('benchmark-store', 'data'),
+     State('benchmark-stat-radioitem', 'value')],
+    prevent_initial_call=True
+)
+def poll_benchmarks(n_intervals, benchmark_data, statistic):
+    if not benchmark_data or 'job_id' not in benchmark_data:
+        raise PreventUpdate
+
+    job = job_queue.get(benchmark_data['job_id'])
+    if job is None:
+        return html.Div("Benchmark job expired, please compare the benchmarks again."), True
+
+    job_status = job.snapshot()
+    if job_status['status'] == 'done':
+        return render_benchmark_table(job.result, benchmark_data['benchmarks'], statistic), True
+    if job_status['status'] == 'error':
+        message, _, error_trace = job_status['error'].partition('\n')
+        return render_error(message, error_trace), True
+    return dash.no_update, False
+
+# Changing the displayed statistic re-pivots the grid of the last comparison, nothing is downloaded or recomputed
+@app.callback(
+    Output('benchmark-output', 'children', allow_duplicate=True),
+    [Input('benchmark-stat-radioitem', 'value')],
+    [State('benchmark-store', 'data'),
+     State('analysis-selection', 'data')],
+    prevent_initial_call=True
+)
+def update_benchmark_statistic(statistic, benchmark_data, selection):
+    if not benchmark_data or not selection:
+        raise PreventUpdate
+    grid = benchmark_grid_cache.get(benchmark_grid_key(selection, benchmark_data['benchmarks']))
+    if grid is None:
+        raise PreventUpdate
+    return render_benchmark_table(grid, benchmark_data['benchmarks'], statistic)
+
+# Paging, sorting and filtering of the results table: only the rows of the requested page are sent back
+@app.callback(
+    [Output('results-table', 'data'),
+     Output('results-table', 'page_count')],
+    [Input('results-table', 'page_current'),
+     Input('results-table', 'page_size'),
+     Input('results-table', 'sort_by'),
+     Input('results-table', 'filter_query')],
+    [State('analysis-selection', 'data')],
+    prevent_initial_call=True
+)
+def update_results_table(page_current, page_size, sort_by, filter_query, selection):
+    if not selection:
+        raise PreventUpdate
+
+    all_info = results_table_cache.get(selection_key(selection))
+    if all_info is None:
+        tickers_instance = find_analysis(selection['period'], selection['interval'], selection['tickers'])
+        if tickers_instance is None:
+            return [], 1
+        all_info = tickers_instance.all_info
+        results_table_cache.put(selection_key(selection), all_info)
+
+    rows = query_results(all_info.reset_index(), filter_query, sort_by)
+    page_current = page_current or 0
+    page_size = page_size or RESULTS_PAGE_SIZE
+    page = rows.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    return page.to_dict('records'), max(1, -(-len(rows) // page_size))
+
+# Stage timings, slowest tickers, network bytes, retries and cache hits of this process (Prometheus text format)
+@app.server.route('/metrics')
+def metrics_endpoint():
+    return Response(registry.prometheus_text(), mimetype='text/plain')
+
+# Same metrics as JSON
+@app.server.route('/metrics.json')
+def metrics_json_endpoint():
+    return Response(json.dumps(registry.snapshot(), default=str), mimetype='application/json')
 
 if __name__ == '__main__':
     app.run_server(debug=True)
-    print("Process finished --- %s seconds ---" % (time.time() - start_time))
\ No newline at end of file
+    print("Process finished --- %s seconds ---" % (time.time() - registry.started_at))
\ No newline at end of file
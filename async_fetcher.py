@@ -0,0 +1,144 @@
+#asyncio data acquisition: prices of many tickers fetched concurrently from the Yahoo chart API
+#Bounded by a semaphore, with a timeout on every request and cancellation of the pending ones on failure
+
+import asyncio
+import json
+import threading
+import time
+
+import aiohttp
+import pandas as pd
+
+from metrics import registry, timed
+
+#Base URL of the chart API, can point to a local fake quote server (GET {base_url}/{ticker}?range=...&interval=...)
+YAHOO_CHART_URL = "https://query2.finance.yahoo.com/v8/finance/chart"
+
+#Intraday intervals keep their timestamps, daily and longer bars are keyed on the session date (like yf.download)
+INTRADAY_SUFFIXES = ("m", "h")
+
+class AsyncQuoteFetcher():
+    def __init__(self, base_url=YAHOO_CHART_URL, max_concurrency=16, timeout_seconds=10, total_timeout_seconds=None):
+        self.base_url = base_url.rstrip("/")
+        #Maximum number of requests in flight at the same time
+        self.max_concurrency = max_concurrency
+        #Timeout of each request, a ticker that times out is reported as an error
+        self.timeout_seconds = timeout_seconds
+        #Optional timeout of a whole fetch_many call, every pending request is cancelled when it expires
+        self.total_timeout_seconds = total_timeout_seconds
+
+    def _params(self, period=None, start=None, interval="1mo"):
+        params = {"interval": interval, "includeAdjustedClose": "true", "events": "div,splits"}
+        if start is not None:
+            params["period1"] = int(pd.Timestamp(start).timestamp())
+            params["period2"] = int(time.time())
+        else:
+            params["range"] = period or "max"
+        return params
+
+    #Converting a chart API response into a frame with a Date index and the Close / Adj Close columns
+    @staticmethod
+    def parse_chart(payload, interval):
+        chart = payload.get("chart", {})
+        if chart.get("error"):
+            raise ValueError(chart["error"].get("description", chart["error"]))
+        results = chart.get("result") or []
+        if not results or not results[0].get("timestamp"):
+            raise ValueError("No data returned")
+
+        result = results[0]
+        indicators = result["indicators"]
+        close = indicators["quote"][0]["close"]
+        adjclose = indicators.get("adjclose", [{}])[0].get("adjclose", close)
+
+        dates = pd.to_datetime(result["timestamp"], unit="s", utc=True)
+        timezone = result.get("meta", {}).get("exchangeTimezoneName", "America/New_York")
+        dates = dates.tz_convert(timezone)
+        if not interval.endswith(INTRADAY_SUFFIXES):
+            dates = dates.tz_localize(None).normalize()
+
+        bars = pd.DataFrame({"Close": close, "Adj Close": adjclose}, index=dates, dtype=float)
+        bars = bars[~bars.index.duplicated(keep="last")].dropna(subset=["Close"])
+        bars.index.name = "Date"
+        return bars
+
+    async def fetch_bars(self, session, semaphore, ticker, period=None, start=None, interval="1mo"):
+        async with semaphore:
+            with timed("async_prices", ticker=ticker):
+                async with session.get(f"{self.base_url}/{ticker}", params=self._params(period, start, interval),
+                                       timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)) as response:
+                    body = await response.read()
+                    registry.increment("network_bytes", len(body), source="chart_api")
+                    payload = json.loads(body)
+                    if response.status != 200 and not payload.get("chart", {}).get("error"):
+                        response.raise_for_status()
+        return self.parse_chart(payload, interval)
+
+    #Same output as DataPreprocessor.download_bars: ({field: wide frame}, {ticker: error message})
+    async def fetch_many(self, tickers, fields=("Adj Close",), period=None, start=None, interval="1mo"):
+        tickers = list(dict.fromkeys(tickers))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        registry.increment("tickers_requested", len(tickers), source="chart_api")
+        async with aiohttp.ClientSession(headers={"User-Agent": "Mozilla/5.0"}) as session:
+            tasks = [asyncio.ensure_future(self.fetch_bars(session, semaphore, ticker, period, start, interval)) for ticker in tickers]
+            try:
+                await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), self.total_timeout_seconds)
+            except asyncio.TimeoutError:
+                #The tickers that did not finish in time are reported as cancelled below
+                pass
+            finally:
+                #Cancelling whatever is still pending (total timeout or the caller cancelled us)
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+
+        bars = {}
+        errors = {}
+        for ticker, task in zip(tickers, tasks):
+            if task.cancelled():
+                errors[ticker] = "Cancelled"
+            elif task.exception() is not None:
+                exception = task.exception()
+                errors[ticker] = "Timed out" if isinstance(exception, asyncio.TimeoutError) else repr(exception)
+            else:
+                bars[ticker] = task.result()
+
+        registry.increment("download_errors", len(errors), source="chart_api")
+
+        all_bars = {}
+        for field in fields:
+            if bars:
+                field_bars = pd.concat({ticker: ticker_bars[field] for ticker, ticker_bars in bars.items()}, axis=1, sort=True)
+            else:
+                field_bars = pd.DataFrame(columns=tickers, dtype=float)
+            field_bars.index.name = "Date"
+            all_bars[field] = field_bars
+
+        return all_bars, errors
+
+    #Sync facade with the signature of DataPreprocessor.download_bars, usable from blocking code (e.g. Dash callbacks)
+    def download_bars(self, tickers, fields=("Adj Close",), **download_kwargs):
+        return run_sync(self.fetch_many(tickers, fields, **download_kwargs))
+
+#Running a coroutine to completion from sync code, in a helper thread when this thread already runs an event loop
+def run_sync(coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+    def runner():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
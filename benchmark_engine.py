@@ -0,0 +1,98 @@
+#Multi-benchmark engine: betas and CAPM statistics of every ticker against several benchmarks (^GSPC, ^NDX, ^RUT, sector
+#ETFs) in one vectorized pass over a shared stock returns matrix
+#The regression sums of every (benchmark, ticker) pair are matrix products of the masked benchmark returns (T x K) with
+#the masked stock returns (T x N), so K benchmarks cost a handful of K x T x N products instead of K full runs
+
+import numpy as np
+import pandas as pd
+
+from beta_engine import beta_stats_from_sums, ticker_from_column
+from capm_engine import capm_stats_from_sums
+
+#Benchmarks offered by the dashboard: broad indices and the SPDR sector ETFs
+BENCHMARKS = {
+    "^GSPC": "S&P 500",
+    "^NDX": "Nasdaq 100",
+    "^RUT": "Russell 2000",
+    "XLK": "Technology",
+    "XLF": "Financials",
+    "XLV": "Health Care",
+    "XLE": "Energy",
+    "XLY": "Consumer Discretionary",
+    "XLP": "Consumer Staples",
+    "XLI": "Industrials",
+    "XLU": "Utilities",
+    "XLB": "Materials",
+    "XLRE": "Real Estate",
+    "XLC": "Communication Services",
+}
+
+DEFAULT_BENCHMARKS = ["^GSPC", "^NDX", "^RUT"]
+
+#Beta and CAPM statistics of every ticker against every benchmark: rms (T x K) benchmark returns, ri (T x N) stock returns,
+#rf (T) risk-free return of each bar, all on the same dates
+#Each pair uses the dates where both the benchmark and the ticker have a return (pairwise=False: only the dates where
+#every ticker has one), like beta_stats_arrays and capm_stats_arrays with that benchmark as the index
+#Returns one row per (benchmark, ticker) pair, benchmark-major, with the beta_stats and capm_stats columns
+def benchmark_grid_arrays(rms, ri, rf, tickers, benchmarks, interval, pairwise=True):
+    rms = np.asarray(rms, dtype=np.float64)
+    ri = np.asarray(ri, dtype=np.float64)
+    rf = np.asarray(rf, dtype=np.float64)
+
+    stock_valid = ~np.isnan(ri)
+    if not pairwise:
+        stock_valid &= stock_valid.all(axis=1, keepdims=True)
+    benchmark_valid = ~np.isnan(rms)
+
+    #Masked values: 0 where missing, so the products only add up the dates where both sides have a return
+    v = stock_valid.astype(np.float64)
+    y = np.where(stock_valid, ri, 0.0)
+    w = benchmark_valid.astype(np.float64)
+    x = np.where(benchmark_valid, rms, 0.0)
+    rf_column = rf[:, None]
+
+    #K x N sums over the dates of each pair
+    n = w.T @ v
+    sx = x.T @ v
+    sy = w.T @ y
+    sxx = (x * x).T @ v
+    syy = w.T @ (y * y)
+    sxy = x.T @ y
+    srf = w.T @ (v * rf_column)
+    syrf = w.T @ (y * rf_column)
+    srf2 = w.T @ (v * rf_column ** 2)
+
+    number_of_benchmarks, number_of_tickers = n.shape
+    pair_tickers = list(tickers) * number_of_benchmarks
+    beta_stats = beta_stats_from_sums(n.ravel(), sx.ravel(), sy.ravel(), sxx.ravel(), syy.ravel(), sxy.ravel(), pair_tickers)
+
+    #Mean benchmark and risk-free returns over each benchmark's own dates, the market side of the expected returns
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bars = w.sum(axis=0)
+        market_returns = x.sum(axis=0) / bars
+        risk_free_returns = (w * rf_column).sum(axis=0) / bars
+
+    #CAPM from the rounded betas, like the table of the single-index analysis
+    betas = np.round(beta_stats["Beta"].to_numpy(), decimals=3)
+    #Excess sums: (y - rf) and (x - rf) over the dates of each pair
+    capm_stats = capm_stats_from_sums(n.ravel(), (sy - srf).ravel(), (sx - srf).ravel(), (syy - 2 * syrf + srf2).ravel(), betas,
+                                      np.repeat(market_returns, number_of_tickers), np.repeat(risk_free_returns, number_of_tickers),
+                                      pair_tickers, interval)
+
+    grid = pd.concat([beta_stats, capm_stats.drop(columns="Ticker")], axis=1)
+    grid.insert(0, "Benchmark", np.repeat(list(benchmarks), number_of_tickers))
+    return grid
+
+#Same from a stock returns df ("<TICKER> Returns" columns) and a benchmark returns df ("<BENCHMARK> Returns" columns)
+#on the same dates
+def benchmark_grid(stock_returns, benchmark_returns, rf, interval, pairwise=True):
+    tickers = [ticker_from_column(column) for column in stock_returns.columns]
+    benchmarks = [ticker_from_column(column) for column in benchmark_returns.columns]
+    return benchmark_grid_arrays(benchmark_returns.to_numpy(dtype=np.float64), stock_returns.to_numpy(dtype=np.float64), rf,
+                                 tickers, benchmarks, interval, pairwise)
+
+#Wide view of a grid: one row per ticker, one column per benchmark, of the given statistic
+def grid_pivot(grid, column="Beta"):
+    benchmarks = list(dict.fromkeys(grid["Benchmark"]))
+    tickers = list(dict.fromkeys(grid["Ticker"]))
+    return grid.pivot(index="Ticker", columns="Benchmark", values=column).reindex(index=tickers, columns=benchmarks)
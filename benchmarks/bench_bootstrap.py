@@ -0,0 +1,55 @@
+#Benchmark of the bootstrap beta intervals: 500 tickers x 5000 resamples, in the calling process and on a process pool
+#The pool time includes spawning the workers and sending them the returns, at least 2 workers so the pool path always runs
+#Runs offline on synthetic returns, usage: python benchmarks/bench_bootstrap.py [--workers 4]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bootstrap_engine import BOOTSTRAP_RESAMPLES, PARALLEL_MIN_WORK, bootstrap_betas_arrays
+
+NUMBER_OF_TICKERS = 500
+#(label, number of bars): 1y monthly, 5y weekly, 5y daily, 20y daily
+WINDOWS = [("1y 1mo", 11), ("5y 1wk", 260), ("5y 1d", 1259), ("20y 1d", 5036)]
+
+def synthetic_returns(number_of_bars, number_of_tickers, seed=0):
+    rng = np.random.default_rng(seed)
+    rm = rng.normal(0.0003, 0.01, number_of_bars)
+    betas = rng.uniform(0.3, 1.8, number_of_tickers)
+    ri = rm[:, None] * betas + rng.normal(0, 0.02, (number_of_bars, number_of_tickers))
+    #Each ticker misses a random 2% of the bars
+    ri[rng.random(ri.shape) < 0.02] = np.nan
+    return rm, ri, betas
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the bootstrap beta intervals")
+    parser.add_argument("--workers", type=int, default=max(2, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    tickers = [f"T{i:04d}" for i in range(NUMBER_OF_TICKERS)]
+    workers = args.workers
+    print(f"{os.cpu_count()} CPUs, pool used from {PARALLEL_MIN_WORK:.0e} date x ticker x resample products")
+    print(f"{'window':>8} {'bars':>5} {'1 process s':>12} {f'{workers} workers s':>12} {'coverage':>9}")
+    for label, number_of_bars in WINDOWS:
+        rm, ri, betas = synthetic_returns(number_of_bars, NUMBER_OF_TICKERS)
+
+        start_time = time.perf_counter()
+        single = bootstrap_betas_arrays(rm, ri, tickers, BOOTSTRAP_RESAMPLES, workers=1)
+        single_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        pooled = bootstrap_betas_arrays(rm, ri, tickers, BOOTSTRAP_RESAMPLES, workers=workers)
+        pooled_time = time.perf_counter() - start_time
+
+        #The intervals only depend on the seed, not on the number of workers
+        assert single.equals(pooled)
+        coverage = np.mean((single["Beta CI Low"] <= betas) & (betas <= single["Beta CI High"]))
+        print(f"{label:>8} {number_of_bars:>5} {single_time:>12.3f} {pooled_time:>12.3f} {coverage:>8.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#Benchmark of the fundamentals fetch: old serial .info calls vs FundamentalsFetcher, against a fake .info with fixed latency
+#Usage: python benchmarks/bench_fundamentals.py [number_of_tickers] [latency_seconds]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fundamentals import FundamentalsFetcher
+
+#The serial baseline is measured on a sample and extrapolated, it would take minutes on the full universe
+SERIAL_SAMPLE = 20
+
+def fake_info(latency):
+    def info_getter(ticker):
+        time.sleep(latency)
+        return {"shortName": ticker, "sector": "Technology", "marketCap": 1.5e12, "beta": 1.2}
+    return info_getter
+
+#Old pattern: mcap_all called .info twice per ticker and run_all_analysis once more
+def serial_fetch(tickers, info_getter):
+    for ticker in tickers:
+        if info_getter(ticker).get("marketCap") is not None:
+            info_getter(ticker)
+        info_getter(ticker).get("beta")
+
+def main():
+    number_of_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    tickers = [f"T{i:04d}" for i in range(number_of_tickers)]
+    info_getter = fake_info(latency)
+
+    start_time = time.perf_counter()
+    serial_fetch(tickers[:SERIAL_SAMPLE], info_getter)
+    serial_time = (time.perf_counter() - start_time) * number_of_tickers / SERIAL_SAMPLE
+
+    fetcher = FundamentalsFetcher(info_getter=info_getter)
+    start_time = time.perf_counter()
+    fetcher.fetch(tickers)
+    fetcher_time = time.perf_counter() - start_time
+
+    print(f"{number_of_tickers} tickers, {latency * 1000:.0f} ms per .info call")
+    print(f"serial (extrapolated from {SERIAL_SAMPLE}): {serial_time:8.2f} s")
+    print(f"FundamentalsFetcher ({fetcher.max_workers} workers, {fetcher.calls_per_second}/s): {fetcher_time:8.2f} s")
+    print(f"speedup: {serial_time / fetcher_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
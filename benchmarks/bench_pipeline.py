@@ -0,0 +1,128 @@
+#Benchmark of the analysis pipeline on the offline synthetic data source (data_sources.SyntheticSource)
+#Times each stage (returns_all_tickers, beta_calc_all, capm_all, mcap_all) and the end-to-end run for every size and interval
+#Results are appended to benchmarks/results/pipeline.jsonl (local to the machine, not tracked), each case is compared with its previous run
+#on that machine to spot regressions
+#Usage: python benchmarks/bench_pipeline.py [--sizes 30 100 500 2000] [--intervals 1d 1wk 1mo] [--latency 0.05] [--no-save]
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from data_sources import SyntheticSource, synthetic_tickers
+from fundamentals import FundamentalsFetcher
+from tickers_analysis import analyzer
+
+TICKER_COUNTS = [30, 100, 500, 2000]
+INTERVALS = ["1d", "1wk", "1mo"]
+STAGES = ["returns_all_tickers", "beta_calc_all", "capm_all", "mcap_all"]
+RESULTS_FILE = os.path.join(REPO_DIR, "benchmarks", "results", "pipeline.jsonl")
+
+#A run more than this much slower than the previous one of the same case is flagged
+REGRESSION_THRESHOLD = 1.25
+
+def make_analyzer(source, period, interval, tickers):
+    tickers_instance = analyzer()
+    tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = len(tickers)
+    tickers_instance.period = tickers_instance.index_processor.period = period
+    tickers_instance.interval = tickers_instance.index_processor.interval = interval
+    tickers_instance.index_processor.data_source = source
+    tickers_instance.fundamentals_fetcher = FundamentalsFetcher(info_getter=source.info, calls_per_second=None)
+    return tickers_instance
+
+#Seconds of each stage, then of the whole pipeline on a fresh analyzer (fundamentals are fetched again)
+def run_case(source, period, interval, tickers):
+    metrics.registry.reset()
+    tickers_instance = make_analyzer(source, period, interval, tickers)
+    tickers_instance.returns_all_tickers(tickers)
+    tickers_instance.beta_calc_all()
+    tickers_instance.capm_all()
+    tickers_instance.mcap_all()
+    seconds = {stage: metrics.registry.timings[stage]["total_seconds"] for stage in STAGES}
+
+    tickers_instance = make_analyzer(source, period, interval, tickers)
+    start_time = time.perf_counter()
+    tickers_instance.returns_all_tickers(tickers)
+    tickers_instance.run_all_analysis()
+    seconds["end_to_end"] = time.perf_counter() - start_time
+
+    return seconds, tickers_instance.returns_data.shape
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#Latest saved result of every case, {(tickers, interval, period, latency): result}
+def previous_results(path):
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                result = json.loads(line)
+                previous[(result["tickers"], result["interval"], result["period"], result["latency_seconds"])] = result
+    return previous
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the analysis pipeline on synthetic prices")
+    parser.add_argument("--sizes", type=int, nargs="+", default=TICKER_COUNTS)
+    parser.add_argument("--intervals", nargs="+", default=INTERVALS)
+    parser.add_argument("--period", default="5y")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each case, the median is kept")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per price request")
+    parser.add_argument("--missing", type=float, default=0.01, help="Share of missing daily bars")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    metrics.PRINT_TIMINGS = False
+    source = SyntheticSource(missing_fraction=args.missing, short_history_fraction=0.05, failure_fraction=0.01,
+                             latency_seconds=args.latency)
+    previous = previous_results(args.output)
+    run_info = {"commit": git_commit(), "run_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                "numpy": np.__version__, "pandas": pd.__version__, "machine": platform.machine()}
+
+    columns = STAGES + ["end_to_end"]
+    print(f"{'tickers':>8} {'interval':>8} {'bars':>6} " + " ".join(f"{column:>20}" for column in columns) + f" {'vs previous':>12}")
+
+    results = []
+    for number_of_tickers in args.sizes:
+        tickers = synthetic_tickers(number_of_tickers)
+        for interval in args.intervals:
+            runs = [run_case(source, args.period, interval, tickers) for _ in range(args.repeat)]
+            seconds = {column: statistics.median(run[0][column] for run in runs) for column in columns}
+            shape = runs[0][1]
+
+            result = {**run_info, "tickers": number_of_tickers, "interval": interval, "period": args.period,
+                      "latency_seconds": args.latency, "bars": shape[0], "seconds": seconds}
+            results.append(result)
+
+            comparison = ""
+            before = previous.get((number_of_tickers, interval, args.period, args.latency))
+            if before is not None:
+                ratio = seconds["end_to_end"] / before["seconds"]["end_to_end"]
+                comparison = f"{ratio:.2f}x" + (" REGRESSION" if ratio > REGRESSION_THRESHOLD else "")
+
+            print(f"{number_of_tickers:>8} {interval:>8} {shape[0]:>6} " + " ".join(f"{seconds[column]:>20.4f}" for column in columns) + f" {comparison:>12}")
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "a") as results_file:
+            for result in results:
+                results_file.write(json.dumps(result) + "\n")
+        print(f"Saved {len(results)} results to {args.output}")
+
+if __name__ == "__main__":
+    main()
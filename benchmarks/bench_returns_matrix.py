@@ -0,0 +1,65 @@
+#Benchmark of the returns matrix build: old per-ticker pd.merge loop vs build_returns_matrix (time and peak traced memory)
+#Runs offline on synthetic 20y daily returns, usage: python benchmarks/bench_returns_matrix.py
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tickers_analysis import build_returns_matrix
+
+TICKER_COUNTS = [30, 100, 250, 500]
+NUMBER_OF_BARS = 252 * 20
+INDEX_NAME = "^GSPC"
+
+def synthetic_returns(number_of_tickers, number_of_bars, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2005-01-03", periods=number_of_bars, name="Date")
+    index_returns = pd.Series(rng.normal(0.0003, 0.01, number_of_bars), index=dates, name=f"{INDEX_NAME} Returns")
+
+    stock_returns = {}
+    for i in range(number_of_tickers):
+        #Each ticker misses a random 1% of the dates, like a real universe with halts and late listings
+        keep = rng.random(number_of_bars) > 0.01
+        stock_returns[f"T{i:04d}"] = pd.Series(rng.normal(0.0004, 0.02, keep.sum()), index=dates[keep])
+
+    return index_returns, stock_returns
+
+#The accumulation used before build_returns_matrix, kept here as the baseline
+def merge_loop(index_returns, stock_returns):
+    returns_all_tickers = index_returns.reset_index()
+    for ticker, returns in stock_returns.items():
+        stock_df = returns.rename(f"{ticker} Returns").rename_axis("Date").reset_index()
+        returns_all_tickers = pd.merge(returns_all_tickers, stock_df, on="Date", how="left")
+    return returns_all_tickers.set_index("Date")
+
+def measure(function, *args):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    print(f"{'tickers':>8} {'merge s':>9} {'merge MB':>9} {'aligned s':>9} {'aligned MB':>10} {'speedup':>8}")
+    for number_of_tickers in TICKER_COUNTS:
+        index_returns, stock_returns = synthetic_returns(number_of_tickers, NUMBER_OF_BARS)
+
+        merged, merge_time, merge_peak = measure(merge_loop, index_returns, stock_returns)
+        built, build_time, build_peak = measure(build_returns_matrix, index_returns, stock_returns)
+
+        #Both builds must give the same matrix
+        pd.testing.assert_frame_equal(merged, built, check_freq=False)
+
+        print(f"{number_of_tickers:>8} {merge_time:>9.3f} {merge_peak / 1e6:>9.1f} "
+              f"{build_time:>9.3f} {build_peak / 1e6:>10.1f} {merge_time / build_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
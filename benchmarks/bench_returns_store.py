@@ -0,0 +1,60 @@
+#Benchmark of the compact ReturnsStore vs the returns DataFrame: memory footprint and beta_stats time
+#Runs offline on synthetic 20y daily returns, usage: python benchmarks/bench_returns_store.py
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beta_engine import beta_stats
+from returns_store import ReturnsStore
+
+TICKER_COUNTS = [500, 2000]
+NUMBER_OF_BARS = 252 * 20
+INDEX_NAME = "^GSPC"
+
+def synthetic_returns_data(number_of_tickers, number_of_bars, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(0.0004, 0.02, (number_of_bars, number_of_tickers + 1))
+    #Late listings: each ticker starts at a random date
+    starts = rng.integers(0, number_of_bars // 2, number_of_tickers)
+    for j, start in enumerate(starts, start=1):
+        values[:start, j] = np.nan
+    dates = pd.bdate_range("2005-01-03", periods=number_of_bars, name="Date")
+    columns = [f"{INDEX_NAME} Returns"] + [f"T{i:04d} Returns" for i in range(number_of_tickers)]
+    return pd.DataFrame(values, index=dates, columns=columns)
+
+def frame_bytes(returns_data):
+    return int(returns_data.memory_usage(deep=True, index=True).sum()) + sum(sys.getsizeof(column) for column in returns_data.columns)
+
+def timed(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+def main():
+    index_column = f"{INDEX_NAME} Returns"
+    print(f"{'tickers':>8} {'frame MB':>9} {'f64 MB':>8} {'f32 MB':>8} {'saved f32':>10} {'beta frame s':>13} {'beta f32 s':>11} {'max |dβ| f32':>13}")
+    for number_of_tickers in TICKER_COUNTS:
+        returns_data = synthetic_returns_data(number_of_tickers, NUMBER_OF_BARS)
+
+        store_64 = ReturnsStore.from_frame(returns_data, INDEX_NAME)
+        store_32 = ReturnsStore.from_frame(returns_data, INDEX_NAME, dtype=np.float32)
+
+        #The float64 round trip must be lossless
+        pd.testing.assert_frame_equal(store_64.to_frame(), returns_data, check_freq=False)
+
+        betas_frame, frame_time = timed(beta_stats, returns_data, index_column)
+        betas_32, store_time = timed(beta_stats, store_32, index_column)
+        beta_error = np.nanmax(np.abs(betas_frame["Beta"].to_numpy() - betas_32["Beta"].to_numpy()))
+
+        data_bytes = frame_bytes(returns_data)
+        print(f"{number_of_tickers:>8} {data_bytes / 1e6:>9.1f} {store_64.nbytes / 1e6:>8.1f} {store_32.nbytes / 1e6:>8.1f} "
+              f"{1 - store_32.nbytes / data_bytes:>9.0%} {frame_time:>13.3f} {store_time:>11.3f} {beta_error:>13.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#Benchmark of the dashboard cold start: time to import app.py (layout built, tickers loaded) in a fresh interpreter
+#Also reports what the startup no longer pays for: the yfinance import and a pd.read_html parse of the constituents
+#Usage: python benchmarks/bench_startup.py [runs]
+
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Runs a snippet in a fresh interpreter and returns its wall time in seconds, measured inside the process
+def timed_run(snippet):
+    code = f"import time\nstart_time = time.perf_counter()\n{snippet}\nprint(time.perf_counter() - start_time)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def median_time(snippet, runs):
+    return statistics.median(timed_run(snippet) for _ in range(runs))
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    cases = [
+        ("import app", "import app\nimport sys\nassert 'yfinance' not in sys.modules"),
+        ("universe.ticker_options()", "import universe\nuniverse.ticker_options()"),
+        ("import yfinance (deferred)", "import yfinance"),
+        ("pd.read_html constituents (removed)",
+         "import json, pandas as pd\n"
+         "rows = ''.join(f'<tr><td>{item[\"value\"]}</td></tr>' for item in json.load(open('data/sp500_tickers.json')))\n"
+         "pd.read_html(f'<table><tr><th>Symbol</th></tr>{rows}</table>')"),
+    ]
+
+    print(f"median of {runs} fresh interpreters")
+    for name, snippet in cases:
+        print(f"{name:<38} {median_time(snippet, runs) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
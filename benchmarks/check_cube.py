@@ -0,0 +1,75 @@
+#Consistency check of the combination cube: every (period, interval) of run_all_combinations must give the same betas,
+#observations, expected returns and CAPM ratios as run_all_analysis run on its own for that period and interval
+#Runs offline on the synthetic data source ending today, usage: python benchmarks/check_cube.py [--tickers 40]
+
+import argparse
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+
+import metrics
+from data_preprocessing import INTERVALS, PERIODS
+from data_sources import SyntheticSource, synthetic_tickers
+from fundamentals import FundamentalsFetcher
+from tickers_analysis import analyzer
+
+def make_analyzer(source, period, interval, tickers):
+    tickers_instance = analyzer()
+    tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = len(tickers)
+    tickers_instance.period = tickers_instance.index_processor.period = period
+    tickers_instance.interval = tickers_instance.index_processor.interval = interval
+    tickers_instance.index_processor.data_source = source
+    tickers_instance.fundamentals_fetcher = FundamentalsFetcher(info_getter=source.info, calls_per_second=None)
+    return tickers_instance
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the combination cube against on-demand analyses")
+    parser.add_argument("--tickers", type=int, default=40)
+    args = parser.parse_args()
+
+    metrics.PRINT_TIMINGS = False
+    #Both paths count the periods back from today, so the synthetic data ends today
+    source = SyntheticSource(missing_fraction=0.02, short_history_fraction=0.1)
+    tickers = synthetic_tickers(args.tickers)
+
+    cube_analyzer = make_analyzer(source, PERIODS[0], INTERVALS[0], tickers)
+    cube = cube_analyzer.run_all_combinations(tickers, PERIODS, INTERVALS)
+
+    failures = []
+    print(f"{'period':>6} {'interval':>8} {'bars':>5} {'max beta diff':>14} {'max ratio diff':>15} {'observations':>13}")
+    for period in PERIODS:
+        for interval in INTERVALS:
+            tickers_instance = make_analyzer(source, period, interval, tickers)
+            tickers_instance.returns_all_tickers(tickers)
+            tickers_instance.run_all_analysis()
+            on_demand = tickers_instance.all_info
+            from_cube = cube_analyzer.all_info_from_cube(cube, period, interval).reindex(on_demand.index)
+
+            columns = [column for column in from_cube.columns if column in on_demand.columns]
+            differences = (from_cube[columns] - on_demand[columns]).abs()
+            beta_difference = np.nanmax(differences[f"Beta {period} {interval}"].to_numpy(), initial=0.0)
+            ratio_difference = np.nanmax(differences.drop(columns=f"Beta {period} {interval}").to_numpy(), initial=0.0)
+
+            selection = cube[(cube["Period"] == period) & (cube["Interval"] == interval)].set_index("Ticker")
+            cube_observations = selection["Observations"].reindex(tickers_instance.beta_stats["Ticker"]).to_numpy()
+            same_observations = np.array_equal(cube_observations, tickers_instance.beta_stats["Observations"].to_numpy())
+            same_missing = (from_cube[columns].isna() == on_demand[columns].isna()).all().all()
+
+            #Rounded to 3 decimals on both sides, a difference of one rounding step is allowed
+            ok = same_observations and same_missing and beta_difference <= 1e-3 + 1e-9 and ratio_difference <= 1e-3 + 1e-9
+            if not ok:
+                failures.append((period, interval))
+            print(f"{period:>6} {interval:>8} {len(tickers_instance.returns_data):>5} {beta_difference:>14.4f} "
+                  f"{ratio_difference:>15.4f} {'same' if same_observations else 'DIFFERENT':>13}{'' if ok else '  MISMATCH'}")
+
+    if failures:
+        print(f"{len(failures)} combinations differ: {', '.join(f'{period} {interval}' for period, interval in failures)}")
+        sys.exit(1)
+    print(f"All {len(PERIODS) * len(INTERVALS)} combinations match")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#Vectorized beta engine: betas, alphas, R² and standard errors of every ticker against the index in one matrix pass
+
+import numpy as np
+import pandas as pd
+
+#Column names of the returns df are in format "[TICKER] Returns"
+def ticker_from_column(column):
+    return column.replace(" Returns", "")
+
+#Splitting the returns df into the index vector (T) and the stock matrix (T x N)
+#A returns_store.ReturnsStore is read through zero-copy views instead
+def split_returns(returns_data, index_column):
+    if hasattr(returns_data, "split_returns"):
+        return returns_data.split_returns(index_column)
+    stock_columns = [column for column in returns_data.columns if column != index_column]
+    rm = returns_data[index_column].to_numpy(dtype=np.float64)
+    ri = returns_data[stock_columns].to_numpy(dtype=np.float64)
+    return rm, ri, stock_columns
+
+#Values where valid, 0 elsewhere, always in float64 (float32 stores are upcast here)
+def _masked(valid, values):
+    return np.where(valid, values, 0.0).astype(np.float64, copy=False)
+
+#OLS of each stock column on the index column: ri = alpha + beta * rm + e
+#pairwise=True uses, for each ticker, every date where both the ticker and the index have a return
+#pairwise=False only keeps the dates where every column has a return (listwise complete)
+def beta_stats(returns_data, index_column, pairwise=True):
+    rm, ri, stock_columns = split_returns(returns_data, index_column)
+    return beta_stats_arrays(rm, ri, [ticker_from_column(column) for column in stock_columns], pairwise)
+
+#Same regression on arrays: rm (T) index returns, ri (T x N) stock returns, one ticker name per column of ri
+def beta_stats_arrays(rm, ri, tickers, pairwise=True):
+    #valid[t, j] is True when both the index and ticker j have a return at date t
+    valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+    if not pairwise:
+        valid &= valid.all(axis=1, keepdims=True)
+
+    weights = valid.astype(np.float64)
+    x = _masked(valid, rm[:, None])
+    y = _masked(valid, ri)
+
+    n = weights.sum(axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #Means over each ticker's own observations
+        mean_x = x.sum(axis=0) / n
+        mean_y = y.sum(axis=0) / n
+
+        #Centering before the cross-products keeps the sums numerically stable
+        xc = (x - mean_x) * weights
+        yc = (y - mean_y) * weights
+
+        sxx = np.einsum("ij,ij->j", xc, xc)
+        syy = np.einsum("ij,ij->j", yc, yc)
+        sxy = np.einsum("ij,ij->j", xc, yc)
+
+        #Covariance and variance share the same normalisation, so it cancels out of the beta
+        beta = sxy / sxx
+        alpha = mean_y - beta * mean_x
+        r_squared = sxy ** 2 / (sxx * syy)
+
+        residual_variance = (syy - beta * sxy) / (n - 2)
+        std_error = np.sqrt(np.clip(residual_variance, 0.0, None) / sxx)
+
+    #A regression needs at least 2 observations, its standard error needs 3
+    beta[n < 2] = np.nan
+    alpha[n < 2] = np.nan
+    r_squared[n < 2] = np.nan
+    std_error[n < 3] = np.nan
+
+    return pd.DataFrame({
+        "Ticker": list(tickers),
+        "Beta": beta,
+        "Alpha": alpha,
+        "R Squared": r_squared,
+        "Beta Std Error": std_error,
+        "Observations": n.astype(int),
+    })
+
+#Same regression output as beta_stats_arrays from each ticker's raw sums over its observations
+#(n, sums of x and y, of their squares and of their products), as kept bar by bar by incremental_state.py
+def beta_stats_from_sums(n, sx, sy, sxx, syy, sxy, tickers):
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #Centered cross-products
+        sxx_c = sxx - sx * sx / n
+        syy_c = syy - sy * sy / n
+        sxy_c = sxy - sx * sy / n
+
+        beta = sxy_c / sxx_c
+        alpha = (sy - beta * sx) / n
+        r_squared = sxy_c ** 2 / (sxx_c * syy_c)
+
+        residual_variance = (syy_c - beta * sxy_c) / (n - 2)
+        std_error = np.sqrt(np.clip(residual_variance, 0.0, None) / sxx_c)
+
+    beta[n < 2] = np.nan
+    alpha[n < 2] = np.nan
+    r_squared[n < 2] = np.nan
+    std_error[n < 3] = np.nan
+
+    return pd.DataFrame({
+        "Ticker": list(tickers),
+        "Beta": beta,
+        "Alpha": alpha,
+        "R Squared": r_squared,
+        "Beta Std Error": std_error,
+        "Observations": n.astype(int),
+    })
+
+#Window sums of a (T x N) matrix from its running (cumulative) sums: each step adds the new bar and drops the oldest
+#window=None gives expanding sums
+def _window_sums(values, window):
+    running = np.cumsum(values, axis=0)
+    if window is None or window >= len(values):
+        return running
+    sums = running.copy()
+    sums[window:] -= running[:-window]
+    return sums
+
+#Beta time series of every ticker over a rolling window of `window` bars (window=None for an expanding window)
+#Cross-moments are kept as running sums, so each new bar costs O(N) and the whole run O(T·N)
+def rolling_betas(returns_data, index_column, window=None, min_periods=None):
+    rm, ri, stock_columns = split_returns(returns_data, index_column)
+    if min_periods is None:
+        min_periods = window if window is not None else 2
+
+    valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+    x = _masked(valid, rm[:, None])
+    y = _masked(valid, ri)
+
+    n = _window_sums(valid.astype(np.float64), window)
+    sx = _window_sums(x, window)
+    sy = _window_sums(y, window)
+    sxx = _window_sums(x * x, window)
+    sxy = _window_sums(x * y, window)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = (sxy - sx * sy / n) / (sxx - sx * sx / n)
+    beta[n < max(min_periods, 2)] = np.nan
+
+    return pd.DataFrame(beta, index=returns_data.index, columns=[ticker_from_column(column) for column in stock_columns])
+
+#EWMA-weighted beta time series: older bars decay with the given half-life (in bars)
+#Same running cross-moments as rolling_betas, decayed by a constant factor at every bar
+def ewma_betas(returns_data, index_column, halflife, min_periods=2):
+    rm, ri, stock_columns = split_returns(returns_data, index_column)
+    decay = 0.5 ** (1.0 / halflife)
+
+    valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+    weights = valid.astype(np.float64)
+    x = _masked(valid, rm[:, None])
+    y = _masked(valid, ri)
+
+    number_of_tickers = ri.shape[1]
+    w = np.zeros(number_of_tickers)
+    sx = np.zeros(number_of_tickers)
+    sy = np.zeros(number_of_tickers)
+    sxx = np.zeros(number_of_tickers)
+    sxy = np.zeros(number_of_tickers)
+
+    beta = np.full(ri.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for t in range(len(rm)):
+            w = decay * w + weights[t]
+            sx = decay * sx + x[t]
+            sy = decay * sy + y[t]
+            sxx = decay * sxx + x[t] * x[t]
+            sxy = decay * sxy + x[t] * y[t]
+            beta[t] = (sxy - sx * sy / w) / (sxx - sx * sx / w)
+    beta[np.cumsum(weights, axis=0) < max(min_periods, 2)] = np.nan
+
+    return pd.DataFrame(beta, index=returns_data.index, columns=[ticker_from_column(column) for column in stock_columns])
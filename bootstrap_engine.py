@@ -0,0 +1,152 @@
+#Bootstrap confidence intervals of the betas of every ticker: the dates are resampled in moving blocks (so the serial
+#correlation of the returns is kept inside each block) and thousands of resamples are regressed at once
+#A resample is a vector of counts (how many times each date is drawn), so the sums of the regressions of a whole batch of
+#resamples are matrix products: counts (B x T) @ masked returns (T x N) gives the B x N sums in one BLAS call
+#Batches of resamples are spread over a process pool, each batch has its own seed drawn from the run seed, so the intervals
+#only depend on the seed (not on the number of workers)
+#The pool is started for one run: the returns are sent once to each worker (initializer), then only seeds travel
+#Its workers are spawned, which re-imports the __main__ module of the caller, so a long-lived server (the dashboard) runs
+#the bootstrap in its own background job with workers=1 instead
+
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from beta_engine import _masked, beta_stats_arrays, split_returns, ticker_from_column
+
+BOOTSTRAP_RESAMPLES = 5000
+BOOTSTRAP_CONFIDENCE = 0.95
+
+#Resamples per batch (one task of the pool), the B x N sums of a batch stay small whatever the number of dates
+BOOTSTRAP_BATCH_SIZE = 250
+
+#Below this many date x ticker x resample products the batches run in the calling process, a pool would cost more than it saves
+PARALLEL_MIN_WORK = 2e8
+
+#Default block length: T^(1/3) dates (at least 1), the usual rate for a moving block bootstrap
+def default_block_length(number_of_dates):
+    return max(1, int(round(number_of_dates ** (1 / 3))))
+
+#Counts (resamples x T) of a moving block bootstrap: each resample is made of blocks of block_length consecutive dates
+#starting at random dates (wrapping around the end), cut to T dates
+def block_bootstrap_counts(rng, number_of_dates, resamples, block_length=1):
+    blocks_per_resample = -(-number_of_dates // block_length)
+    starts = rng.integers(0, number_of_dates, size=(resamples, blocks_per_resample))
+    rows = (starts[:, :, None] + np.arange(block_length)) % number_of_dates
+    rows = rows.reshape(resamples, -1)[:, :number_of_dates]
+
+    #Row t of resample b lands in bin b * T + t
+    bins = (rows + np.arange(resamples)[:, None] * number_of_dates).ravel()
+    counts = np.bincount(bins, minlength=resamples * number_of_dates)
+    return counts.reshape(resamples, number_of_dates).astype(np.float64)
+
+#Masked regression terms (T x N) of every date, shared by all the batches of a run: validity, x, y, x² and xy
+def _regression_terms(rm, ri, pairwise=True):
+    valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+    if not pairwise:
+        valid &= valid.all(axis=1, keepdims=True)
+    x = _masked(valid, rm[:, None])
+    y = _masked(valid, ri)
+    return valid.astype(np.float64), x, y, x * x, x * y
+
+#Betas (resamples x N) of one batch of resamples, seed is a np.random.SeedSequence
+def _bootstrap_batch(terms, seed, resamples, block_length):
+    valid, x, y, xx, xy = terms
+    counts = block_bootstrap_counts(np.random.default_rng(seed), len(valid), resamples, block_length)
+
+    n = counts @ valid
+    sx = counts @ x
+    sy = counts @ y
+    sxx = counts @ xx
+    sxy = counts @ xy
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sxx_c = sxx - sx * sx / n
+        betas = (sxy - sx * sy / n) / sxx_c
+    #A resample that drew fewer than 2 distinct index returns for a ticker has no beta
+    betas[(n < 2) | ~(np.abs(sxx_c) > 1e-12 * np.abs(sxx))] = np.nan
+    return betas
+
+#Regression terms of the run in a pool worker, computed once by the initializer from the returns sent with it
+_worker_terms = None
+
+def _init_worker(rm, ri, pairwise):
+    global _worker_terms
+    _worker_terms = _regression_terms(rm, ri, pairwise)
+
+def _worker_batch(seed, resamples, block_length):
+    return _bootstrap_batch(_worker_terms, seed, resamples, block_length)
+
+#Quantiles of each column of a (resamples x N) matrix over its non-NaN values (linear interpolation, like np.nanquantile)
+#Sorting once puts the NaNs at the bottom of each column, so every column is read with its own count of values
+def _column_quantiles(values, quantiles):
+    values = np.sort(values, axis=0)
+    counts = (~np.isnan(values)).sum(axis=0)
+    columns = np.arange(values.shape[1])
+
+    results = []
+    for quantile in quantiles:
+        position = quantile * np.clip(counts - 1, 0, None)
+        below = np.floor(position).astype(int)
+        above = np.minimum(below + 1, np.clip(counts - 1, 0, None))
+        fraction = position - below
+        result = values[below, columns] * (1 - fraction) + values[above, columns] * fraction
+        result[counts == 0] = np.nan
+        results.append(result)
+    return results
+
+#Bootstrap of the betas of every ticker: rm (T) index returns, ri (T x N) stock returns, one ticker name per column of ri
+#Returns the betas of the full sample with the lower and upper bounds of the percentile interval at the given confidence
+#and the standard deviation of the resampled betas
+#workers: processes of the pool (None: one per CPU, 1: no pool), block_length=None uses default_block_length
+def bootstrap_betas_arrays(rm, ri, tickers, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE, block_length=None,
+                           seed=0, workers=None, pairwise=True):
+    rm = np.asarray(rm, dtype=np.float64)
+    ri = np.asarray(ri, dtype=np.float64)
+    if block_length is None:
+        block_length = default_block_length(len(rm))
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {confidence}")
+
+    batch_sizes = [min(BOOTSTRAP_BATCH_SIZE, resamples - start) for start in range(0, resamples, BOOTSTRAP_BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    workers = min(workers or os.cpu_count() or 1, len(batch_sizes))
+    if workers > 1 and len(rm) * ri.shape[1] * resamples >= PARALLEL_MIN_WORK:
+        #Spawned workers: forking a multithreaded process can deadlock the children
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(rm, ri, pairwise)) as executor:
+            futures = [executor.submit(_worker_batch, batch_seed, batch_size, block_length)
+                       for batch_seed, batch_size in zip(seeds, batch_sizes)]
+            batches = [future.result() for future in futures]
+    else:
+        terms = _regression_terms(rm, ri, pairwise)
+        batches = [_bootstrap_batch(terms, batch_seed, batch_size, block_length) for batch_seed, batch_size in zip(seeds, batch_sizes)]
+
+    betas = np.vstack(batches) if batches else np.empty((0, ri.shape[1]))
+    tail = (1 - confidence) / 2
+    lower, upper = _column_quantiles(betas, [tail, 1 - tail])
+    #Tickers without any resampled beta get NaN (numpy warns about the empty columns)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        std_error = np.nanstd(betas, axis=0, ddof=1)
+
+    point_estimates = beta_stats_arrays(rm, ri, tickers, pairwise=pairwise)
+    return pd.DataFrame({
+        "Ticker": list(tickers),
+        "Beta": point_estimates["Beta"].to_numpy(),
+        "Beta CI Low": lower,
+        "Beta CI High": upper,
+        "Bootstrap Std Error": std_error,
+    })
+
+#Same from a returns df (index column first, then "<TICKER> Returns" columns) or a ReturnsStore
+def bootstrap_betas(returns_data, index_column, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE,
+                    block_length=None, seed=0, workers=None, pairwise=True):
+    rm, ri, stock_columns = split_returns(returns_data, index_column)
+    return bootstrap_betas_arrays(rm, ri, [ticker_from_column(column) for column in stock_columns], resamples, confidence,
+                                  block_length, seed, workers, pairwise)
@@ -0,0 +1,104 @@
+#Vectorized CAPM engine: expected returns on the security market line, Jensen's alpha, Treynor and Sharpe ratios
+#of every ticker in array operations, against a constant risk-free rate or a risk-free series aligned on the returns dates
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import BARS_PER_YEAR
+
+#Default annual risk-free rate, around the 5 year treasury yield (^FVX)
+RISK_FREE_RATE = 0.042
+
+#Yahoo tickers of treasury yields (quoted in % per year): 13 week bill, 5 year and 10 year notes
+RISK_FREE_TICKERS = ["^IRX", "^FVX", "^TNX"]
+
+#Columns of capm_stats besides Ticker, the CAPM expectation is shown per month whatever the interval of the bars
+EXPECTED_RETURN_COLUMN = "Expected Monthly Returns (%)"
+RATIO_COLUMNS = ["Jensen's Alpha (% per year)", "Treynor Ratio", "Sharpe Ratio"]
+
+#Annual yields of a treasury ticker (e.g. ^IRX) as a Series of rates keyed on date, through a DataPreprocessor
+#so the price cache and the data source are used like for any other ticker
+def load_risk_free_rates(processor, ticker="^IRX"):
+    saved_interval = processor.interval
+    processor.interval = "1d"
+    try:
+        yields = processor.single_closes(ticker)
+    finally:
+        processor.interval = saved_interval
+    return (yields.dropna() / 100).rename(ticker)
+
+#Risk-free return of each bar (array aligned on dates) from an annual rate: a constant or a Series keyed on date
+#The rate earned over a bar is the one known at the start of the bar (the last yield dated before the bar), so a window
+#gets the same rates as the longer history it is cut from
+def risk_free_per_bar(risk_free, dates, interval):
+    bars_per_year = BARS_PER_YEAR.get(interval, 12)
+
+    if np.isscalar(risk_free):
+        annual_rates = np.full(len(dates), float(risk_free))
+    else:
+        rates = risk_free.dropna().sort_index()
+        if not len(rates):
+            raise ValueError("The risk-free series does not cover the returns dates")
+        previous_rows = rates.index.searchsorted(pd.DatetimeIndex(dates), side="left") - 1
+        #Bars before the first known yield use that first yield
+        annual_rates = rates.to_numpy(dtype=np.float64)[np.clip(previous_rows, 0, None)]
+
+    return (1 + annual_rates) ** (1 / bars_per_year) - 1
+
+#Expected monthly returns (in %) of an array of betas: E[ri] = rf + beta * (E[rm] - rf), from the mean per-bar returns of
+#the market and of the risk-free rate scaled to a month
+def expected_returns_from_means(betas, market_return, risk_free_return, interval):
+    bars_per_month = BARS_PER_YEAR.get(interval, 12) / 12
+    return (risk_free_return + np.asarray(betas) * (market_return - risk_free_return)) * bars_per_month * 100
+
+#CAPM statistics of every ticker: rm (T) index returns, ri (T x N) stock returns, rf (T) risk-free return of each bar
+#betas (N) are the betas of the table, the ratios are annualized for the interval of the bars
+#pairwise=True uses, for each ticker, every date where both the ticker and the index have a return
+def capm_stats_arrays(rm, ri, rf, betas, tickers, interval, pairwise=True):
+    valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+    if not pairwise:
+        valid &= valid.all(axis=1, keepdims=True)
+    weights = valid.astype(np.float64)
+    n = weights.sum(axis=0)
+
+    #Excess returns over the risk-free return of the same bar, 0 where not observed
+    market_excess = np.where(np.isnan(rm), 0.0, rm - rf)
+    stock_excess = np.where(valid, ri - rf[:, None], 0.0)
+
+    market_return = np.nanmean(rm)
+    risk_free_return = np.nanmean(np.where(np.isnan(rm), np.nan, rf))
+    return capm_stats_from_sums(n, stock_excess.sum(axis=0), weights.T @ market_excess,
+                                np.einsum("ij,ij->j", stock_excess, stock_excess), betas, market_return, risk_free_return,
+                                tickers, interval)
+
+#CAPM statistics from each ticker's sums over its observations: n, sum of the stock excess returns, sum of the market
+#excess returns and sum of the squared stock excess returns, plus the mean market and risk-free returns of the period
+#(incremental_state.py keeps these sums up to date bar by bar)
+def capm_stats_from_sums(n, stock_excess_sum, market_excess_sum, stock_excess_squares, betas, market_return, risk_free_return,
+                         tickers, interval):
+    bars_per_year = BARS_PER_YEAR.get(interval, 12)
+    betas = np.asarray(betas, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #Mean excess returns over each ticker's own observations
+        mean_stock_excess = stock_excess_sum / n
+        mean_market_excess = market_excess_sum / n
+        stock_excess_std = np.sqrt((stock_excess_squares - n * mean_stock_excess ** 2) / (n - 1))
+
+        #Jensen's alpha: return above the one the CAPM predicts for the beta, per bar then per year
+        jensens_alpha = (mean_stock_excess - betas * mean_market_excess) * bars_per_year
+        #Excess return per unit of systematic risk (Treynor) and of total risk (Sharpe), per year
+        treynor_ratio = mean_stock_excess * bars_per_year / betas
+        sharpe_ratio = mean_stock_excess / stock_excess_std * np.sqrt(bars_per_year)
+
+    for ratio in (jensens_alpha, treynor_ratio, sharpe_ratio):
+        ratio[n < 2] = np.nan
+
+    return pd.DataFrame({
+        "Ticker": list(tickers),
+        EXPECTED_RETURN_COLUMN: expected_returns_from_means(betas, market_return, risk_free_return, interval),
+        RATIO_COLUMNS[0]: jensens_alpha * 100,
+        RATIO_COLUMNS[1]: treynor_ratio,
+        RATIO_COLUMNS[2]: sharpe_ratio,
+    })
@@ -0,0 +1,161 @@
+#Covariance engine: full N x N covariance of the stock returns (NaN-aware pairwise or Ledoit-Wolf shrinkage)
+#and portfolio risk queries (beta, volatility, marginal and total risk contributions) for any weights
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from beta_engine import beta_stats_arrays, split_returns, ticker_from_column
+from data_preprocessing import BARS_PER_YEAR
+from result_cache import ResultCache
+
+COVARIANCE_ESTIMATORS = ["pairwise", "ledoit-wolf"]
+
+#Returns centered on each column's own mean, 0 where missing, with the validity mask as float weights
+def _centered(values):
+    valid = ~np.isnan(values)
+    weights = valid.astype(np.float64)
+    with np.errstate(invalid="ignore"):
+        means = np.where(valid, values, 0.0).sum(axis=0) / weights.sum(axis=0)
+    return np.where(valid, values - means, 0.0), weights
+
+#Covariance of every pair of columns of a (T x N) matrix over the dates where both have a value
+#Pair counts and sums come from matrix products of the masked values, so the whole matrix costs a few T·N² products
+def pairwise_covariance(values):
+    x, weights = _centered(np.asarray(values, dtype=np.float64))
+
+    n = weights.T @ weights
+    #sums[i, j]: sum of column i over the dates where column j has a value
+    sums = x.T @ weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = (x.T @ x - sums * sums.T / n) / (n - 1)
+    covariance[n < 2] = np.nan
+    return covariance
+
+#Ledoit-Wolf shrinkage of the pairwise covariance towards a scaled identity (average variance on the diagonal)
+#The shrinkage intensity is the Ledoit-Wolf (2004) estimate, computed on the centered returns with missing values at 0
+#Returns the shrunk matrix and the intensity (0: sample covariance, 1: scaled identity)
+def ledoit_wolf_covariance(values):
+    values = np.asarray(values, dtype=np.float64)
+    x, _ = _centered(values)
+    number_of_dates, number_of_columns = x.shape
+
+    sample = x.T @ x / number_of_dates
+    mu = np.trace(sample) / number_of_columns
+    squared = x * x
+    #Distance of the sample covariance to the target, and variance of the sample covariance entries
+    delta = (np.sum(sample ** 2) - 2 * mu * np.trace(sample) + number_of_columns * mu ** 2) / number_of_columns
+    beta = (np.sum(squared.T @ squared) / number_of_dates - np.sum(sample ** 2)) / (number_of_columns * number_of_dates)
+    shrinkage = 0.0 if delta == 0 else min(beta, delta) / delta
+
+    covariance = pairwise_covariance(values)
+    target = np.nanmean(np.diag(covariance)) * np.eye(number_of_columns)
+    return (1 - shrinkage) * covariance + shrinkage * target, shrinkage
+
+#Covariance matrix and index betas of a set of tickers, per bar of the interval
+class RiskModel():
+    def __init__(self, tickers, covariance, betas, interval, estimator="pairwise", shrinkage=0.0):
+        self.tickers = list(tickers)
+        self.positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.covariance = np.ascontiguousarray(covariance, dtype=np.float64)
+        self.betas = np.asarray(betas, dtype=np.float64)
+        self.interval = interval
+        self.estimator = estimator
+        self.shrinkage = shrinkage
+
+    #From a returns df (index column first, then "<TICKER> Returns" columns) or a ReturnsStore
+    @classmethod
+    def from_returns(cls, returns_data, index_column, interval, estimator="pairwise", pairwise=True):
+        rm, ri, stock_columns = split_returns(returns_data, index_column)
+        tickers = [ticker_from_column(column) for column in stock_columns]
+        ri = np.asarray(ri, dtype=np.float64)
+
+        if estimator == "pairwise":
+            covariance, shrinkage = pairwise_covariance(ri), 0.0
+        elif estimator == "ledoit-wolf":
+            covariance, shrinkage = ledoit_wolf_covariance(ri)
+        else:
+            raise ValueError(f"Unknown covariance estimator: {estimator}. Available: {', '.join(COVARIANCE_ESTIMATORS)}")
+
+        betas = beta_stats_arrays(rm, ri, tickers, pairwise=pairwise)["Beta"].to_numpy()
+        return cls(tickers, covariance, betas, interval, estimator, shrinkage)
+
+    #Covariance as a df, annualized for the interval of the bars
+    def covariance_frame(self, annualized=True):
+        scale = BARS_PER_YEAR.get(self.interval, 12) if annualized else 1
+        return pd.DataFrame(self.covariance * scale, index=self.tickers, columns=self.tickers)
+
+    def correlation_frame(self):
+        volatilities = np.sqrt(np.diag(self.covariance))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            correlation = self.covariance / np.outer(volatilities, volatilities)
+        return pd.DataFrame(correlation, index=self.tickers, columns=self.tickers)
+
+    #Risk of a portfolio: weights as {ticker: weight} (tickers left out weigh 0) or one weight per ticker of the model
+    #Returns the portfolio beta, its annualized volatility and, per ticker, the marginal contribution (d volatility / d weight),
+    #the contribution (weight x marginal, they add up to the volatility) and the share of the volatility
+    def portfolio(self, weights):
+        if isinstance(weights, dict):
+            unknown = [ticker for ticker in weights if ticker not in self.positions]
+            if unknown:
+                raise ValueError(f"No returns for {', '.join(unknown)}")
+            tickers = list(weights)
+            positions = [self.positions[ticker] for ticker in tickers]
+            w = np.array([weights[ticker] for ticker in tickers], dtype=np.float64)
+        else:
+            tickers = self.tickers
+            positions = list(range(len(tickers)))
+            w = np.asarray(weights, dtype=np.float64)
+            if len(w) != len(tickers):
+                raise ValueError(f"Expected {len(tickers)} weights, got {len(w)}")
+
+        #Only the rows and columns of the held tickers take part in the products
+        covariance = self.covariance[np.ix_(positions, positions)]
+        annualization = np.sqrt(BARS_PER_YEAR.get(self.interval, 12))
+
+        covariance_times_weights = covariance @ w
+        volatility = np.sqrt(max(w @ covariance_times_weights, 0.0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            marginal = covariance_times_weights / volatility
+
+        contributions = pd.DataFrame({
+            "Ticker": tickers,
+            "Weight": w,
+            "Beta": self.betas[positions],
+            "Marginal Risk Contribution": marginal * annualization,
+            "Risk Contribution": w * marginal * annualization,
+            "Risk Contribution (%)": w * marginal / volatility * 100 if volatility else np.nan,
+        })
+
+        return {
+            "beta": float(w @ self.betas[positions]),
+            "volatility": volatility * annualization,
+            "contributions": contributions,
+        }
+
+#Risk models computed once per selection (tickers, period, interval, index, estimator) and reused by every portfolio query
+#Entries live in a ResultCache, so they expire at the next market close like the analyses
+class CovarianceService():
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else ResultCache(max_entries=16)
+        self._lock = threading.Lock()
+
+    #Risk model of the returns_data of an analyzer (see tickers_analysis.analyzer.risk_model_all)
+    def risk_model(self, tickers_instance, estimator="ledoit-wolf"):
+        returns_data = tickers_instance.returns_data
+        key = (tuple(returns_data.columns), tickers_instance.period, tickers_instance.interval,
+               tickers_instance.index_name, estimator, returns_data.index[-1] if len(returns_data) else None)
+
+        risk_model = self.cache.get(key)
+        if risk_model is None:
+            #Concurrent queries of the same selection compute it once
+            with self._lock:
+                risk_model = self.cache.get(key)
+                if risk_model is None:
+                    risk_model = tickers_instance.risk_model_all(estimator)
+                    self.cache.put(key, risk_model)
+        return risk_model
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,9 +1,43 @@
 import numpy as np
 import pandas as pd
-import yfinance as yf
-import time
 
-start_time = time.time()
+from metrics import registry, timed
+
+#Periods and intervals offered by the app
+PERIODS = ["1y", "2y", "3y", "5y", "10y", "20y"]
+INTERVALS = ["1d", "1wk", "1mo"]
+
+#Number of bars in one year for each interval offered by the app
+BARS_PER_YEAR = {"1d": 252, "1wk": 52, "1mo": 12}
+
+#pandas resample rules turning daily closes into the weekly/monthly bars of Yahoo (weeks start on Monday, months on the 1st)
+RESAMPLE_RULES = {"1wk": "W-MON", "1mo": "MS"}
+
+#Daily closes (Date index, one column per ticker) resampled to the bars of another interval, keyed on the bar start
+def resample_closes(closes, interval):
+    if interval == "1d":
+        return closes
+    return closes.resample(RESAMPLE_RULES[interval], label="left", closed="left").last()
+
+#Returns of a wide close frame in one pass, each close against the previous close of the same ticker
+#Same values as returns_from_closes column by column (a gap gives the return over the gap)
+def wide_returns(closes):
+    previous_closes = closes.ffill().shift(1)
+    return (closes / previous_closes - 1).where(closes.notna())
+
+#Result of a bulk download: one wide close-price frame plus the tickers that failed
+class BulkFetchResult():
+    def __init__(self, closes, errors=None):
+        #Date index, one column per ticker (the index ticker included)
+        self.closes = closes
+        #{ticker: error message} for every ticker that could not be downloaded
+        self.errors = errors if errors is not None else {}
+
+    def fetched_tickers(self):
+        return [ticker for ticker in self.closes.columns if ticker not in self.errors]
+
+    def failed_tickers(self):
+        return list(self.errors.keys())
 
 class DataPreprocessor():
     def __init__(self):
@@ -11,6 +45,24 @@ class DataPreprocessor():
         self.interval = "1mo"
         self.index_name = "^GSPC"
         self.number_of_tickers = 30
+        #Number of tickers requested per yf.download call in download_bars
+        self.chunk_size = 100
+        #Optional price_cache.PriceCache, when set prices are served from disk and only the missing tail is downloaded
+        self.price_cache = None
+        #Optional market data source used instead of yf.download (see data_sources.py), e.g. async_fetcher.AsyncQuoteFetcher
+        #to fetch every ticker concurrently with asyncio, or data_sources.SyntheticSource for offline runs and benchmarks
+        self.data_source = None
+        #Optional progress_callback(stage, done, total), called by download_bars as the chunks complete
+        self.progress_callback = None
+
+    #Former name of data_source, when the only alternative source was the asyncio fetcher
+    @property
+    def async_fetcher(self):
+        return self.data_source
+
+    @async_fetcher.setter
+    def async_fetcher(self, fetcher):
+        self.data_source = fetcher
 
     def period_selection(self, prompt="What period do you want to use? 1Y,2Y,3Y,4Y,5Y? (answer with integer) "):
         while True:
@@ -102,6 +154,11 @@ class DataPreprocessor():
     #Creating a df with the returns of the index
     #Doing the index_returnsdf is important because this will be the market used for the calculation of each beta
     def index_returnsdf(self):
+        if self.price_cache is not None or self.data_source is not None:
+            return self.returns_from_closes(self.single_closes(self.index_name), self.index_name)
+
+        #yfinance is imported when the first download happens, it is slow to import and not needed at startup
+        import yfinance as yf
     
         index_data = yf.Ticker(self.index_name)
         hist_index = pd.DataFrame(index_data.history(period = self.period,interval = self.interval))
@@ -119,6 +176,10 @@ class DataPreprocessor():
         return index_returns
 
     def stock_returnsdf(self, ticker):        
+        if self.price_cache is not None or self.data_source is not None:
+            return self.returns_from_closes(self.single_closes(ticker), ticker)
+
+        import yfinance as yf
         
         #fetching data using yahoo finance library
         stock_data = yf.Ticker(ticker)
@@ -136,6 +197,132 @@ class DataPreprocessor():
 
         return stock_returns
     
+    #Closes of one ticker through the price cache and/or the data source, ValueError when it cannot be downloaded
+    def single_closes(self, ticker):
+        bulk_closes = self.close_prices_bulk([ticker], include_index=False)
+        if ticker in bulk_closes.errors:
+            raise ValueError(f"Could not download {ticker}: {bulk_closes.errors[ticker]}")
+        return bulk_closes.closes[ticker]
+
+    #Downloading bars of many tickers in chunked batch requests, each chunk is a single yf.download call
+    #Returns ({field: wide frame with one column per ticker}, {ticker: error message})
+    #download_kwargs are passed to yf.download (period or start, interval), or to self.data_source when it is set
+    def download_bars(self, tickers, fields=("Adj Close",), **download_kwargs):
+        if self.data_source is not None:
+            all_bars, errors = self.data_source.download_bars(tickers, fields, **download_kwargs)
+            if self.progress_callback is not None:
+                self.progress_callback("prices", len(tickers), len(tickers))
+            return all_bars, errors
+
+        import yfinance as yf
+
+        tickers = list(dict.fromkeys(tickers))
+
+        chunks_bars = {field: [] for field in fields}
+        errors = {}
+
+        for start in range(0, len(tickers), self.chunk_size):
+            if self.progress_callback is not None:
+                self.progress_callback("prices", start, len(tickers))
+
+            chunk = tickers[start:start + self.chunk_size]
+            registry.increment("tickers_requested", len(chunk), source="yfinance")
+            try:
+                #auto_adjust=False so both the raw Close and the Adj Close (same as Ticker.history's Close) come back
+                with timed("download_chunk", quiet=True):
+                    hist = yf.download(chunk, auto_adjust=False, actions=False, threads=True,
+                                       group_by="column", progress=False, show_errors=False, **download_kwargs)
+            except Exception as e:
+                for ticker in chunk:
+                    errors[ticker] = repr(e)
+                continue
+
+            #yfinance keeps the per-ticker failures of the last download call in shared._ERRORS
+            chunk_errors = dict(getattr(yf.shared, "_ERRORS", {}))
+
+            if hist is None or len(hist) == 0:
+                for ticker in chunk:
+                    errors[ticker] = chunk_errors.get(ticker.upper(), "No data returned")
+                continue
+
+            for field in fields:
+                #A single ticker comes back with flat OHLC columns, several tickers with (field, ticker) columns
+                if isinstance(hist.columns, pd.MultiIndex):
+                    bars = hist[field]
+                else:
+                    bars = hist[[field]].rename(columns={field: chunk[0].upper()})
+
+                #yfinance upper-cases the tickers, mapping them back to the names we were given
+                bars = bars.rename(columns={ticker.upper(): ticker for ticker in chunk})
+                chunks_bars[field].append(bars.astype(float))
+
+            closes = chunks_bars[fields[0]][-1]
+            for ticker in chunk:
+                if ticker not in closes.columns or closes[ticker].isna().all():
+                    errors[ticker] = chunk_errors.get(ticker.upper(), "No data returned")
+
+        if self.progress_callback is not None:
+            self.progress_callback("prices", len(tickers), len(tickers))
+        registry.increment("download_errors", len(errors), source="yfinance")
+
+        all_bars = {}
+        for field in fields:
+            if chunks_bars[field]:
+                bars = pd.concat(chunks_bars[field], axis=1, sort=True)
+                #Keeping the requested order
+                bars = bars[[ticker for ticker in tickers if ticker in bars.columns]]
+            else:
+                bars = pd.DataFrame(columns=tickers, dtype=float)
+            bars.index.name = "Date"
+            all_bars[field] = bars
+
+        return all_bars, errors
+
+    #Getting the closes of the index and all the tickers as one wide frame
+    #Served from self.price_cache when it is set, otherwise downloaded in chunked batch requests
+    @timed("close_prices_bulk", quiet=True)
+    def close_prices_bulk(self, tickers, include_index=True):
+        #Index goes first so it is always part of the result, duplicates are dropped keeping the order
+        all_tickers = list(dict.fromkeys(([self.index_name] if include_index else []) + list(tickers)))
+
+        if self.price_cache is not None:
+            closes, errors = self.price_cache.closes(all_tickers, self.period, self.interval, self.download_bars)
+        else:
+            bars, errors = self.download_bars(all_tickers, period=self.period, interval=self.interval)
+            closes = bars["Adj Close"]
+
+        return BulkFetchResult(closes, errors)
+
+    #asyncio variants of index_returnsdf and stock_returnsdf, going through self.data_source, or an AsyncQuoteFetcher of the
+    #call when it is not set (self.data_source is left unset, so the sync downloads keep going through yf.download)
+    async def index_returnsdf_async(self):
+        return await self.stock_returnsdf_async(self.index_name)
+
+    async def stock_returnsdf_async(self, ticker):
+        fetcher = self.data_source
+        if fetcher is None:
+            from async_fetcher import AsyncQuoteFetcher
+            fetcher = AsyncQuoteFetcher()
+
+        bars, errors = await fetcher.fetch_many([ticker], period=self.period, interval=self.interval)
+        if ticker in errors:
+            raise ValueError(f"Could not download {ticker}: {errors[ticker]}")
+
+        return self.returns_from_closes(bars["Adj Close"][ticker], ticker)
+
+    #Same output as stock_returnsdf, but built from a close series that is already downloaded
+    def returns_from_closes(self, closes, ticker):
+        stock_returns = closes.dropna().astype(float).pct_change()
+
+        #converting (Series) to dataframe
+        stock_returns = stock_returns.to_frame(name=f"{ticker} Returns").dropna()
+        stock_returns.index.name = "Date"
+
+        #reseting the index to organize the df
+        stock_returns.reset_index(inplace=True)
+
+        return stock_returns
+
     def get_index_name(self):
         return self.index_name
     
@@ -0,0 +1,117 @@
+#Data-quality stage between the downloaded closes and the returns matrix, in one pass over the wide (dates x tickers) frame:
+#bar dates normalized to the trading calendar of the index, simple or log returns, per-ticker coverage and quality flags
+#Closes are the adjusted closes of download_bars ("Adj Close"), so splits and dividends do not show up as returns
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import wide_returns
+from metrics import timed
+
+RETURN_METHODS = ["simple", "log"]
+
+#Bar dates are converted to the exchange's time zone before the time of day is dropped
+MARKET_TIMEZONE = "America/New_York"
+
+#A ticker whose returns span less than this share of the period has a short history
+SHORT_HISTORY_SHARE = 0.9
+
+#A ticker with no price change (or no bar) over its last bars has a stale history, number of bars per interval
+STALE_BARS = {"1d": 5, "1wk": 2, "1mo": 1}
+
+#Bar dates as tz-naive market dates keyed on the bar start (the day, the Monday of the week, the 1st of the month)
+#Yahoo sometimes returns bars stamped in UTC or with a time of day, or the running month/week stamped on today
+def normalize_bar_dates(dates, interval="1d"):
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert(MARKET_TIMEZONE).tz_localize(None)
+    dates = dates.normalize()
+    if interval == "1wk":
+        dates = dates - pd.to_timedelta(dates.weekday, unit="D")
+    elif interval == "1mo":
+        dates = dates.to_period("M").to_timestamp()
+    return dates
+
+#Closes aligned on the trading calendar of the index: one row per date with an index close, each ticker's bar lands on
+#the first calendar date at or after its own date (bars on dates the index does not trade are folded into the next bar)
+#When several bars land on the same date, the last close of each ticker is kept
+def align_to_calendar(closes, index_name, interval="1d"):
+    closes = closes.copy(deep=False)
+    closes.index = normalize_bar_dates(closes.index, interval)
+    closes = closes.sort_index(kind="stable")
+
+    calendar = closes.index[closes[index_name].notna()].unique()
+    calendar_rows = calendar.searchsorted(closes.index)
+    inside = calendar_rows < len(calendar)
+
+    aligned = closes[inside].groupby(calendar_rows[inside]).last()
+    aligned.index = pd.DatetimeIndex(calendar[aligned.index], name="Date")
+    return aligned.reindex(columns=closes.columns)
+
+#Per-ticker quality of the closes behind a returns matrix (both on the same calendar, index column first)
+def quality_report(closes, returns, tickers, interval="1mo"):
+    values = closes[tickers].to_numpy(dtype=np.float64)
+    has_close = ~np.isnan(values)
+    number_of_rows = len(values)
+    number_of_returns = len(returns)
+
+    any_close = has_close.any(axis=0)
+    first_rows = np.where(any_close, has_close.argmax(axis=0), -1)
+    last_rows = np.where(any_close, number_of_rows - 1 - has_close[::-1].argmax(axis=0), -1)
+    spanned = np.where(any_close, last_rows - first_rows + 1, 0)
+
+    return_values = returns[tickers].to_numpy(dtype=np.float64)
+    bars = (~np.isnan(return_values)).sum(axis=0)
+
+    #No bar at all, or no price change, over the last bars of the calendar
+    stale_bars = STALE_BARS.get(interval, 1)
+    tail = return_values[-stale_bars:]
+    stale = ((tail == 0) | np.isnan(tail)).all(axis=0) if len(tail) else np.ones(len(tickers), dtype=bool)
+
+    dates = closes.index
+    with np.errstate(divide="ignore", invalid="ignore"):
+        history_share = bars / number_of_returns if number_of_returns else np.zeros(len(tickers))
+        coverage = np.where(spanned > 1, bars / (spanned - 1), 0.0)
+
+    return pd.DataFrame({
+        "Ticker": list(tickers),
+        "First Bar": [dates[row] if row >= 0 else pd.NaT for row in first_rows],
+        "Last Bar": [dates[row] if row >= 0 else pd.NaT for row in last_rows],
+        "Bars": bars,
+        "Missing Bars": np.where(any_close, spanned - has_close.sum(axis=0), 0),
+        "History (%)": np.round(history_share * 100, 1),
+        "Coverage (%)": np.round(coverage * 100, 1),
+        "Short History": history_share < SHORT_HISTORY_SHARE,
+        "Stale": stale,
+    })
+
+#Returns matrix (index column first, "<TICKER> Returns" columns, only the dates where the index has a return) and the
+#quality report of every ticker, from a wide close frame holding the index and the tickers
+#method="log" gives log returns, a gap in a ticker's bars gives the return over the gap
+@timed("data_quality", quiet=True)
+def clean_returns(closes, index_name, tickers, interval="1mo", method="simple"):
+    if method not in RETURN_METHODS:
+        raise ValueError(f"Unknown returns method: {method}. Available: {', '.join(RETURN_METHODS)}")
+
+    tickers = [ticker for ticker in tickers if ticker != index_name]
+    closes = align_to_calendar(closes[[index_name] + tickers], index_name, interval)
+
+    returns = wide_returns(closes)
+    returns = returns[returns[index_name].notna()]
+    if method == "log":
+        returns = np.log1p(returns)
+
+    quality = quality_report(closes, returns, tickers, interval)
+
+    returns.columns = [f"{column} Returns" for column in returns.columns]
+    returns.index.name = "Date"
+    return returns, quality
+
+#One-line summary of the flagged tickers of a quality report (None when nothing is flagged)
+def quality_summary(quality):
+    parts = []
+    for flag, label in [("Short History", "short history"), ("Stale", "stale")]:
+        flagged = quality.loc[quality[flag], "Ticker"]
+        if len(flagged):
+            parts.append(f"{label} ({len(flagged)}): {', '.join(flagged)}")
+    return "; ".join(parts) if parts else None
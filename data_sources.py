@@ -0,0 +1,174 @@
+#Market data sources pluggable under DataPreprocessor.data_source (yf.download is used when no source is set)
+#A source has download_bars(tickers, fields, period=None, start=None, interval=...) returning
+#({field: wide frame, Date index, one column per ticker}, {ticker: error message}), and optionally an async fetch_many
+#with the same signature (see async_fetcher.AsyncQuoteFetcher)
+#SyntheticSource generates deterministic prices offline, with controllable missing data, failures and latency
+
+import asyncio
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import resample_closes
+from metrics import registry
+from price_cache import period_start
+
+#Treasury yield tickers and their average level (in % per year, quoted like Yahoo's ^IRX/^FVX/^TNX)
+SYNTHETIC_YIELDS = {"^IRX": 4.0, "^FVX": 4.2, "^TNX": 4.3}
+
+SYNTHETIC_SECTORS = ["Technology", "Healthcare", "Financials", "Industrials", "Energy", "Utilities", "Consumer Staples", "Real Estate"]
+
+#N synthetic ticker names (SYN0000, SYN0001, ...)
+def synthetic_tickers(number_of_tickers):
+    return [f"SYN{i:04d}" for i in range(number_of_tickers)]
+
+#One-factor market: every stock return is beta * index return + its own noise, on a business-day calendar
+#The same seed and ticker always give the same series, whatever the other settings are
+class SyntheticSource():
+    def __init__(self, seed=0, end=None, history_years=25, index_names=("^GSPC",),
+                 missing_fraction=0.0, short_history_fraction=0.0, failure_fraction=0.0,
+                 latency_seconds=0.0, per_ticker_latency_seconds=0.0, chunk_size=100, info_latency_seconds=0.0):
+        self.seed = seed
+        #Last trading day of the data (today by default, like a live source), periods are counted back from it
+        #The values only depend on the seed, a fixed end also fixes their dates
+        self.end = pd.Timestamp.now().normalize() if end is None else pd.Timestamp(end)
+        self.calendar = pd.bdate_range(end=self.end, periods=history_years * 252, name="Date")
+        #Tickers that get the market returns themselves
+        self.index_names = set(index_names)
+
+        #Share of the daily bars of each stock that are missing
+        self.missing_fraction = missing_fraction
+        #Share of the stocks whose history starts late (listed during the history)
+        self.short_history_fraction = short_history_fraction
+        #Share of the stocks that cannot be downloaded
+        self.failure_fraction = failure_fraction
+
+        #Simulated request latency: latency_seconds + per_ticker_latency_seconds * tickers for each chunk of chunk_size tickers
+        self.latency_seconds = latency_seconds
+        self.per_ticker_latency_seconds = per_ticker_latency_seconds
+        self.chunk_size = chunk_size
+        #Simulated latency of each info() call
+        self.info_latency_seconds = info_latency_seconds
+
+        #Number of simulated requests (price chunks and info calls)
+        self.requests = 0
+        self._market_returns = np.random.default_rng([seed, 0]).normal(0.0003, 0.011, len(self.calendar))
+
+    def _rng(self, ticker):
+        return np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+
+    #Random draws of a ticker, always in the same order so one setting never changes the other draws
+    def _draws(self, ticker):
+        rng = self._rng(ticker)
+        length = len(self.calendar)
+        return {
+            "failure": rng.random(),
+            "beta": rng.uniform(0.3, 1.8),
+            "noise": rng.normal(0.0001, 0.015, length),
+            "short_history": rng.random(),
+            "first_bar": int(rng.integers(length // 4, length - length // 10)),
+            "missing": rng.random(length),
+            "market_cap": 10 ** rng.uniform(9.5, 12.5),
+            "sector": SYNTHETIC_SECTORS[int(rng.integers(len(SYNTHETIC_SECTORS)))],
+        }
+
+    #Full daily closes of a ticker on the calendar (NaN where missing), None when the ticker fails
+    def daily_closes(self, ticker):
+        if ticker in self.index_names:
+            return 100 * np.cumprod(1 + self._market_returns)
+        if ticker in SYNTHETIC_YIELDS:
+            #Mean-reverting yield around its level
+            shocks = self._rng(ticker).normal(0, 0.03, len(self.calendar))
+            deviations = np.zeros(len(self.calendar))
+            for t in range(1, len(deviations)):
+                deviations[t] = 0.995 * deviations[t - 1] + shocks[t]
+            return np.clip(SYNTHETIC_YIELDS[ticker] + deviations, 0.01, None)
+
+        draws = self._draws(ticker)
+        if draws["failure"] < self.failure_fraction:
+            return None
+
+        closes = 100 * np.cumprod(1 + draws["beta"] * self._market_returns + draws["noise"])
+        if draws["short_history"] < self.short_history_fraction:
+            closes[:draws["first_bar"]] = np.nan
+        if self.missing_fraction:
+            closes[draws["missing"] < self.missing_fraction] = np.nan
+        return closes
+
+    #Bars of the tickers without the simulated latency
+    def _bars(self, tickers, fields, period=None, start=None, interval="1mo"):
+        if interval not in ("1d", "1wk", "1mo"):
+            raise ValueError(f"Interval {interval} not supported by the synthetic source")
+
+        columns = {}
+        errors = {}
+        for ticker in tickers:
+            closes = self.daily_closes(ticker)
+            if closes is None:
+                errors[ticker] = "No data found, symbol may be delisted"
+            else:
+                columns[ticker] = closes
+
+        if start is not None:
+            first_date = pd.Timestamp(start)
+        else:
+            first_date = period_start(period or "max", now=self.end)
+        first_row = 0 if first_date is None else self.calendar.searchsorted(first_date)
+
+        values = np.column_stack(list(columns.values())) if columns else np.empty((len(self.calendar), 0))
+        closes = pd.DataFrame(values, index=self.calendar, columns=list(columns)).iloc[first_row:]
+
+        all_bars = {}
+        for field in fields:
+            if field == "Adj Close":
+                #2% yearly dividend taken out of the past closes, like Yahoo's adjusted closes (yields are not adjusted)
+                adjustment = (1 - 0.02 / 252) ** np.arange(len(closes))[::-1]
+                field_bars = closes.mul(adjustment, axis=0)
+                yield_columns = [ticker for ticker in closes.columns if ticker in SYNTHETIC_YIELDS]
+                field_bars[yield_columns] = closes[yield_columns]
+            else:
+                field_bars = closes
+            field_bars = resample_closes(field_bars, interval).dropna(how="all")
+            field_bars.index.name = "Date"
+            all_bars[field] = field_bars
+
+        return all_bars, errors
+
+    def _latency(self, number_of_tickers):
+        chunks = max(1, -(-number_of_tickers // self.chunk_size))
+        self.requests += chunks
+        return chunks * self.latency_seconds + number_of_tickers * self.per_ticker_latency_seconds
+
+    #Same contract as DataPreprocessor.download_bars
+    def download_bars(self, tickers, fields=("Adj Close",), period=None, start=None, interval="1mo", **download_kwargs):
+        tickers = list(dict.fromkeys(tickers))
+        registry.increment("tickers_requested", len(tickers), source="synthetic")
+        latency = self._latency(len(tickers))
+        if latency:
+            time.sleep(latency)
+        return self._bars(tickers, fields, period, start, interval)
+
+    #Same contract as AsyncQuoteFetcher.fetch_many
+    async def fetch_many(self, tickers, fields=("Adj Close",), period=None, start=None, interval="1mo"):
+        tickers = list(dict.fromkeys(tickers))
+        registry.increment("tickers_requested", len(tickers), source="synthetic")
+        await asyncio.sleep(self._latency(len(tickers)))
+        return self._bars(tickers, fields, period, start, interval)
+
+    #yf.Ticker(ticker).info replacement, usable as FundamentalsFetcher(info_getter=source.info)
+    def info(self, ticker):
+        self.requests += 1
+        if self.info_latency_seconds:
+            time.sleep(self.info_latency_seconds)
+
+        draws = self._draws(ticker)
+        if ticker not in self.index_names and draws["failure"] < self.failure_fraction:
+            raise ValueError(f"No fundamentals for {ticker}")
+        return {
+            "shortName": f"{ticker} Synthetic",
+            "sector": draws["sector"],
+            "marketCap": draws["market_cap"],
+            "beta": round(draws["beta"], 2),
+        }
@@ -0,0 +1,201 @@
+#Vectorized multi-factor engine (Fama-French 3 and 5 factors): loadings, t-stats and R² of every ticker in one solve
+#Factor returns are read from local Ken French CSVs (data/factors/), fetched by download_factors outside of the analyses
+#(`python pipeline.py --fetch-factors`), the dashboard hides the factor panel while they are missing
+
+import io
+import os
+import zipfile
+from functools import lru_cache
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing import RESAMPLE_RULES
+
+FACTORS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "factors")
+
+#Files of the Ken French data library (unzipped CSVs), the monthly file is preferred for monthly bars
+#Daily factors are compounded into the bars of any interval
+MONTHLY_FACTORS_FILE = os.path.join(FACTORS_DIR, "F-F_Research_Data_5_Factors_2x3.csv")
+DAILY_FACTORS_FILE = os.path.join(FACTORS_DIR, "F-F_Research_Data_5_Factors_2x3_daily.csv")
+
+#Zipped CSVs of the Ken French data library, one per factor file
+FACTORS_URL = "https://mba.tuck.dartmouth.edu/pages/faculty/ken.french/ftp"
+FACTORS_ZIPS = {
+    os.path.basename(MONTHLY_FACTORS_FILE): "F-F_Research_Data_5_Factors_2x3_CSV.zip",
+    os.path.basename(DAILY_FACTORS_FILE): "F-F_Research_Data_5_Factors_2x3_daily_CSV.zip",
+}
+
+#Factors of each model, regressed on the excess returns of the stocks (over the RF column of the file)
+FACTOR_MODELS = {
+    "ff3": ["Mkt-RF", "SMB", "HML"],
+    "ff5": ["Mkt-RF", "SMB", "HML", "RMW", "CMA"],
+}
+
+#Factor returns of a Ken French CSV as a DataFrame of decimal returns keyed on Date (YYYYMM: month start, YYYYMMDD: day)
+#Only the first table is read (the annual factors that follow it are skipped)
+@lru_cache(maxsize=None)
+def load_factors(path):
+    with open(path) as factors_file:
+        lines = factors_file.read().splitlines()
+
+    header_row = next((i for i, line in enumerate(lines) if "Mkt-RF" in [field.strip() for field in line.split(",")]), None)
+    if header_row is None:
+        raise ValueError(f"No Mkt-RF column in {path}, expected a Ken French factors CSV")
+    names = [field.strip() for field in lines[header_row].split(",")[1:]]
+
+    dates = []
+    values = []
+    for line in lines[header_row + 1:]:
+        fields = [field.strip() for field in line.split(",")]
+        if not fields[0].isdigit():
+            break
+        dates.append(fields[0])
+        values.append([float(field) for field in fields[1:len(names) + 1]])
+    if not dates:
+        raise ValueError(f"No factor returns in {path}")
+
+    date_format = "%Y%m" if len(dates[0]) == 6 else "%Y%m%d"
+    index = pd.DatetimeIndex(pd.to_datetime(dates, format=date_format), name="Date")
+    #The library quotes returns in %
+    return pd.DataFrame(np.array(values) / 100, index=index, columns=names)
+
+#Factor file used for bars of an interval: the monthly one for monthly bars when it is there, the daily one otherwise
+def factors_file_for(interval, factors_dir=FACTORS_DIR):
+    monthly_file = os.path.join(factors_dir, os.path.basename(MONTHLY_FACTORS_FILE))
+    daily_file = os.path.join(factors_dir, os.path.basename(DAILY_FACTORS_FILE))
+    if interval == "1mo" and os.path.exists(monthly_file):
+        return monthly_file
+    if os.path.exists(daily_file):
+        return daily_file
+    raise FileNotFoundError(f"No factor file for {interval} bars in {factors_dir} (expected {os.path.basename(daily_file)})")
+
+#Whether there is a factor file for bars of an interval (for any interval when None)
+def factors_available(interval=None, factors_dir=FACTORS_DIR):
+    try:
+        factors_file_for(interval or "1mo", factors_dir)
+    except FileNotFoundError:
+        return False
+    return True
+
+#Downloading the monthly and daily factor files from the Ken French data library into factors_dir
+#Each file is written next to its final name and renamed, so a failed download never leaves half a file behind
+def download_factors(factors_dir=FACTORS_DIR, base_url=FACTORS_URL, timeout_seconds=60):
+    os.makedirs(factors_dir, exist_ok=True)
+    paths = []
+    for file_name, zip_name in FACTORS_ZIPS.items():
+        with urlopen(f"{base_url}/{zip_name}", timeout=timeout_seconds) as response:
+            content = response.read()
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(content))
+        except zipfile.BadZipFile as e:
+            raise ValueError(f"{zip_name} is not a zip archive") from e
+        #The archive holds a single CSV, whose extension is sometimes upper case
+        member = next((name for name in archive.namelist() if name.lower().endswith(".csv")), None)
+        if member is None:
+            raise ValueError(f"No CSV in {zip_name}")
+        path = os.path.join(factors_dir, file_name)
+        with open(path + ".tmp", "wb") as factors_file:
+            factors_file.write(archive.read(member))
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+    load_factors.cache_clear()
+    return paths
+
+#Factor returns of each returns date (rows without factor data are NaN), daily factors are compounded into the bars
+#of the interval keyed on the bar start like resample_closes, monthly factors only fit monthly bars
+def align_factors(factors, dates, interval):
+    monthly_factors = len(factors) > 1 and (factors.index[1] - factors.index[0]).days > 20
+    if monthly_factors and interval != "1mo":
+        raise ValueError(f"Monthly factors cannot be used with {interval} bars, use the daily factor file")
+
+    if interval != "1d" and not monthly_factors:
+        growth = (1 + factors).resample(RESAMPLE_RULES[interval], label="left", closed="left")
+        #Bars with no factor day stay NaN instead of a 0 return
+        factors = growth.prod().where(growth.count() > 0) - 1
+
+    return factors.reindex(pd.DatetimeIndex(dates))
+
+#OLS of each stock's excess returns on the factors: ri - rf = alpha + sum(loading_k * factor_k) + e
+#ri (T x N) stock returns, factors (T x K) factor returns and rf (T) risk-free returns on the same dates
+#Columns observed on every date are solved together with one least-squares solve on the shared factor matrix,
+#the others with one batched solve of their own (masked) normal equations
+#pairwise=False only keeps the dates where every column has a return (listwise complete)
+def factor_stats_arrays(ri, factors, rf, tickers, factor_names, pairwise=True):
+    ri = np.asarray(ri, dtype=np.float64)
+    number_of_dates, number_of_tickers = ri.shape
+
+    #Design matrix with the intercept first, dates without factor data are left out of every regression
+    x = np.column_stack([np.ones(number_of_dates), np.asarray(factors, dtype=np.float64)])
+    factor_rows = ~np.isnan(x).any(axis=1) & ~np.isnan(rf)
+    x = np.where(factor_rows[:, None], x, 0.0)
+    number_of_coefficients = x.shape[1]
+
+    valid = ~np.isnan(ri) & factor_rows[:, None]
+    if not pairwise:
+        valid &= valid.all(axis=1, keepdims=True)
+    weights = valid.astype(np.float64)
+    y = np.where(valid, ri - np.where(factor_rows, rf, 0.0)[:, None], 0.0)
+    n = weights.sum(axis=0)
+
+    coefficients = np.full((number_of_coefficients, number_of_tickers), np.nan)
+    #Diagonal of (X'X)^-1 of each ticker, for the standard errors
+    inverse_diagonals = np.full((number_of_coefficients, number_of_tickers), np.nan)
+
+    complete = valid[factor_rows].all(axis=0) & (n > number_of_coefficients)
+    if complete.any():
+        shared_x = x[factor_rows]
+        coefficients[:, complete] = np.linalg.lstsq(shared_x, y[factor_rows][:, complete], rcond=None)[0]
+        inverse_diagonals[:, complete] = np.diag(np.linalg.pinv(shared_x.T @ shared_x))[:, None]
+
+    partial = ~complete & (n > number_of_coefficients)
+    if partial.any():
+        #X'WX of every ticker (N x K x K) from one matrix product of the pairwise factor products with the masks
+        cross_products = (x[:, :, None] * x[:, None, :]).reshape(number_of_dates, -1)
+        xtx = (cross_products.T @ weights[:, partial]).T.reshape(-1, number_of_coefficients, number_of_coefficients)
+        xty = (x.T @ y[:, partial]).T
+        try:
+            inverse = np.linalg.inv(xtx)
+        except np.linalg.LinAlgError:
+            #Collinear factors on some ticker's dates
+            inverse = np.linalg.pinv(xtx)
+        coefficients[:, partial] = np.einsum("nij,nj->in", inverse, xty)
+        inverse_diagonals[:, partial] = np.diagonal(inverse, axis1=1, axis2=2).T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residuals = (y - x @ np.nan_to_num(coefficients)) * weights
+        residual_sum = np.einsum("ij,ij->j", residuals, residuals)
+        mean_y = y.sum(axis=0) / n
+        centered = (y - mean_y) * weights
+        total_sum = np.einsum("ij,ij->j", centered, centered)
+
+        r_squared = 1 - residual_sum / total_sum
+        residual_variance = residual_sum / (n - number_of_coefficients)
+        t_stats = coefficients / np.sqrt(residual_variance * inverse_diagonals)
+
+    #A regression needs more observations than coefficients
+    r_squared[n <= number_of_coefficients] = np.nan
+
+    stats = {"Ticker": list(tickers), "Alpha": coefficients[0]}
+    for k, name in enumerate(factor_names, start=1):
+        stats[name] = coefficients[k]
+    stats["t Alpha"] = t_stats[0]
+    for k, name in enumerate(factor_names, start=1):
+        stats[f"t {name}"] = t_stats[k]
+    stats["R Squared"] = r_squared
+    stats["Observations"] = n.astype(int)
+    return pd.DataFrame(stats)
+
+#Factor regressions of every stock column of a returns df (returns keyed on the bar start) for one model
+def factor_stats(returns_data, stock_columns, tickers, factors, interval, model="ff3", pairwise=True):
+    if model not in FACTOR_MODELS:
+        raise ValueError(f"Unknown factor model: {model}. Available: {', '.join(FACTOR_MODELS)}")
+    factor_names = FACTOR_MODELS[model]
+    missing = [name for name in factor_names + ["RF"] if name not in factors.columns]
+    if missing:
+        raise ValueError(f"Factor data has no {', '.join(missing)} column")
+
+    aligned = align_factors(factors[factor_names + ["RF"]], returns_data.index, interval)
+    ri = returns_data[stock_columns].to_numpy(dtype=np.float64)
+    return factor_stats_arrays(ri, aligned[factor_names].to_numpy(), aligned["RF"].to_numpy(), tickers, factor_names, pairwise=pairwise)
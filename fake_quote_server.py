@@ -0,0 +1,167 @@
+#Local fake of the Yahoo chart API for async_fetcher.AsyncQuoteFetcher, served by aiohttp on localhost
+#Tickers can be given a response delay or be missing, and the server records how many requests are in flight at once and
+#how many were dropped by the client, so the semaphore, the per-request timeout and the cancellation paths can be checked
+#Usage: python fake_quote_server.py runs those checks against a server on a free port
+
+import asyncio
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+
+from async_fetcher import AsyncQuoteFetcher
+
+class FakeQuoteServer():
+    def __init__(self, delays=None, default_delay=0.0, missing=(), number_of_bars=60, host="127.0.0.1", port=0):
+        #{ticker: seconds} before the response of a ticker, default_delay for the others
+        self.delays = dict(delays or {})
+        self.default_delay = default_delay
+        #Tickers answered with the chart API "No data found" error (HTTP 404)
+        self.missing = set(missing)
+        self.number_of_bars = number_of_bars
+        self.host = host
+        self.port = port
+
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        #Requests whose handler was cancelled because the client went away before the response
+        self.cancelled = 0
+
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/chart"
+
+    #Monthly bars of a ticker (same prices on every run), stamped at the open in exchange time like the real API
+    def chart_payload(self, ticker):
+        dates = pd.date_range(end="2026-10-01", periods=self.number_of_bars, freq="MS", tz="America/New_York")
+        dates = dates + pd.Timedelta(hours=9, minutes=30)
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        closes = (100 * np.cumprod(1 + rng.normal(0.01, 0.05, self.number_of_bars))).tolist()
+        return {"chart": {"result": [{
+            "meta": {"exchangeTimezoneName": "America/New_York"},
+            "timestamp": [int(date.timestamp()) for date in dates],
+            "indicators": {"quote": [{"close": closes}], "adjclose": [{"adjclose": closes}]},
+        }], "error": None}}
+
+    async def chart(self, request):
+        ticker = request.match_info["ticker"]
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if ticker in self.missing:
+                error = {"code": "Not Found", "description": "No data found, symbol may be delisted"}
+                return web.json_response({"chart": {"result": None, "error": error}}, status=404)
+            #Waiting in small steps, a client that drops the connection meanwhile is counted as cancelled
+            #(aiohttp only cancels the handler itself on some versions)
+            deadline = time.monotonic() + self.delays.get(ticker, self.default_delay)
+            while time.monotonic() < deadline:
+                if request.transport is None or request.transport.is_closing():
+                    self.cancelled += 1
+                    return web.Response(status=499)
+                await asyncio.sleep(min(0.01, max(deadline - time.monotonic(), 0)))
+            return web.json_response(self.chart_payload(ticker))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    #Serving from an event loop in a background thread, port=0 picks a free port
+    def start(self):
+        app = web.Application()
+        app.router.add_get("/chart/{ticker}", self.chart)
+        self._loop = asyncio.new_event_loop()
+        self._runner = web.AppRunner(app)
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def reset_counters(self):
+        self.requests = self.in_flight = self.max_in_flight = self.cancelled = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+#Waiting for the server to see the client side cancellations (they reach the handlers asynchronously)
+def wait_for(condition, timeout_seconds=2.0):
+    deadline = time.time() + timeout_seconds
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def main():
+    tickers = [f"T{i:02d}" for i in range(40)]
+    with FakeQuoteServer(delays={"SLOW": 5.0}, default_delay=0.05, missing={"BAD"}) as server:
+        #Semaphore: never more requests in flight than max_concurrency
+        fetcher = AsyncQuoteFetcher(base_url=server.base_url, max_concurrency=8)
+        bars, errors = fetcher.download_bars(tickers, period="5y", interval="1mo")
+        assert not errors and list(bars["Adj Close"].columns) == tickers, errors
+        assert server.max_in_flight <= 8, server.max_in_flight
+        print(f"semaphore: {server.requests} requests, at most {server.max_in_flight} in flight (limit 8)")
+
+        #Per-request timeout: the slow ticker is reported, the others are returned
+        server.reset_counters()
+        fetcher = AsyncQuoteFetcher(base_url=server.base_url, max_concurrency=8, timeout_seconds=0.3)
+        bars, errors = fetcher.download_bars(["T00", "SLOW", "BAD"], period="5y", interval="1mo")
+        assert errors.get("SLOW") == "Timed out", errors
+        assert "No data found" in errors.get("BAD", ""), errors
+        assert list(bars["Adj Close"].columns) == ["T00"]
+        assert wait_for(lambda: server.cancelled == 1), server.cancelled
+        print(f"timeout: {errors}")
+
+        #Total timeout: the requests still pending are cancelled on the client and dropped on the server
+        server.reset_counters()
+        server.delays.update({f"T{i:02d}": 5.0 for i in range(5)})
+        fetcher = AsyncQuoteFetcher(base_url=server.base_url, max_concurrency=8, total_timeout_seconds=0.5)
+        bars, errors = fetcher.download_bars(tickers[:10], period="5y", interval="1mo")
+        assert sorted(errors) == tickers[:5] and set(errors.values()) == {"Cancelled"}, errors
+        assert list(bars["Adj Close"].columns) == tickers[5:10]
+        assert wait_for(lambda: server.cancelled == 5), server.cancelled
+        print(f"total timeout: {len(errors)} cancelled, {server.cancelled} dropped on the server")
+
+        #Caller cancellation: cancelling fetch_many cancels every request in flight
+        server.reset_counters()
+        async def cancel_fetch():
+            task = asyncio.ensure_future(AsyncQuoteFetcher(base_url=server.base_url, max_concurrency=8).fetch_many(tickers[:5]))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+        assert asyncio.run(cancel_fetch())
+        assert wait_for(lambda: server.cancelled == 5), server.cancelled
+        print(f"caller cancellation: {server.cancelled} requests dropped on the server")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#Fundamentals of many tickers (market cap, Yahoo beta, ...) with one .info call per ticker on a bounded thread pool
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import registry, timed
+
+#Fields read from yf.Ticker(ticker).info and the column names they get in the analysis
+FUNDAMENTAL_FIELDS = {
+    "shortName": "Name",
+    "sector": "Sector",
+    "marketCap": "Market Cap (in $B)",
+    "beta": "Beta YF",
+}
+
+def yahoo_info(ticker):
+    #yfinance is imported on first use, it is slow to import and not needed at startup
+    import yfinance as yf
+    return yf.Ticker(ticker).info
+
+#Spacing the calls of all the threads so no more than calls_per_second start each second
+class RateLimiter():
+    def __init__(self, calls_per_second):
+        self.min_interval = 1.0 / calls_per_second if calls_per_second else 0.0
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class FundamentalsFetcher():
+    def __init__(self, max_workers=32, calls_per_second=50, retries=3, backoff_seconds=0.5, info_getter=yahoo_info):
+        self.max_workers = max_workers
+        self.calls_per_second = calls_per_second
+        #Number of retries after a failed call, waiting backoff_seconds * 2^attempt (plus jitter) between them
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        #Function ticker -> info dict, yfinance by default (can be replaced by a fake for offline runs)
+        self.info_getter = info_getter
+
+        #{ticker: error message} of the tickers that failed in the last fetch
+        self.errors = {}
+
+    def _fetch_one(self, ticker, rate_limiter):
+        for attempt in range(self.retries + 1):
+            rate_limiter.wait()
+            try:
+                with timed("fundamentals", ticker=ticker):
+                    return self.info_getter(ticker) or {}
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying fundamentals of {ticker} ({e})")
+                registry.increment("retries", stage="fundamentals")
+                time.sleep(self.backoff_seconds * 2 ** attempt * (1 + random.random()))
+
+    #One row per ticker with the FUNDAMENTAL_FIELDS columns, failed tickers get empty values
+    #progress_callback(stage, done, total) is called as the tickers complete
+    @timed("fundamentals_fetch")
+    def fetch(self, tickers, progress_callback=None):
+        rate_limiter = RateLimiter(self.calls_per_second)
+        self.errors = {}
+
+        completed = [0]
+        completed_lock = threading.Lock()
+        def ticker_completed(future):
+            with completed_lock:
+                completed[0] += 1
+                done = completed[0]
+            progress_callback("fundamentals", done, len(tickers))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {ticker: executor.submit(self._fetch_one, ticker, rate_limiter) for ticker in tickers}
+            if progress_callback is not None:
+                for future in futures.values():
+                    future.add_done_callback(ticker_completed)
+
+        rows = []
+        for ticker, future in futures.items():
+            try:
+                info = future.result()
+            except Exception as e:
+                self.errors[ticker] = repr(e)
+                info = {}
+            rows.append([ticker] + [info.get(field) for field in FUNDAMENTAL_FIELDS])
+
+        fundamentals_df = pd.DataFrame(rows, columns=["Ticker"] + list(FUNDAMENTAL_FIELDS.values()))
+
+        market_cap = pd.to_numeric(fundamentals_df["Market Cap (in $B)"], errors="coerce")
+        fundamentals_df["Market Cap (in $B)"] = np.round(market_cap / 1000000000, decimals=3)
+        fundamentals_df["Beta YF"] = pd.to_numeric(fundamentals_df["Beta YF"], errors="coerce")
+
+        if self.errors:
+            print(f"Failed fundamentals ({len(self.errors)}): {', '.join(self.errors)}")
+        registry.increment("fundamentals_errors", len(self.errors))
+
+        return fundamentals_df
@@ -0,0 +1,404 @@
+#Incremental end-of-day analytics: the sufficient statistics of the betas and CAPM of one (period, interval) are kept
+#per ticker (counts, sums, sums of squares and cross-products with the index and the risk-free rate) and updated in O(N)
+#when a bar is appended, when the forming bar is revised, and when bars fall out of the period window
+#A refresh after the close then costs a one-bar download and a few array operations instead of a full recompute
+#Usage: python incremental_state.py build [--tickers 500] [--periods 5y] [--intervals 1d 1mo], then after each close:
+#       python incremental_state.py refresh
+
+import argparse
+import json
+import os
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from beta_engine import beta_stats_from_sums, split_returns, ticker_from_column
+from capm_engine import RISK_FREE_RATE, EXPECTED_RETURN_COLUMN, RATIO_COLUMNS, capm_stats_from_sums, load_risk_free_rates, risk_free_per_bar
+from data_preprocessing import DataPreprocessor, PERIODS, resample_closes, wide_returns
+from data_quality import align_to_calendar, normalize_bar_dates
+from metrics import timed
+from price_cache import period_start
+from tickers_analysis import period_first_bar
+from universe import DEFAULT_UNIVERSE, load_universe
+
+INCREMENTAL_STATE_DIR = "data/state"
+
+#Daily closes downloaded by a refresh, enough to catch up after a long weekend or a missed run
+REFRESH_PERIOD = "5d"
+
+#Sums kept for every ticker, over the dates where both the ticker and the index have a return (x: index, y: stock, rf: risk-free)
+SUM_NAMES = ["n", "sx", "sy", "sxx", "syy", "sxy", "srf", "sxrf", "syrf", "srf2"]
+
+#Sums kept for the index alone (mean market and risk-free returns of the expected returns)
+INDEX_SUM_NAMES = ["n", "sx", "srf"]
+
+#The sums are recomputed from the window after this many updates, so rounding errors of the add/remove steps never pile up
+REBUILD_EVERY = 1000
+
+class IncrementalBetaState():
+    def __init__(self, index_name, tickers, period, interval, risk_free=RISK_FREE_RATE):
+        self.index_name = index_name
+        self.tickers = list(tickers)
+        self.period = period
+        self.interval = interval
+        #Annual risk-free rate: a constant or a Series of annual rates keyed on date (like analyzer.risk_free)
+        self.risk_free = risk_free
+
+        #Bars of the window: return date and row (index return, stock returns..., risk-free return) of each bar
+        self.dates = deque()
+        self.rows = deque()
+        #Date of the bar before the first return of the window (it has no return inside the period)
+        self.first_bar_date = None
+
+        #Closes at the end of the previous bar (carried forward) and closes of the last bar, index first
+        self.previous_closes = np.full(len(self.tickers) + 1, np.nan)
+        self.last_closes = np.full(len(self.tickers) + 1, np.nan)
+
+        self.sums = {name: np.zeros(len(self.tickers)) for name in SUM_NAMES}
+        self.index_sums = {name: 0.0 for name in INDEX_SUM_NAMES}
+        self.updates_since_rebuild = 0
+
+    #Risk-free return of a bar starting on date
+    def _risk_free_return(self, date):
+        return risk_free_per_bar(self.risk_free, [date], self.interval)[0]
+
+    #Adding (sign=1) or removing (sign=-1) the contributions of rows of (index return, stock returns..., rf)
+    def _accumulate(self, rows, sign):
+        rows = np.atleast_2d(rows)
+        rm, ri, rf = rows[:, 0], rows[:, 1:-1], rows[:, -1]
+
+        valid = ~np.isnan(ri) & ~np.isnan(rm)[:, None]
+        x = np.where(valid, rm[:, None], 0.0)
+        y = np.where(valid, ri, 0.0)
+        z = np.where(valid, rf[:, None], 0.0)
+
+        contributions = {
+            "n": valid.sum(axis=0), "sx": x.sum(axis=0), "sy": y.sum(axis=0),
+            "sxx": (x * x).sum(axis=0), "syy": (y * y).sum(axis=0), "sxy": (x * y).sum(axis=0),
+            "srf": z.sum(axis=0), "sxrf": (x * z).sum(axis=0), "syrf": (y * z).sum(axis=0), "srf2": (z * z).sum(axis=0),
+        }
+        for name in SUM_NAMES:
+            self.sums[name] += sign * contributions[name]
+
+        index_rows = ~np.isnan(rm)
+        self.index_sums["n"] += sign * index_rows.sum()
+        self.index_sums["sx"] += sign * rm[index_rows].sum()
+        self.index_sums["srf"] += sign * rf[index_rows].sum()
+
+    #Sums recomputed from the bars of the window in one pass
+    def rebuild(self):
+        self.sums = {name: np.zeros(len(self.tickers)) for name in SUM_NAMES}
+        self.index_sums = {name: 0.0 for name in INDEX_SUM_NAMES}
+        if self.rows:
+            self._accumulate(np.vstack(self.rows), 1)
+        self.updates_since_rebuild = 0
+
+    def _counted_update(self):
+        self.updates_since_rebuild += 1
+        if self.updates_since_rebuild >= REBUILD_EVERY:
+            self.rebuild()
+
+    def _drop_first(self):
+        self.first_bar_date = self.dates.popleft()
+        self._accumulate(self.rows.popleft(), -1)
+
+    #Dropping the bars that fell out of the period, same first row as tickers_analysis.period_first_row (a download of
+    #the period on the day now): the bars before the first bar of the period (period_first_bar), then that first bar
+    #(it has no return inside the period), only looking at the front of the window
+    #The window has no daily calendar, so a holiday right after the period start counts as a trading day
+    def drop_expired(self, now=None):
+        if not self.dates:
+            return 0
+        earliest_bar = period_first_bar(self.period, now, self.interval)
+        if earliest_bar is None or (self.first_bar_date is not None and earliest_bar <= pd.Timestamp(self.first_bar_date)):
+            return 0
+
+        dropped = 0
+        while self.dates and self.dates[0] < earliest_bar:
+            self._drop_first()
+            dropped += 1
+        if self.dates:
+            self._drop_first()
+            dropped += 1
+        if dropped:
+            self._counted_update()
+        return dropped
+
+    #Appending the returns of a new bar (stock_returns: one per ticker or {ticker: return}), or replacing the last bar
+    #when date is the date of the last bar (a bar still forming, e.g. the running week or month)
+    def append_returns(self, date, index_return, stock_returns, now=None):
+        date = pd.Timestamp(date)
+        if isinstance(stock_returns, (dict, pd.Series)):
+            stock_returns = pd.Series(stock_returns, dtype=np.float64).reindex(self.tickers).to_numpy()
+        stock_returns = np.asarray(stock_returns, dtype=np.float64)
+        if len(stock_returns) != len(self.tickers):
+            raise ValueError(f"Expected {len(self.tickers)} returns, got {len(stock_returns)}")
+
+        if self.dates and date < self.dates[-1]:
+            raise ValueError(f"Bar of {date.date()} is older than the last bar ({self.dates[-1].date()})")
+
+        if self.dates and date == self.dates[-1]:
+            self.dates.pop()
+            self._accumulate(self.rows.pop(), -1)
+
+        row = np.concatenate([[index_return], stock_returns, [self._risk_free_return(date)]])
+        self.dates.append(date)
+        self.rows.append(row)
+        self._accumulate(row, 1)
+        self._counted_update()
+
+        self.drop_expired(now)
+
+    #Appending a bar from the closes of the day ({ticker: close}, the index included), returns are taken against the
+    #closes of the previous bar; closes dated inside the last bar (same week or month) revise that bar instead
+    def append_closes(self, date, closes, now=None):
+        date = normalize_bar_dates([date], self.interval)[0]
+        closes = pd.Series(closes, dtype=np.float64).reindex([self.index_name] + self.tickers).to_numpy()
+        if np.isnan(closes[0]):
+            raise ValueError(f"No close for the index {self.index_name} on {date.date()}")
+
+        if self.dates and date == self.dates[-1]:
+            #Revising the forming bar: tickers without a new close keep the close they had in it
+            closes = np.where(np.isnan(closes), self.last_closes, closes)
+        else:
+            self.previous_closes = np.where(np.isnan(self.last_closes), self.previous_closes, self.last_closes)
+        self.last_closes = closes
+
+        with np.errstate(invalid="ignore"):
+            returns = closes / self.previous_closes - 1
+        self.append_returns(date, returns[0], returns[1:], now=now)
+
+    #Beta regression output of every ticker (same columns as beta_engine.beta_stats)
+    def beta_stats(self):
+        sums = self.sums
+        return beta_stats_from_sums(sums["n"], sums["sx"], sums["sy"], sums["sxx"], sums["syy"], sums["sxy"], self.tickers)
+
+    #Expected returns, Jensen's alpha, Treynor and Sharpe ratios of every ticker for an array of betas
+    def capm_stats(self, betas):
+        sums = self.sums
+        index_sums = self.index_sums
+        with np.errstate(divide="ignore", invalid="ignore"):
+            market_return = index_sums["sx"] / index_sums["n"]
+            risk_free_return = index_sums["srf"] / index_sums["n"]
+        #Excess sums: (y - rf) and (x - rf) over each ticker's observations
+        stock_excess_squares = sums["syy"] - 2 * sums["syrf"] + sums["srf2"]
+        return capm_stats_from_sums(sums["n"], sums["sy"] - sums["srf"], sums["sx"] - sums["srf"], stock_excess_squares,
+                                    betas, market_return, risk_free_return, self.tickers, self.interval)
+
+    #all_info-style frame of the window: expected return, rounded beta and CAPM ratios (like run_all_analysis without
+    #the fundamentals), CAPM is computed from the rounded betas of the table
+    def all_info(self):
+        betas = np.round(self.beta_stats()["Beta"].to_numpy(), decimals=3)
+        capm_stats = self.capm_stats(betas)
+
+        all_info = pd.DataFrame({
+            "Ticker": self.tickers,
+            EXPECTED_RETURN_COLUMN: np.round(capm_stats[EXPECTED_RETURN_COLUMN].to_numpy(), decimals=3),
+            f"Beta {self.period} {self.interval}": betas,
+        })
+        all_info[RATIO_COLUMNS] = capm_stats[RATIO_COLUMNS].round(3).to_numpy()
+        return all_info.set_index("Ticker")
+
+    #Returns of the window (index first, "<TICKER> Returns" columns) as a df
+    def returns_frame(self):
+        values = np.vstack(self.rows)[:, :-1] if self.rows else np.empty((0, len(self.tickers) + 1))
+        columns = [f"{ticker} Returns" for ticker in [self.index_name] + self.tickers]
+        return pd.DataFrame(values, index=pd.DatetimeIndex(list(self.dates), name="Date"), columns=columns)
+
+    #State of a returns df (index column first, like analyzer.returns_data) covering at least the period
+    #first_bar_date is the date of the bar before the first return (the first return date when not given)
+    @classmethod
+    def from_returns(cls, returns_data, index_name, period, interval, risk_free=RISK_FREE_RATE, first_bar_date=None, now=None):
+        rm, ri, stock_columns = split_returns(returns_data, f"{index_name} Returns")
+        state = cls(index_name, [ticker_from_column(column) for column in stock_columns], period, interval, risk_free)
+
+        dates = pd.DatetimeIndex(returns_data.index)
+        rf = risk_free_per_bar(risk_free, dates, interval)
+        state.dates = deque(dates)
+        state.rows = deque(np.column_stack([rm, ri, rf]))
+        state.first_bar_date = first_bar_date if first_bar_date is not None else (dates[0] if len(dates) else None)
+        state.drop_expired(now)
+        state.rebuild()
+        return state
+
+    #State of a wide daily close frame (index and tickers, as close_prices_bulk returns), the closes of the last bars are
+    #kept so the next bars can be appended with append_closes
+    @classmethod
+    def from_closes(cls, daily_closes, index_name, tickers, period, interval, risk_free=RISK_FREE_RATE, now=None):
+        tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != index_name]
+        closes = resample_closes(align_to_calendar(daily_closes[[index_name] + tickers], index_name, "1d"), interval)
+        closes = closes[closes[index_name].notna()]
+
+        returns = wide_returns(closes)[1:]
+        returns.columns = [f"{column} Returns" for column in returns.columns]
+        state = cls.from_returns(returns, index_name, period, interval, risk_free, first_bar_date=closes.index[0], now=now)
+
+        values = closes.to_numpy(dtype=np.float64)
+        state.last_closes = values[-1]
+        state.previous_closes = pd.DataFrame(values[:-1]).ffill().to_numpy()[-1] if len(values) > 1 else np.full(values.shape[1], np.nan)
+        return state
+
+    #Persisting the state (sums, window, last closes and its metadata as a JSON string) to state.npz in a directory
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        risk_free_series = not np.isscalar(self.risk_free)
+        metadata = {
+            "index_name": self.index_name, "tickers": self.tickers, "period": self.period, "interval": self.interval,
+            "risk_free": None if risk_free_series else float(self.risk_free),
+            "first_bar_date": None if self.first_bar_date is None else pd.Timestamp(self.first_bar_date).isoformat(),
+            "updates_since_rebuild": self.updates_since_rebuild,
+            "index_sums": self.index_sums,
+        }
+        arrays = {f"sum_{name}": values for name, values in self.sums.items()}
+        arrays["dates"] = np.array(list(self.dates), dtype="datetime64[ns]")
+        arrays["rows"] = np.vstack(self.rows) if self.rows else np.empty((0, len(self.tickers) + 2))
+        arrays["previous_closes"] = self.previous_closes
+        arrays["last_closes"] = self.last_closes
+        if risk_free_series:
+            arrays["risk_free_dates"] = self.risk_free.index.to_numpy(dtype="datetime64[ns]")
+            arrays["risk_free_rates"] = self.risk_free.to_numpy(dtype=np.float64)
+
+        arrays["metadata"] = np.array(json.dumps(metadata))
+
+        #One file written under a temporary name then renamed, a reader never sees half a state
+        np.savez(os.path.join(directory, "state.tmp.npz"), **arrays)
+        os.replace(os.path.join(directory, "state.tmp.npz"), os.path.join(directory, "state.npz"))
+
+    @classmethod
+    def load(cls, directory):
+        arrays = np.load(os.path.join(directory, "state.npz"))
+        metadata = json.loads(str(arrays["metadata"]))
+
+        if metadata["risk_free"] is None:
+            risk_free = pd.Series(arrays["risk_free_rates"], index=pd.DatetimeIndex(arrays["risk_free_dates"]))
+        else:
+            risk_free = metadata["risk_free"]
+
+        state = cls(metadata["index_name"], metadata["tickers"], metadata["period"], metadata["interval"], risk_free)
+        state.dates = deque(pd.DatetimeIndex(arrays["dates"]))
+        state.rows = deque(arrays["rows"])
+        state.first_bar_date = None if metadata["first_bar_date"] is None else pd.Timestamp(metadata["first_bar_date"])
+        state.previous_closes = arrays["previous_closes"]
+        state.last_closes = arrays["last_closes"]
+        state.sums = {name: arrays[f"sum_{name}"].copy() for name in SUM_NAMES}
+        state.index_sums = metadata["index_sums"]
+        state.updates_since_rebuild = metadata["updates_since_rebuild"]
+        return state
+
+#Directory of the state of one (period, interval)
+def state_dir(directory, period, interval):
+    return os.path.join(directory, f"{period}_{interval}")
+
+#Building and saving the state of every (period, interval) from one download of the daily closes of the longest period
+#risk_free: annual rate, or a treasury ticker (^IRX, ^FVX, ^TNX) whose yields are used
+@timed("build_states")
+def build_states(tickers, periods=("5y",), intervals=("1mo",), risk_free=RISK_FREE_RATE, directory=INCREMENTAL_STATE_DIR,
+                 processor=None):
+    processor = processor if processor is not None else DataPreprocessor()
+    if isinstance(risk_free, str):
+        risk_free = load_risk_free_rates(processor, risk_free)
+
+    saved_settings = processor.period, processor.interval
+    processor.period = min(periods, key=lambda period: period_start(period) or pd.Timestamp.min)
+    processor.interval = "1d"
+    try:
+        bulk_closes = processor.close_prices_bulk(tickers)
+    finally:
+        processor.period, processor.interval = saved_settings
+
+    if processor.index_name in bulk_closes.errors:
+        raise ValueError(f"Could not download the index {processor.index_name}: {bulk_closes.errors[processor.index_name]}")
+    if bulk_closes.errors:
+        print(f"Failed downloads ({len(bulk_closes.errors)}): {', '.join(bulk_closes.errors)}")
+    tickers = [ticker for ticker in tickers if ticker not in bulk_closes.errors]
+
+    states = {}
+    for interval in intervals:
+        for period in periods:
+            state = IncrementalBetaState.from_closes(bulk_closes.closes, processor.index_name, tickers, period, interval, risk_free)
+            state.save(state_dir(directory, period, interval))
+            states[(period, interval)] = state
+    return states
+
+#States saved in a directory, {(period, interval): state}
+def load_states(directory=INCREMENTAL_STATE_DIR):
+    states = {}
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if os.path.exists(os.path.join(directory, name, "state.npz")):
+            state = IncrementalBetaState.load(os.path.join(directory, name))
+            states[(state.period, state.interval)] = state
+    return states
+
+#Appending the last daily closes to every saved state and saving them again, one small download for all the states
+#Days already in a state are skipped, days inside its last (forming) week or month revise that bar
+@timed("refresh_states")
+def refresh_states(directory=INCREMENTAL_STATE_DIR, processor=None, now=None):
+    states = load_states(directory)
+    if not states:
+        raise ValueError(f"No incremental state in {directory}, run build first")
+
+    processor = processor if processor is not None else DataPreprocessor()
+    index_name = next(iter(states.values())).index_name
+    processor.index_name = index_name
+    tickers = list(dict.fromkeys(ticker for state in states.values() for ticker in state.tickers))
+
+    saved_settings = processor.period, processor.interval
+    processor.period, processor.interval = REFRESH_PERIOD, "1d"
+    try:
+        bulk_closes = processor.close_prices_bulk(tickers)
+    finally:
+        processor.period, processor.interval = saved_settings
+
+    if index_name in bulk_closes.errors:
+        raise ValueError(f"Could not download the index {index_name}: {bulk_closes.errors[index_name]}")
+    daily_closes = align_to_calendar(bulk_closes.closes, index_name, "1d")
+
+    appended = {}
+    for key, state in states.items():
+        with timed("refresh_state", quiet=True):
+            last_date = state.dates[-1] if state.dates else pd.Timestamp.min
+            count = 0
+            for date, closes in daily_closes.iterrows():
+                if normalize_bar_dates([date], state.interval)[0] < last_date or (state.interval == "1d" and date <= last_date):
+                    continue
+                state.append_closes(date, closes, now=now)
+                count += 1
+            state.save(state_dir(directory, *key))
+        appended[key] = count
+    return states, appended
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental beta/CAPM state of a universe, updated after each close")
+    parser.add_argument("command", choices=["build", "refresh", "show"])
+    parser.add_argument("--universe", default=DEFAULT_UNIVERSE)
+    parser.add_argument("--tickers", type=int, default=None, help="Only the first N tickers of the universe")
+    parser.add_argument("--periods", nargs="+", default=["5y"], choices=PERIODS)
+    parser.add_argument("--intervals", nargs="+", default=["1mo"])
+    parser.add_argument("--risk-free", default=str(RISK_FREE_RATE), help="Annual risk-free rate (e.g. 0.042) or a treasury ticker (^IRX, ^FVX, ^TNX)")
+    parser.add_argument("--state-dir", default=INCREMENTAL_STATE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        tickers = list(load_universe(args.universe))
+        if args.tickers is not None:
+            tickers = tickers[:args.tickers]
+        try:
+            risk_free = float(args.risk_free)
+        except ValueError:
+            risk_free = args.risk_free
+        states = build_states(tickers, args.periods, args.intervals, risk_free, args.state_dir)
+    elif args.command == "refresh":
+        states, appended = refresh_states(args.state_dir)
+        for (period, interval), count in appended.items():
+            print(f"{period} {interval}: {count} new daily closes")
+    else:
+        states = load_states(args.state_dir)
+
+    for (period, interval), state in states.items():
+        last_date = state.dates[-1].date() if state.dates else None
+        print(f"{period} {interval}: {len(state.tickers)} tickers, {len(state.dates)} bars up to {last_date}")
+        print(state.all_info().head(10).to_string())
+
+if __name__ == "__main__":
+    main()
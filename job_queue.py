@@ -0,0 +1,136 @@
+#Background jobs for the dashboard: analyses run on a local worker pool and the UI polls their progress by job ID
+#Jobs with the same key (same parameters) are deduplicated, so concurrent users share one computation
+
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class Job():
+    def __init__(self, key, stage_weights=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        #queued, running, done or error
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        #Share of the total work of each stage, used for the overall fraction and the ETA
+        self.stage_weights = stage_weights or {}
+        #{stage: (done, total)}
+        self.progress = {}
+        self.stage = None
+        #Latest partial result published by the job function while it runs
+        self.partial_result = None
+        self._lock = threading.Lock()
+
+    #Progress callback given to the job function: stage name, units done and total units of that stage
+    def report(self, stage, done, total):
+        with self._lock:
+            self.stage = stage
+            self.progress[stage] = (done, total)
+
+    #Making a partial result available to the pollers before the job finishes
+    def publish(self, partial_result):
+        with self._lock:
+            self.partial_result = partial_result
+
+    def fraction_done(self):
+        with self._lock:
+            if self.status == "done":
+                return 1.0
+            weights = self.stage_weights or {stage: 1.0 for stage in self.progress}
+            total_weight = sum(weights.values())
+            if not total_weight:
+                return 0.0
+            done_weight = 0.0
+            for stage, (done, total) in self.progress.items():
+                if total:
+                    done_weight += weights.get(stage, 0.0) * min(done / total, 1.0)
+            return done_weight / total_weight
+
+    #Seconds left, extrapolated from the time spent so far and the fraction done
+    def eta_seconds(self):
+        fraction = self.fraction_done()
+        if self.started_at is None or fraction <= 0:
+            return None
+        if fraction >= 1:
+            return 0.0
+        elapsed = time.time() - self.started_at
+        return elapsed * (1 - fraction) / fraction
+
+    def snapshot(self):
+        with self._lock:
+            progress = dict(self.progress)
+            stage = self.stage
+        return {
+            "id": self.id,
+            "status": self.status,
+            "stage": stage,
+            "progress": progress,
+            "fraction_done": self.fraction_done(),
+            "eta_seconds": self.eta_seconds(),
+            "error": self.error,
+        }
+
+class JobQueue():
+    def __init__(self, max_workers=2, retention_seconds=600):
+        self.max_workers = max_workers
+        #Finished jobs stay available for polling during retention_seconds
+        self.retention_seconds = retention_seconds
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs = {}
+        #Key of every queued or running job -> job, used for deduplication
+        self._active = {}
+        self._lock = threading.Lock()
+
+    #Submitting function(job) under key, returns the already queued/running job with the same key if there is one
+    #on_done(job) is called in the worker when the function succeeds (e.g. to fill a result cache)
+    def submit(self, key, function, stage_weights=None, on_done=None):
+        with self._lock:
+            self._drop_expired()
+
+            if key in self._active:
+                return self._active[key]
+
+            job = Job(key, stage_weights)
+            self._jobs[job.id] = job
+            self._active[key] = job
+
+        self._executor.submit(self._run, job, function, on_done)
+        return job
+
+    def _run(self, job, function, on_done):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = function(job)
+            job.status = "done"
+            if on_done is not None:
+                on_done(job)
+        except Exception as e:
+            job.error = f"{e}\n{traceback.format_exc()}"
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _drop_expired(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.retention_seconds:
+                del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
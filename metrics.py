@@ -0,0 +1,200 @@
+#Instrumentation: stage timings, per-ticker durations and counters (network bytes, retries, cache hits) in one registry
+#The dashboard exposes the registry on /metrics, stages can be profiled with cProfile (or pyinstrument) through CAPM_PROFILE
+#Usage: @timed("beta_calc_all") on a method, or with timed("fundamentals", ticker=ticker): around a block
+
+import functools
+import inspect
+import os
+import threading
+import time
+
+PROFILE_DIR = "data/profiles"
+
+#Printing "<stage> finished --- s seconds ---" for the stage timings (per-ticker and quiet timings are only recorded)
+PRINT_TIMINGS = True
+
+class MetricsRegistry():
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        #{stage: {"count", "total_seconds", "min_seconds", "max_seconds", "last_seconds"}}
+        self.timings = {}
+        #{(name, ((label, value), ...)): value}
+        self.counters = {}
+        #{stage: {ticker: seconds of the last call}}
+        self.ticker_durations = {}
+        #{name: function returning a dict of values}, read when the registry is exported (e.g. ResultCache.stats)
+        self.collectors = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timing = self.timings.get(stage)
+            if timing is None:
+                timing = self.timings[stage] = {"count": 0, "total_seconds": 0.0, "min_seconds": seconds, "max_seconds": seconds}
+            timing["count"] += 1
+            timing["total_seconds"] += seconds
+            timing["min_seconds"] = min(timing["min_seconds"], seconds)
+            timing["max_seconds"] = max(timing["max_seconds"], seconds)
+            timing["last_seconds"] = seconds
+
+    def observe_ticker(self, stage, ticker, seconds):
+        with self._lock:
+            self.ticker_durations.setdefault(stage, {})[ticker] = seconds
+        self.observe(f"{stage}.ticker", seconds)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def register_collector(self, name, function):
+        self.collectors[name] = function
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counters = {}
+            self.ticker_durations = {}
+            self.started_at = time.time()
+
+    #Plain dict of everything recorded, with the slowest tickers of each stage
+    def snapshot(self, slowest_tickers=10):
+        with self._lock:
+            timings = {stage: dict(timing) for stage, timing in self.timings.items()}
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+            slowest = {stage: sorted(durations.items(), key=lambda item: item[1], reverse=True)[:slowest_tickers]
+                       for stage, durations in self.ticker_durations.items()}
+
+        collected = {}
+        for name, function in self.collectors.items():
+            try:
+                collected[name] = function()
+            except Exception as e:
+                collected[name] = {"error": repr(e)}
+
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "timings": timings,
+            "counters": counters,
+            "slowest_tickers": slowest,
+            "collectors": collected,
+        }
+
+    #Prometheus text exposition format
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = [f"capm_uptime_seconds {snapshot['uptime_seconds']:.3f}"]
+
+        for stage, timing in sorted(snapshot["timings"].items()):
+            for field in ("count", "total_seconds", "min_seconds", "max_seconds", "last_seconds"):
+                lines.append(f'capm_stage_{field}{{stage="{stage}"}} {timing[field]}')
+
+        for counter in sorted(snapshot["counters"], key=lambda counter: (counter["name"], sorted(counter["labels"].items()))):
+            labels = ",".join(f'{label}="{value}"' for label, value in sorted(counter["labels"].items()))
+            lines.append(f"capm_{counter['name']}{{{labels}}} {counter['value']}" if labels else f"capm_{counter['name']} {counter['value']}")
+
+        for name, values in sorted(snapshot["collectors"].items()):
+            for field, value in sorted(values.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"capm_{name}_{field} {value}")
+
+        return "\n".join(lines) + "\n"
+
+#Registry shared by the whole process
+registry = MetricsRegistry()
+
+#Stages profiled (set of names, or "all") and the profiler used, read from CAPM_PROFILE / CAPM_PROFILER by default
+#e.g. CAPM_PROFILE=run_all_analysis,fundamentals_fetch CAPM_PROFILER=pyinstrument python app.py
+_profile_stages = set(filter(None, os.environ.get("CAPM_PROFILE", "").split(",")))
+_profiler_name = os.environ.get("CAPM_PROFILER", "cprofile")
+#Only one profiler runs at a time (nested stages and other threads are not profiled separately)
+_profiler_lock = threading.Lock()
+
+def set_profiling(stages, profiler="cprofile"):
+    global _profile_stages, _profiler_name
+    _profile_stages = set(stages or ())
+    _profiler_name = profiler
+
+def _start_profiler(stage):
+    if not (stage in _profile_stages or "all" in _profile_stages):
+        return None
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+
+    try:
+        if _profiler_name == "pyinstrument":
+            from pyinstrument import Profiler
+            profiler = Profiler()
+        else:
+            import cProfile
+            profiler = cProfile.Profile()
+        profiler.enable() if _profiler_name != "pyinstrument" else profiler.start()
+        return profiler
+    except Exception as e:
+        _profiler_lock.release()
+        print(f"Could not profile {stage}: {e}")
+        return None
+
+#Writing the profile to PROFILE_DIR (.prof for cProfile, readable with pstats/snakeviz, .html for pyinstrument)
+def _stop_profiler(profiler, stage):
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{stage}-{time.strftime('%Y%m%dT%H%M%S')}")
+        if _profiler_name == "pyinstrument":
+            profiler.stop()
+            with open(path + ".html", "w") as profile_file:
+                profile_file.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+    finally:
+        _profiler_lock.release()
+
+#Timing a stage (or one ticker of a stage) into the registry, as a context manager or a decorator
+#Works on generator functions too, the time then runs until the generator is exhausted
+class timed():
+    def __init__(self, stage, ticker=None, quiet=False, metrics=None):
+        self.stage = stage
+        self.ticker = ticker
+        #quiet timings are recorded without being printed
+        self.quiet = quiet
+        self.metrics = metrics or registry
+
+    def __enter__(self):
+        self._profiler = _start_profiler(self.stage) if self.ticker is None else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            _stop_profiler(self._profiler, self.stage)
+
+        if self.ticker is not None:
+            self.metrics.observe_ticker(self.stage, self.ticker, self.seconds)
+        else:
+            self.metrics.observe(self.stage, self.seconds)
+            if PRINT_TIMINGS and not self.quiet:
+                print("%s finished --- %s seconds ---" % (self.stage, self.seconds))
+
+        if exc_type is not None:
+            self.metrics.increment("stage_errors", stage=self.stage)
+        return False
+
+    def __call__(self, function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                with timed(self.stage, self.ticker, self.quiet, self.metrics):
+                    yield from function(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage, self.ticker, self.quiet, self.metrics):
+                return function(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,238 @@
+#Headless batch runner: returns, betas, CAPM and market caps of a whole universe, published as a versioned analysis snapshot
+#Replaces the ad-hoc CSVs of saving_all_returns/saving_all_analysis, the dashboard serves its requests from the latest snapshot
+#Usage: python pipeline.py [--universe sp500] [--tickers 500] [--periods 1y 5y] [--intervals 1d 1mo] [--fundamentals-workers 32] ...
+
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+
+from data_preprocessing import PERIODS, INTERVALS
+from capm_engine import RISK_FREE_RATE
+from factor_engine import download_factors
+from fundamentals import FundamentalsFetcher
+from metrics import registry, set_profiling, timed
+from returns_snapshot import KEEP_VERSIONS, SnapshotReader, current_version, publish_version, read_store, write_store
+from tickers_analysis import analyzer, period_first_row
+from universe import DEFAULT_UNIVERSE, load_universe
+
+ANALYSIS_SNAPSHOT_DIR = "data/snapshots/analysis"
+
+#Files of a snapshot version: the (period, interval, ticker) cube, the fundamentals, the returns of each interval and
+#the annual risk-free rates of a treasury ticker (only when the run used one)
+CUBE_FILE = "cube.parquet"
+FUNDAMENTALS_FILE = "fundamentals.parquet"
+RISK_FREE_FILE = "risk_free.parquet"
+META_FILE = "meta.json"
+
+#Directory of the ReturnsStore of an interval inside a version
+def returns_dir(version_dir, interval):
+    return os.path.join(version_dir, f"returns_{interval}")
+
+#Running every stage for the universe and publishing the result, returns (version, {stage: seconds})
+#number_of_tickers: first N tickers of the universe (all of them by default)
+#chunk_size: tickers per yf.download call, fundamentals_workers/calls_per_second: concurrency and rate of the .info calls
+#async_concurrency: when set, prices are fetched with the asyncio fetcher and that many requests in flight
+#price_cache: optional PriceCache, so a nightly run only downloads the new bars
+#risk_free: annual risk-free rate, or the treasury ticker whose yields are used (e.g. "^IRX")
+def run_pipeline(universe_name=DEFAULT_UNIVERSE, number_of_tickers=None, periods=PERIODS, intervals=INTERVALS,
+                 chunk_size=100, fundamentals_workers=32, calls_per_second=50, async_concurrency=None,
+                 price_cache=None, risk_free=RISK_FREE_RATE, snapshot_dir=ANALYSIS_SNAPSHOT_DIR, keep=KEEP_VERSIONS):
+    start_time = time.perf_counter()
+    timings = {}
+
+    tickers = list(load_universe(universe_name))
+    if number_of_tickers is not None:
+        tickers = tickers[:number_of_tickers]
+
+    tickers_instance = analyzer()
+    tickers_instance.universe = universe_name
+    tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = len(tickers)
+    tickers_instance.index_processor.chunk_size = chunk_size
+    tickers_instance.index_processor.price_cache = price_cache
+    if async_concurrency:
+        from async_fetcher import AsyncQuoteFetcher
+        tickers_instance.index_processor.data_source = AsyncQuoteFetcher(max_concurrency=async_concurrency)
+    tickers_instance.fundamentals_fetcher = FundamentalsFetcher(max_workers=fundamentals_workers, calls_per_second=calls_per_second)
+    if isinstance(risk_free, str):
+        tickers_instance.use_risk_free_series(risk_free)
+    else:
+        tickers_instance.risk_free = risk_free
+
+    #Prices, returns, betas and CAPM of every (period, interval) from one daily download
+    with timed("pipeline_prices_betas_capm", quiet=True) as stage:
+        cube = tickers_instance.run_all_combinations(tickers, periods=periods, intervals=intervals)
+    timings["prices_betas_capm"] = stage.seconds
+
+    #Market cap, Yahoo beta, name and sector of the tickers that could be downloaded
+    with timed("pipeline_fundamentals", quiet=True) as stage:
+        analyzed_tickers = list(dict.fromkeys(cube["Ticker"]))
+        fundamentals_df = tickers_instance.fundamentals_fetcher.fetch(analyzed_tickers)
+    timings["fundamentals"] = stage.seconds
+
+    #Writing the snapshot, the CURRENT pointer only moves once every file is written
+    write_start = time.perf_counter()
+    metadata = {
+        "universe": universe_name,
+        "index_name": tickers_instance.index_name,
+        "as_of": pd.Timestamp.now().normalize().isoformat(),
+        "periods": list(periods),
+        "intervals": list(intervals),
+        "risk_free": risk_free,
+        "pairwise": tickers_instance.pairwise,
+        "tickers": analyzed_tickers,
+        "fetch_errors": tickers_instance.fetch_errors,
+        "fundamentals_errors": tickers_instance.fundamentals_fetcher.errors,
+        "settings": {"chunk_size": chunk_size, "fundamentals_workers": fundamentals_workers,
+                     "calls_per_second": calls_per_second, "async_concurrency": async_concurrency},
+    }
+
+    def write_files(version_dir, version):
+        cube.to_parquet(os.path.join(version_dir, CUBE_FILE), index=False)
+        fundamentals_df.to_parquet(os.path.join(version_dir, FUNDAMENTALS_FILE), index=False)
+        if isinstance(tickers_instance.risk_free, pd.Series):
+            tickers_instance.risk_free.to_frame("Risk Free").to_parquet(os.path.join(version_dir, RISK_FREE_FILE))
+        for interval, store in tickers_instance.combination_returns.items():
+            write_store(store, returns_dir(version_dir, interval), store.metadata)
+        timings["write"] = time.perf_counter() - write_start
+        timings["total"] = time.perf_counter() - start_time
+        with open(os.path.join(version_dir, META_FILE), "w") as meta_file:
+            json.dump({"version": version, "created_at": time.time(), **metadata, "timings": timings}, meta_file, indent=1)
+
+    version = publish_version(write_files, snapshot_dir, keep)
+    registry.observe("run_pipeline", time.perf_counter() - start_time)
+
+    return version, timings
+
+#Read-only view of a published analysis snapshot, answers dashboard requests without any download
+class AnalysisSnapshot():
+    def __init__(self, version_dir):
+        self.version_dir = version_dir
+        with open(os.path.join(version_dir, META_FILE)) as meta_file:
+            self.metadata = json.load(meta_file)
+        self.version = self.metadata["version"]
+        self.index_name = self.metadata["index_name"]
+        self.cube = pd.read_parquet(os.path.join(version_dir, CUBE_FILE))
+        self.fundamentals_df = pd.read_parquet(os.path.join(version_dir, FUNDAMENTALS_FILE))
+        #Risk-free rate of the run: the stored yields of a treasury ticker, or the constant rate
+        risk_free_path = os.path.join(version_dir, RISK_FREE_FILE)
+        if os.path.exists(risk_free_path):
+            self.risk_free = pd.read_parquet(risk_free_path)["Risk Free"].rename(self.metadata["risk_free"])
+        else:
+            self.risk_free = self.metadata.get("risk_free", RISK_FREE_RATE)
+        self.pairwise = self.metadata.get("pairwise", True)
+        self.tickers = set(self.metadata["tickers"])
+        #{interval: ReturnsStore}, memory mapped on first use
+        self._stores = {}
+
+    @classmethod
+    def open(cls, snapshot_dir=ANALYSIS_SNAPSHOT_DIR, version=None):
+        version = version or current_version(snapshot_dir)
+        if version is None:
+            raise FileNotFoundError(f"No analysis snapshot published in {snapshot_dir}")
+        return cls(os.path.join(snapshot_dir, version))
+
+    def returns_store(self, interval):
+        if interval not in self._stores:
+            self._stores[interval] = read_store(returns_dir(self.version_dir, interval))
+        return self._stores[interval]
+
+    #True when the snapshot has the period, interval and every selected ticker for the index in use
+    def covers(self, period, interval, selected_tickers, index_name=None):
+        return ((index_name is None or index_name == self.index_name)
+                and period in self.metadata["periods"] and interval in self.metadata["intervals"]
+                and all(ticker in self.tickers for ticker in selected_tickers))
+
+    #analyzer holding the same state as a live run (returns_data, ticker_names, beta_stats, beta_all_df, all_info, and the
+    #risk-free rate and pairwise setting of the run, so statistics recomputed from it match the cube)
+    def analyzer_for(self, period, interval, selected_tickers):
+        tickers_instance = analyzer()
+        tickers_instance.index_name = self.index_name
+        tickers_instance.period = tickers_instance.index_processor.period = period
+        tickers_instance.interval = tickers_instance.index_processor.interval = interval
+        tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = len(selected_tickers)
+        tickers_instance.pairwise = self.pairwise
+        #A treasury ticker whose yields are not in the snapshot has them fetched again
+        if isinstance(self.risk_free, str):
+            tickers_instance.use_risk_free_series(self.risk_free)
+        else:
+            tickers_instance.risk_free = self.risk_free
+
+        #Returns of the period, sliced out of the returns of the longest period like in run_all_combinations
+        store = self.returns_store(interval)
+        #Daily calendar of the index: the daily return dates and the bar before the first one
+        trading_days = None
+        if "1d" in self.metadata["intervals"]:
+            daily_store = self.returns_store("1d")
+            trading_days = daily_store.index.insert(0, pd.Timestamp(daily_store.metadata["first_bar"]))
+        first_row = period_first_row(store.index, period, store.metadata["first_bar"], now=self.metadata["as_of"], interval=interval,
+                                     trading_days=trading_days)
+        columns = [f"{ticker} Returns" for ticker in [self.index_name] + list(selected_tickers)]
+        tickers_instance.returns_data = store.to_frame().iloc[first_row:][columns]
+        tickers_instance.get_stock_ticker_names()
+
+        selection = self.cube[(self.cube["Period"] == period) & (self.cube["Interval"] == interval)]
+        tickers_instance.beta_stats = selection.set_index("Ticker").loc[list(selected_tickers)].reset_index()
+
+        all_info = tickers_instance.all_info_from_cube(tickers_instance.beta_stats, period, interval)
+        tickers_instance.beta_all_df = all_info[f"Beta {period} {interval}"].reset_index()
+        tickers_instance.fundamentals_df = self.fundamentals_df.set_index("Ticker").reindex(list(selected_tickers)).reset_index()
+        tickers_instance.all_info = pd.merge(all_info.reset_index(), tickers_instance.fundamentals_df, on="Ticker", how="left").set_index("Ticker")
+
+        return tickers_instance
+
+#Latest analysis snapshot of a directory for a long-running process (None until one is published)
+def analysis_snapshot_reader(snapshot_dir=ANALYSIS_SNAPSHOT_DIR, check_interval_seconds=5):
+    return SnapshotReader(snapshot_dir, check_interval_seconds, open_version=lambda directory, version: AnalysisSnapshot.open(directory, version))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute the analysis of a whole universe and publish it as a snapshot")
+    parser.add_argument("--universe", default=DEFAULT_UNIVERSE)
+    parser.add_argument("--tickers", type=int, default=None, help="Only the first N tickers of the universe")
+    parser.add_argument("--periods", nargs="+", default=PERIODS)
+    parser.add_argument("--intervals", nargs="+", default=INTERVALS)
+    parser.add_argument("--chunk-size", type=int, default=100, help="Tickers per price download request")
+    parser.add_argument("--async-concurrency", type=int, default=None, help="Fetch prices with asyncio, this many requests in flight")
+    parser.add_argument("--fundamentals-workers", type=int, default=32)
+    parser.add_argument("--calls-per-second", type=float, default=50, help="Rate limit of the fundamentals requests")
+    parser.add_argument("--price-cache", action="store_true", help="Serve prices from the on-disk cache, only download the new bars")
+    parser.add_argument("--risk-free", default=str(RISK_FREE_RATE), help="Annual risk-free rate (e.g. 0.042) or a treasury ticker (^IRX, ^FVX, ^TNX)")
+    parser.add_argument("--snapshot-dir", default=ANALYSIS_SNAPSHOT_DIR)
+    parser.add_argument("--keep", type=int, default=KEEP_VERSIONS, help="Number of versions kept on disk")
+    parser.add_argument("--fetch-factors", action="store_true", help="Download the Fama-French factor files to data/factors first")
+    parser.add_argument("--profile", nargs="*", default=None, help="Stages to profile with cProfile (all of them when no stage is given)")
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        set_profiling(args.profile or ["all"])
+
+    #The factor files are optional, the analysis is published without them when the download fails
+    if args.fetch_factors:
+        try:
+            print(f"Downloaded {', '.join(download_factors())}")
+        except (OSError, ValueError) as e:
+            print(f"Fama-French factors not downloaded: {e}")
+
+    price_cache = None
+    if args.price_cache:
+        from price_cache import PriceCache
+        price_cache = PriceCache()
+
+    try:
+        risk_free = float(args.risk_free)
+    except ValueError:
+        risk_free = args.risk_free
+
+    version, timings = run_pipeline(args.universe, args.tickers, args.periods, args.intervals,
+                                    chunk_size=args.chunk_size, fundamentals_workers=args.fundamentals_workers,
+                                    calls_per_second=args.calls_per_second, async_concurrency=args.async_concurrency,
+                                    price_cache=price_cache, risk_free=risk_free, snapshot_dir=args.snapshot_dir, keep=args.keep)
+
+    print(f"Published analysis snapshot {version} to {args.snapshot_dir}")
+    for stage, seconds in timings.items():
+        print(f"{stage:<20}{seconds:>10.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#On-disk price cache: one Parquet file of closes per (interval, ticker)
+#Only the missing tail since the last cached bar is downloaded, every period is served by slicing the cached series
+
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import quote
+
+import pandas as pd
+
+from metrics import registry
+
+CACHE_DIR = "data/cache/prices"
+
+#Raw close and the dividend/split adjusted close (the one used for the returns)
+CACHED_FIELDS = ("Close", "Adj Close")
+
+#US market close, cached bars are fresh until the next session closes
+MARKET_TIMEZONE = "America/New_York"
+MARKET_CLOSE_HOUR = 16
+
+#Relative difference above which a re-downloaded bar is considered restated (dividend or split adjustment)
+RESTATEMENT_TOLERANCE = 1e-6
+
+#Epoch seconds of the most recent weekday 16:00 New York close before `now` (exchange holidays are not skipped)
+def last_market_close(now=None):
+    now = time.time() if now is None else now
+    now_market = pd.Timestamp(now, unit="s", tz="UTC").tz_convert(MARKET_TIMEZONE)
+
+    market_close = now_market.normalize() + pd.Timedelta(hours=MARKET_CLOSE_HOUR)
+    if now_market < market_close:
+        market_close -= pd.Timedelta(days=1)
+    while market_close.weekday() >= 5:
+        market_close -= pd.Timedelta(days=1)
+
+    return market_close.timestamp()
+
+#First date covered by a yfinance period ("5y", "6mo", "ytd", ...), None for "max"
+def period_start(period, now=None):
+    today = pd.Timestamp.now().normalize() if now is None else pd.Timestamp(now).normalize()
+
+    if period == "max":
+        return None
+    if period == "ytd":
+        return pd.Timestamp(year=today.year, month=1, day=1)
+
+    match = re.fullmatch(r"(\d+)(y|mo|wk|d)", period)
+    if match is None:
+        raise ValueError(f"Unknown period: {period}")
+
+    amount, unit = int(match.group(1)), match.group(2)
+    if unit == "y":
+        return today - pd.DateOffset(years=amount)
+    if unit == "mo":
+        return today - pd.DateOffset(months=amount)
+    if unit == "wk":
+        return today - pd.DateOffset(weeks=amount)
+    return today - pd.DateOffset(days=amount)
+
+#True when period_a covers at least as much history as period_b
+def _covers(period_a, period_b):
+    start_a, start_b = period_start(period_a), period_start(period_b)
+    if start_a is None:
+        return True
+    if start_b is None:
+        return False
+    return start_a <= start_b
+
+class PriceCache():
+    def __init__(self, cache_dir=CACHE_DIR, ttl_seconds=None, fetch_period=None):
+        self.cache_dir = cache_dir
+        #Optional maximum age of a cached series, on top of the market close rule
+        self.ttl_seconds = ttl_seconds
+        #Optional minimum period of a first download (e.g. "20y") so shorter periods never need a refetch
+        self.fetch_period = fetch_period
+
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary_path = self._index_path + ".tmp"
+        with open(temporary_path, "w") as index_file:
+            json.dump(self._index, index_file, indent=1, sort_keys=True)
+        os.replace(temporary_path, self._index_path)
+
+    @staticmethod
+    def _key(ticker, interval):
+        return f"{interval}/{ticker}"
+
+    def _file_path(self, ticker, interval):
+        return os.path.join(self.cache_dir, interval, quote(ticker, safe="") + ".parquet")
+
+    def read(self, ticker, interval):
+        return pd.read_parquet(self._file_path(ticker, interval))
+
+    def _write(self, ticker, interval, bars, period):
+        path = self._file_path(ticker, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        #Writing to a temporary file first so readers never see a half-written file
+        temporary_path = path + ".tmp"
+        bars.to_parquet(temporary_path)
+        os.replace(temporary_path, path)
+
+        self._index[self._key(ticker, interval)] = {
+            "fetched_at": time.time(),
+            "period": period,
+            "last_date": bars.index[-1].isoformat(),
+        }
+
+    def is_cached(self, ticker, interval):
+        return self._key(ticker, interval) in self._index
+
+    #A cached series is stale once a market session closed after it was fetched, or when it is older than ttl_seconds
+    def is_stale(self, ticker, interval, now=None):
+        entry = self._index.get(self._key(ticker, interval))
+        if entry is None:
+            return True
+
+        now = time.time() if now is None else now
+        if self.ttl_seconds is not None and now - entry["fetched_at"] > self.ttl_seconds:
+            return True
+        return entry["fetched_at"] < last_market_close(now)
+
+    #Removing cached series, all of them by default, or only the given tickers and/or interval
+    #Returns the number of series removed
+    def invalidate(self, tickers=None, interval=None):
+        with self._lock:
+            removed = 0
+            for key in list(self._index):
+                key_interval, key_ticker = key.split("/", 1)
+                if tickers is not None and key_ticker not in tickers:
+                    continue
+                if interval is not None and key_interval != interval:
+                    continue
+
+                del self._index[key]
+                try:
+                    os.remove(self._file_path(key_ticker, key_interval))
+                except OSError:
+                    pass
+                removed += 1
+
+            self._save_index()
+            return removed
+
+    def clear(self):
+        return self.invalidate()
+
+    #Downloading the whole period for tickers that are not cached (or whose cached history is restated/too short)
+    #Returns {ticker: (bars, period)}, nothing is written (the downloads run outside the lock)
+    def _fetch_full(self, tickers, period, interval, download, errors):
+        if self.fetch_period is not None and _covers(self.fetch_period, period):
+            period = self.fetch_period
+
+        bars, download_errors = download(tickers, fields=CACHED_FIELDS, period=period, interval=interval)
+        errors.update(download_errors)
+
+        fetched = {}
+        for ticker in tickers:
+            if ticker in download_errors:
+                continue
+            ticker_bars = pd.DataFrame({field: bars[field][ticker] for field in CACHED_FIELDS}).dropna(subset=["Close"])
+            fetched[ticker] = (ticker_bars, period)
+        return fetched
+
+    #Downloading only the bars since the last final cached bar and appending them, cached: {ticker: (bars, period)}
+    #Returns {ticker: (bars, period)} of the refreshed series, and the tickers whose overlapping bar changed (dividend or
+    #split), they need a full refetch
+    def _fetch_tail(self, cached, interval, download):
+        #The last cached bar may still be forming (e.g. the current month), so the tail starts at the one before it
+        #That bar is final, if its value changed the whole adjusted history was restated
+        groups = {}
+        for ticker, (ticker_bars, _) in cached.items():
+            check_date = ticker_bars.index[-2] if len(ticker_bars) > 1 else ticker_bars.index[-1]
+            groups.setdefault(check_date, []).append(ticker)
+
+        fetched = {}
+        restated = []
+        for check_date, group in groups.items():
+            bars, download_errors = download(group, fields=CACHED_FIELDS, start=check_date.strftime("%Y-%m-%d"), interval=interval)
+
+            for ticker in group:
+                if ticker in download_errors:
+                    #Keeping the stale series, the next call will try again
+                    print(f"Could not refresh {ticker}, using cached prices: {download_errors[ticker]}")
+                    continue
+
+                new_bars = pd.DataFrame({field: bars[field][ticker] for field in CACHED_FIELDS}).dropna(subset=["Close"])
+                old_bars, cached_period = cached[ticker]
+
+                if check_date in new_bars.index:
+                    old_values = old_bars.loc[check_date, list(CACHED_FIELDS)].to_numpy(dtype=float)
+                    new_values = new_bars.loc[check_date, list(CACHED_FIELDS)].to_numpy(dtype=float)
+                    if (abs(new_values - old_values) > RESTATEMENT_TOLERANCE * abs(old_values)).any():
+                        restated.append(ticker)
+                        continue
+
+                #New bars replace the overlapping cached ones
+                ticker_bars = pd.concat([old_bars[old_bars.index < check_date], new_bars]).sort_index()
+                ticker_bars = ticker_bars[~ticker_bars.index.duplicated(keep="last")]
+                fetched[ticker] = (ticker_bars, cached_period)
+
+        return fetched, restated
+
+    #Writing downloaded series (under the lock), a series that another call stored after fetch_started and that covers
+    #as much history is kept instead
+    def _store(self, fetched, interval, fetch_started):
+        for ticker, (bars, period) in fetched.items():
+            entry = self._index.get(self._key(ticker, interval))
+            if entry is not None and entry["fetched_at"] >= fetch_started and _covers(entry["period"], period):
+                continue
+            self._write(ticker, interval, bars, period)
+
+    #Wide frame of adjusted closes for the tickers over the period, plus {ticker: error message}
+    #download(tickers, fields=..., **yf.download kwargs) returns ({field: wide frame}, errors), e.g. DataPreprocessor.download_bars
+    #The lock is only held to read and update the index and the files, calls for other tickers never wait behind a download
+    def closes(self, tickers, period, interval, download):
+        errors = {}
+
+        with self._lock:
+            full = []
+            tail = []
+            for ticker in tickers:
+                entry = self._index.get(self._key(ticker, interval))
+                if entry is None or not _covers(entry["period"], period):
+                    full.append(ticker)
+                elif self.is_stale(ticker, interval):
+                    tail.append(ticker)
+            cached = {ticker: (self.read(ticker, interval), self._index[self._key(ticker, interval)]["period"]) for ticker in tail}
+
+        registry.increment("price_cache_hits", len(tickers) - len(full) - len(tail), interval=interval)
+        registry.increment("price_cache_misses", len(full), interval=interval)
+        registry.increment("price_cache_tail_refreshes", len(tail), interval=interval)
+
+        fetch_started = time.time()
+        fetched = {}
+        if tail:
+            refreshed, restated = self._fetch_tail(cached, interval, download)
+            registry.increment("price_cache_restatements", len(restated), interval=interval)
+            fetched.update(refreshed)
+            full += restated
+        if full:
+            fetched.update(self._fetch_full(full, period, interval, download, errors))
+
+        with self._lock:
+            if fetched:
+                self._store(fetched, interval, fetch_started)
+                self._save_index()
+
+            start = period_start(period)
+            columns = []
+            for ticker in tickers:
+                if ticker in errors:
+                    continue
+                ticker_closes = self.read(ticker, interval)["Adj Close"].rename(ticker)
+                if start is not None:
+                    ticker_closes = ticker_closes[ticker_closes.index >= start]
+                columns.append(ticker_closes)
+
+        if columns:
+            all_closes = pd.concat(columns, axis=1, sort=True)
+        else:
+            all_closes = pd.DataFrame(columns=list(tickers), dtype=float)
+        all_closes.index.name = "Date"
+
+        return all_closes, errors
@@ -0,0 +1,118 @@
+#In-process LRU cache of finished analyses, so repeating a selection in the dashboard skips the download and compute
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from price_cache import last_market_close
+
+#Normalized key of a selection: the order and duplicates of the selected tickers do not matter
+def make_key(tickers, period, interval, index_name):
+    return (tuple(sorted(set(tickers))), period, interval, index_name)
+
+#Approximate memory footprint of a cached value in bytes (frames, arrays, figures and plain containers)
+def estimate_size(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(item, seen) for item in value)
+    #plotly figures
+    if hasattr(value, "to_json") and hasattr(value, "to_plotly_json"):
+        return len(value.to_json())
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_size(vars(value), seen)
+    return sys.getsizeof(value)
+
+class ResultCache():
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        #Optional maximum age of an entry, entries also expire at every market close
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _is_expired(self, created_at, now):
+        if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+            return True
+        #Results computed before the last market close miss that session's bar
+        return created_at < last_market_close(now)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, _, created_at = entry
+            if self._is_expired(created_at, time.time()):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            #Most recently used entries go to the end
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = estimate_size(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            #Values bigger than the whole cache are not stored
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, time.time())
+            self.total_bytes += size
+
+            #Evicting the least recently used entries until the cache fits its bounds again
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
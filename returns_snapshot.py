@@ -0,0 +1,162 @@
+#Read-only snapshots of the returns matrix shared by every Dash worker process through mmap
+#A refresher process writes a new version directory and publishes it by atomically replacing the CURRENT pointer
+
+import argparse
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from returns_store import ReturnsStore
+
+SNAPSHOT_DIR = "data/snapshots/returns"
+CURRENT_FILE = "CURRENT"
+
+#Number of published versions kept on disk (workers may still have an older one mapped)
+KEEP_VERSIONS = 3
+
+#Creating a new snapshot version with write_files(version_dir, version) and making it the current one
+#Used for the returns snapshots below and for the analysis snapshots of pipeline.py
+def publish_version(write_files, snapshot_dir=SNAPSHOT_DIR, keep=KEEP_VERSIONS):
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    #Versions sort in publication order
+    now_ns = time.time_ns()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now_ns // 10**9)) + f"{now_ns % 10**9:09d}-" + uuid.uuid4().hex[:8]
+    temporary_dir = os.path.join(snapshot_dir, f".tmp-{version}")
+    os.makedirs(temporary_dir)
+
+    try:
+        write_files(temporary_dir, version)
+    except BaseException:
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+        raise
+
+    #The version directory appears complete, then the pointer is swapped atomically
+    os.rename(temporary_dir, os.path.join(snapshot_dir, version))
+    pointer_path = os.path.join(snapshot_dir, CURRENT_FILE)
+    with open(pointer_path + ".tmp", "w") as pointer_file:
+        pointer_file.write(version)
+    os.replace(pointer_path + ".tmp", pointer_path)
+
+    _remove_old_versions(snapshot_dir, keep)
+
+    return version
+
+#Arrays and metadata of a ReturnsStore in a directory
+def write_store(store, directory, metadata=None):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "values.npy"), store.values)
+    np.save(os.path.join(directory, "dates.npy"), store.dates)
+    np.save(os.path.join(directory, "valid.npy"), store.valid_bits)
+    with open(os.path.join(directory, "meta.json"), "w") as meta_file:
+        json.dump({
+            "created_at": time.time(),
+            "index_name": store.index_name,
+            "tickers": store.tickers,
+            "dtype": str(store.values.dtype),
+            "shape": list(store.values.shape),
+            **(metadata or {}),
+        }, meta_file, indent=1)
+
+#ReturnsStore written by write_store, backed by read-only memory maps
+def read_store(directory):
+    with open(os.path.join(directory, "meta.json")) as meta_file:
+        metadata = json.load(meta_file)
+
+    values = np.load(os.path.join(directory, "values.npy"), mmap_mode="r")
+    dates = np.load(os.path.join(directory, "dates.npy"))
+    valid_bits = np.load(os.path.join(directory, "valid.npy"), mmap_mode="r")
+
+    store = ReturnsStore(values, dates, metadata["tickers"], metadata["index_name"], dtype=values.dtype, valid_bits=valid_bits)
+    store.metadata = metadata
+    return store
+
+#Writing a ReturnsStore as a new snapshot version and making it the current one
+#metadata (e.g. period and interval) is stored next to the arrays
+def publish_snapshot(store, snapshot_dir=SNAPSHOT_DIR, metadata=None, keep=KEEP_VERSIONS):
+    return publish_version(lambda version_dir, version: write_store(store, version_dir, {"version": version, **(metadata or {})}),
+                           snapshot_dir, keep)
+
+def _remove_old_versions(snapshot_dir, keep):
+    versions = list_versions(snapshot_dir)
+    current = current_version(snapshot_dir)
+    #Files still mapped by a worker stay readable after they are unlinked
+    for version in versions[:-keep]:
+        if version == current:
+            continue
+        shutil.rmtree(os.path.join(snapshot_dir, version), ignore_errors=True)
+
+def list_versions(snapshot_dir=SNAPSHOT_DIR):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(name for name in os.listdir(snapshot_dir)
+                  if not name.startswith(".") and os.path.isdir(os.path.join(snapshot_dir, name)))
+
+def current_version(snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, CURRENT_FILE)) as pointer_file:
+            return pointer_file.read().strip() or None
+    except OSError:
+        return None
+
+def read_metadata(snapshot_dir=SNAPSHOT_DIR, version=None):
+    version = version or current_version(snapshot_dir)
+    with open(os.path.join(snapshot_dir, version, "meta.json")) as meta_file:
+        return json.load(meta_file)
+
+#Opening a snapshot version (the current one by default) as a ReturnsStore backed by read-only memory maps
+def open_snapshot(snapshot_dir=SNAPSHOT_DIR, version=None):
+    version = version or current_version(snapshot_dir)
+    if version is None:
+        raise FileNotFoundError(f"No returns snapshot published in {snapshot_dir}")
+    return read_store(os.path.join(snapshot_dir, version))
+
+#Per-worker handle on the latest snapshot, reopened only when a new version is published
+#open_version(snapshot_dir, version) opens a version (open_snapshot by default), get() returns None until one is published
+class SnapshotReader():
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, check_interval_seconds=5, open_version=open_snapshot):
+        self.snapshot_dir = snapshot_dir
+        self.open_version = open_version
+        #Minimum time between two reads of the CURRENT pointer
+        self.check_interval_seconds = check_interval_seconds
+        self.version = None
+        self._store = None
+        self._last_check = 0.0
+
+    def get(self):
+        now = time.time()
+        if self._store is None or now - self._last_check >= self.check_interval_seconds:
+            self._last_check = now
+            version = current_version(self.snapshot_dir)
+            if version is not None and version != self.version:
+                self._store = self.open_version(self.snapshot_dir, version)
+                self.version = version
+        return self._store
+
+#Refresher: downloads the returns once and publishes them for every worker
+def main():
+    from tickers_analysis import analyzer
+
+    parser = argparse.ArgumentParser(description="Publish a returns snapshot for the dashboard workers")
+    parser.add_argument("--period", default="5y")
+    parser.add_argument("--interval", default="1mo")
+    parser.add_argument("--tickers", type=int, default=500, help="Number of tickers of the universe")
+    parser.add_argument("--float32", action="store_true", help="Store the returns in float32")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    tickers_instance = analyzer()
+    tickers_instance.number_of_tickers = tickers_instance.index_processor.number_of_tickers = args.tickers
+    tickers_instance.period = tickers_instance.index_processor.period = args.period
+    tickers_instance.interval = tickers_instance.index_processor.interval = args.interval
+
+    tickers_instance.returns_all_tickers()
+    version = tickers_instance.publish_returns_snapshot(args.snapshot_dir, dtype=np.float32 if args.float32 else np.float64)
+    print(f"Published returns snapshot {version} to {args.snapshot_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#Compact returns container: one contiguous (dates x columns) array, a shared date vector, a ticker -> column index
+#and a validity bitmask, instead of a DataFrame with one "<TICKER> Returns" column per ticker
+
+import numpy as np
+import pandas as pd
+
+from beta_engine import ticker_from_column
+
+class ReturnsStore():
+    #values: (T x N+1) array, column 0 holds the index returns and the other columns the stocks, NaN where missing
+    #dates: T datetime64 values, tickers: the N+1 names (index first)
+    #valid_bits can be given when already known (e.g. read from a snapshot), otherwise it is computed from the NaNs
+    def __init__(self, values, dates, tickers, index_name, dtype=np.float64, valid_bits=None):
+        self.values = np.ascontiguousarray(values, dtype=dtype)
+        self.dates = np.asarray(dates, dtype="datetime64[ns]")
+        self.tickers = list(tickers)
+        self.index_name = index_name
+        self.columns = {ticker: j for j, ticker in enumerate(self.tickers)}
+
+        #One bit per (date, column): 1 where there is a return, packed along the dates
+        if valid_bits is None:
+            valid_bits = np.packbits(~np.isnan(self.values), axis=0)
+        self.valid_bits = valid_bits
+
+        if self.values.shape != (len(self.dates), len(self.tickers)):
+            raise ValueError(f"values {self.values.shape} do not match {len(self.dates)} dates x {len(self.tickers)} tickers")
+        if self.columns.get(index_name) != 0:
+            raise ValueError(f"The index {index_name} must be the first column")
+
+    #From the returns df of analyzer.returns_all_tickers (index column first, then "<TICKER> Returns" columns)
+    #dtype=np.float32 halves the memory, the round trip to_frame() is only lossless with np.float64
+    @classmethod
+    def from_frame(cls, returns_data, index_name, dtype=np.float64):
+        index_column = f"{index_name} Returns"
+        columns = [index_column] + [column for column in returns_data.columns if column != index_column]
+        values = returns_data[columns].to_numpy(dtype=dtype)
+        tickers = [ticker_from_column(column) for column in columns]
+        return cls(values, returns_data.index.to_numpy(), tickers, index_name, dtype=dtype)
+
+    #Back to the DataFrame format of analyzer.returns_all_tickers (no copy of float64 values)
+    def to_frame(self):
+        return pd.DataFrame(self.values.astype(np.float64, copy=False), index=self.index,
+                            columns=[f"{ticker} Returns" for ticker in self.tickers], copy=False)
+
+    @property
+    def index(self):
+        return pd.DatetimeIndex(self.dates, name="Date")
+
+    @property
+    def stock_tickers(self):
+        return self.tickers[1:]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.dates.nbytes + self.valid_bits.nbytes
+
+    #Boolean (T x N+1) mask of the dates where each column has a return
+    def valid_mask(self):
+        return np.unpackbits(self.valid_bits, axis=0, count=len(self.dates)).astype(bool)
+
+    #Zero-copy views into the returns array
+    def index_view(self):
+        return self.values[:, 0]
+
+    def stock_view(self):
+        return self.values[:, 1:]
+
+    def column(self, ticker):
+        return self.values[:, self.columns[ticker]]
+
+    #Same contract as beta_engine.split_returns, so the beta engines read the store through views
+    def split_returns(self, index_column=None):
+        return self.index_view(), self.stock_view(), [f"{ticker} Returns" for ticker in self.stock_tickers]
@@ -2,11 +2,65 @@
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
-import time
-from data_preprocessing import DataPreprocessor
-
-start_time = time.time()
+from data_preprocessing import DataPreprocessor, BARS_PER_YEAR, PERIODS, INTERVALS, resample_closes, wide_returns
+from beta_engine import beta_stats, beta_stats_arrays, rolling_betas, ewma_betas, split_returns, ticker_from_column
+from bootstrap_engine import BOOTSTRAP_CONFIDENCE, BOOTSTRAP_RESAMPLES, bootstrap_betas
+from benchmark_engine import DEFAULT_BENCHMARKS, benchmark_grid
+from capm_engine import RISK_FREE_RATE, RATIO_COLUMNS, EXPECTED_RETURN_COLUMN, capm_stats_arrays, load_risk_free_rates, risk_free_per_bar
+from covariance_engine import RiskModel
+from data_quality import align_to_calendar, clean_returns, normalize_bar_dates, quality_summary
+from factor_engine import factor_stats, factors_file_for, load_factors
+from price_cache import period_start
+from fundamentals import FundamentalsFetcher
+from universe import load_universe, DEFAULT_UNIVERSE
+from returns_store import ReturnsStore
+from returns_snapshot import SNAPSHOT_DIR, publish_snapshot, open_snapshot
+from metrics import timed
+
+#Building the wide returns df (index column first, then one column per ticker) with one concat + reindex
+#Merging the tickers one by one copies the whole frame for every ticker, which is O(N²) in memory traffic
+def build_returns_matrix(index_returns, stock_returns):
+    #index_returns: Series of the index returns keyed on Date
+    #stock_returns: {ticker: Series of the ticker returns keyed on Date}
+    dates = index_returns.index
+    column_names = [index_returns.name] + [f"{ticker} Returns" for ticker in stock_returns]
+
+    #One contiguous float64 block, each ticker is aligned on the index dates (left join on Date) straight into its column
+    values = np.empty((len(dates), len(column_names)), dtype=np.float64)
+    values[:, 0] = index_returns.to_numpy(dtype=np.float64)
+    for j, returns in enumerate(stock_returns.values(), start=1):
+        values[:, j] = returns.reindex(dates).to_numpy(dtype=np.float64)
+
+    returns_all_tickers = pd.DataFrame(values, index=dates, columns=column_names, copy=False)
+    returns_all_tickers.index.name = "Date"
+
+    return returns_all_tickers
+
+#First trading day of a period downloaded on the day now (None for "max"): the first day on or after the period start
+#trading_days: daily calendar of the index, business days are assumed past its end or without one
+def period_first_day(period, now=None, trading_days=None):
+    start = period_start(period, now)
+    if start is None:
+        return None
+    if trading_days is not None and len(trading_days) and start <= trading_days[-1]:
+        return trading_days[trading_days.searchsorted(start)]
+    return pd.offsets.BDay().rollforward(start)
+
+#Date of the first bar of that download: the bar holding its first trading day, keyed on the bar start (the day, the
+#Monday of the week, the 1st of the month)
+def period_first_bar(period, now=None, interval="1d", trading_days=None):
+    first_day = period_first_day(period, now, trading_days)
+    if first_day is None:
+        return None
+    return normalize_bar_dates([first_day], interval)[0]
+
+#First row of a period in returns downloaded over a longer period (first_bar_date: date of the bar before the first return)
+#The first bar of the period (period_first_bar) has no return inside the period, as with a download of that period on the day now
+def period_first_row(return_dates, period, first_bar_date, now=None, interval="1d", trading_days=None):
+    earliest_bar = period_first_bar(period, now, interval, trading_days)
+    if earliest_bar is None or earliest_bar <= pd.Timestamp(first_bar_date):
+        return 0
+    return return_dates.searchsorted(earliest_bar) + 1
 
 class analyzer:
     def __init__(self):
@@ -19,58 +73,99 @@ class analyzer:
         self.period = self.index_processor.get_period()
         self.interval = self.index_processor.get_interval()
 
+        #Universe used when no tickers are selected (see universe.py)
+        self.universe = DEFAULT_UNIVERSE
+
         self.returns_data = None
         self.ticker_names = []
         self.all_info = None
         self.beta_all_df = None
+        #Full regression output of beta_calc_all (beta, alpha, R², standard error, observations)
+        self.beta_stats = None
+        #Bootstrap confidence intervals of the betas of beta_bootstrap_all
+        self.beta_intervals = None
+        #Returns of the other benchmarks on the dates of returns_data, each one downloaded once (see benchmark_returns_all)
+        self.benchmark_returns = None
+        #(benchmark, ticker) grid of betas and CAPM statistics of benchmark_grid_all
+        self.benchmark_grid = None
+        #Annual risk-free rate of the CAPM: a constant, or a Series of annual rates keyed on date (see use_risk_free_series)
+        self.risk_free = RISK_FREE_RATE
+        #Expected returns, Jensen's alpha, Treynor and Sharpe ratios of capm_all (unrounded)
+        self.capm_stats = None
+        #Loadings, t-stats and R² of factor_model_all (Fama-French 3 or 5 factors)
+        self.factor_stats = None
+        #Covariance matrix and betas of risk_model_all, for portfolio risk queries
+        self.risk_model = None
+        #Beta time series (dates x tickers) of rolling_beta_all
+        self.rolling_betas = None
+        #Concurrent .info fetcher and its last result (market cap, Yahoo beta, name, sector)
+        self.fundamentals_fetcher = FundamentalsFetcher()
+        self.fundamentals_df = None
+        #Optional progress_callback(stage, done, total) for the "prices", "betas" and "fundamentals" stages
+        self.progress_callback = None
+        #Use pairwise-complete observations for each ticker (False keeps only dates where every ticker has data)
+        self.pairwise = True
+        #{ticker: error message} of the tickers that failed in the last download
+        self.fetch_errors = {}
+        #"simple" or "log" returns (see data_quality.clean_returns)
+        self.returns_method = "simple"
+        #Per-ticker coverage and quality flags (short or stale history) of the last returns matrix
+        self.data_quality = None
+        #Tidy (period, interval, ticker) cube of run_all_combinations
+        self.combinations_df = None
+        #{interval: ReturnsStore} of the returns behind the cube (longest period, index first)
+        self.combination_returns = {}
     
-    #Creating a df with all the returns of all features (for the selected period and interval)
-    def returns_all_tickers(self, selected_tickers=None):
-        start_time = time.time()
+    #DataFrame with a "Ticker" column: the selected tickers, or the first N tickers of self.universe
+    def tickers_to_analyze(self, selected_tickers=None):
         if selected_tickers:
             # Create a DataFrame with the selected tickers
-            all_tickers = pd.DataFrame(selected_tickers, columns=["Ticker"])
-        else:
-            # Otherwise use the first N tickers from the S&P 500 (original behavior)
-            all_stocks = pd.read_html("data/sp500_components.html")[0]
-            all_tickers = pd.DataFrame([all_stocks.iloc[i, 0] for i in range(len(all_stocks))], columns=["Ticker"])
-            all_tickers = all_tickers.head(self.number_of_tickers)
-
-        #Give me the returns of the index (input by the user)
-        index_returns = self.index_processor.index_returnsdf()
-
-        #First ticker to have returns in the datafram is the index ticker (input by the user)
-        returns_all_tickers = pd.DataFrame(index_returns["Date"])
-        returns_all_tickers[f"{self.index_name} Returns"] = index_returns[f"{self.index_name} Returns"]
-
-        for i in range(len(all_tickers)):
-            #Selecting each ticker from the wikipedia df
-            ticker = all_tickers.iloc[i,0]
-            try:
-                print(f"Processing {ticker}...")
-                #Getting returns of the ticker using the function in the preprocessor part
-                stock_returns = self.index_processor.stock_returnsdf(ticker)
-                
-                #Merging the newly created df with the returns_all_tickers df
-                returns_all_tickers = pd.merge(
-                    returns_all_tickers, 
-                    stock_returns[["Date", f"{ticker} Returns"]], 
-                    on="Date", 
-                    how="left"
-                )
-                
-            except Exception as e:
-                print(f"Error with {ticker}: {e}")
-    
-        #Setting date as index of the data frame
-        returns_all_tickers.set_index("Date", inplace=True)
+            return pd.DataFrame(selected_tickers, columns=["Ticker"])
+
+        # Otherwise use the first N tickers of the universe (S&P 500 by default, original behavior)
+        all_tickers = pd.DataFrame(list(load_universe(self.universe)), columns=["Ticker"])
+        return all_tickers.head(self.number_of_tickers)
+
+    #Creating a df with all the returns of all features (for the selected period and interval)
+    @timed("returns_all_tickers")
+    def returns_all_tickers(self, selected_tickers=None):
+        all_tickers = self.tickers_to_analyze(selected_tickers)
+
+        #Downloading the index and all tickers in chunked batch requests (one wide close-price frame)
+        self.index_processor.progress_callback = self.progress_callback
+        bulk_closes = self.index_processor.close_prices_bulk(list(all_tickers["Ticker"]))
+        self.fetch_errors = bulk_closes.errors
+
+        #Prices can come (partly) from the cache, so the stage is reported complete once the bulk fetch returns
+        if self.progress_callback is not None:
+            self.progress_callback("prices", len(all_tickers) + 1, len(all_tickers) + 1)
+
+        if self.index_name in bulk_closes.errors:
+            raise ValueError(f"Could not download the index {self.index_name}: {bulk_closes.errors[self.index_name]}")
+
+        if self.fetch_errors:
+            print(f"Failed downloads ({len(self.fetch_errors)}): {', '.join(self.fetch_errors)}")
+
+        #Failed downloads are reported in self.fetch_errors instead of stopping the analysis
+        tickers = [ticker for ticker in dict.fromkeys(all_tickers["Ticker"]) if ticker not in bulk_closes.errors]
+
+        #Bars aligned on the trading calendar of the index and returns of every ticker in one pass over the wide closes
+        #(only the dates where the index has a return are kept, like the old left merge)
+        returns_all_tickers, self.data_quality = clean_returns(bulk_closes.closes, self.index_name, tickers, self.interval, self.returns_method)
+        self.report_data_quality()
 
         #Storing the DataFrame as instance variables
         self.returns_data = returns_all_tickers
-
-        print("returns_all_tickers finished --- %s seconds ---" % (time.time() - start_time))
+        self.benchmark_returns = None
         return returns_all_tickers
     
+    #Printing the tickers flagged by the data-quality stage (short or stale histories)
+    def report_data_quality(self):
+        summary = quality_summary(self.data_quality) if self.data_quality is not None else None
+        if summary:
+            print(f"Data quality flags: {summary}")
+        return summary
+
     #Important to maintain consistency throughout the different analyses
     def get_stock_ticker_names(self):
         #Putting the stock ticker names into a list in case you just want to check what tickers we are using
@@ -95,7 +190,7 @@ class analyzer:
     
         return ticker_names
 
-    #Saving all returns into a file if desired
+    #Saving all returns into a file if desired (pipeline.py publishes versioned snapshots of the whole universe instead)
     def saving_all_returns(self):
         returns_filename = f'returns_{self.index_name}_{self.number_of_tickers}_tickers_{self.period}_{self.interval}.csv'
 
@@ -105,8 +200,8 @@ class analyzer:
         
         return returns_filename
 
+    @timed("beta_calc_all")
     def beta_calc_all(self):
-        start_time = time.time()
         if not self.ticker_names:
             self.get_stock_ticker_names()
         
@@ -114,73 +209,203 @@ class analyzer:
             print("No ticker names available. Cannot calculate betas.")
             return None
 
+        #Betas, alphas, R² and standard errors of every ticker in a single NaN-aware matrix pass
+        self.beta_stats = beta_stats(self.returns_data, f"{self.index_name} Returns", pairwise=self.pairwise)
+
         #Creating dataframe only with the ticker names, 
         #This will be the df that I will add the future data (beta, mcap, etc.)
         self.beta_all_df = pd.DataFrame(self.ticker_names, columns=["Ticker"])
 
-        for i in range(len(self.beta_all_df)):
-            #Each ticker is in each row [i,0], so I am fetching each ticker in each iteration
-            ticker = self.beta_all_df.iloc[i, 0]
-            
-            #Skipping the index column, since we don't calculate the beta of it
-            if self.index_name in self.ticker_names:
-                continue
-            
-            #Calculating ri (individual stock returns)
-            ri = self.returns_data[f"{ticker} Returns"]
-            
-            #Calculating rm (market returns (standard is sp500))
-            rm = self.returns_data[f"{self.index_name} Returns"]
-
-            #Beta calculation
-            beta = np.cov(ri, rm)[0,1]/np.var(rm)
+        #Adding the rounded betas to the df that initially only had the ticker names
+        betas = self.beta_stats.set_index("Ticker")["Beta"]
+        self.beta_all_df[f"Beta {self.period} {self.interval}"] = np.round(betas.reindex(self.ticker_names).to_numpy(), decimals=3)
 
-            #Beta rounding
-            rounded_beta = np.round(beta, decimals=3)
-
-            #Adding beta to the df that initially only had the ticker names
-            self.beta_all_df.at[i,f"Beta {self.period} {self.interval}"] = rounded_beta
-
-        print("beta_calc_all finished --- %s seconds ---" % (time.time() - start_time))
+        if self.progress_callback is not None:
+            self.progress_callback("betas", len(self.ticker_names), len(self.ticker_names))
         
         return self.beta_all_df
-        #np.cov(ri,rm) will give me a covariance matrix. the [0,1] element is the covariance between...
-        #... rm and r1 (is the same as [1,0])
     
-    def capm_all(self):
-        start_time = time.time()
-        
+    #Bootstrap confidence intervals of the betas (percentile intervals of moving-block resamples of the dates, see
+    #bootstrap_engine.py), one row per ticker with the beta, its bounds and the bootstrap standard error
+    @timed("beta_bootstrap_all")
+    def beta_bootstrap_all(self, resamples=BOOTSTRAP_RESAMPLES, confidence=BOOTSTRAP_CONFIDENCE, block_length=None, seed=0, workers=None):
+        if self.returns_data is None:
+            print("No return data available. Please run returns_all_tickers() first.")
+            return None
+
+        self.beta_intervals = bootstrap_betas(self.returns_data, f"{self.index_name} Returns", resamples, confidence,
+                                              block_length, seed, workers, pairwise=self.pairwise)
+        return self.beta_intervals
+
+    #Returns of a list of benchmarks ("<BENCHMARK> Returns" columns, in the order given) on the dates of returns_data
+    #The index of the analysis is read from returns_data, the others are downloaded in one bulk request the first time
+    #they are asked for and kept in self.benchmark_returns, benchmarks that cannot be downloaded are left out
+    def benchmark_returns_all(self, benchmarks=DEFAULT_BENCHMARKS):
+        if self.returns_data is None:
+            print("No return data available. Please run returns_all_tickers() first.")
+            return None
+
+        if self.benchmark_returns is None or not self.benchmark_returns.index.equals(self.returns_data.index):
+            self.benchmark_returns = pd.DataFrame(index=self.returns_data.index)
+
+        missing = [benchmark for benchmark in dict.fromkeys(benchmarks)
+                   if benchmark != self.index_name and f"{benchmark} Returns" not in self.benchmark_returns.columns]
+        if missing:
+            bulk_closes = self.index_processor.close_prices_bulk(missing)
+            if self.index_name in bulk_closes.errors:
+                raise ValueError(f"Could not download the index {self.index_name}: {bulk_closes.errors[self.index_name]}")
+            if bulk_closes.errors:
+                print(f"Failed benchmark downloads ({len(bulk_closes.errors)}): {', '.join(bulk_closes.errors)}")
+
+            #Same calendar and returns method as the stocks, then the dates of returns_data
+            fetched = [benchmark for benchmark in missing if benchmark not in bulk_closes.errors]
+            if fetched:
+                returns, _ = clean_returns(bulk_closes.closes, self.index_name, fetched, self.interval, self.returns_method)
+                returns = returns.drop(columns=f"{self.index_name} Returns").reindex(self.returns_data.index)
+                self.benchmark_returns = pd.concat([self.benchmark_returns, returns], axis=1)
+
+        index_column = f"{self.index_name} Returns"
+        columns = [f"{benchmark} Returns" for benchmark in dict.fromkeys(benchmarks)]
+        benchmark_returns = self.benchmark_returns.assign(**{index_column: self.returns_data[index_column]})
+        return benchmark_returns[[column for column in columns if column in benchmark_returns.columns]]
+
+    #Betas and CAPM statistics of every ticker against every benchmark (one row per (benchmark, ticker) pair, unrounded)
+    #The stock returns matrix is shared by all the benchmarks and the whole grid is computed in one pass
+    @timed("benchmark_grid_all")
+    def benchmark_grid_all(self, benchmarks=DEFAULT_BENCHMARKS):
+        benchmark_returns = self.benchmark_returns_all(benchmarks)
+        if benchmark_returns is None:
+            return None
+
+        stock_returns = self.returns_data.drop(columns=f"{self.index_name} Returns")
+        rf = risk_free_per_bar(self.risk_free, self.returns_data.index, self.interval)
+        self.benchmark_grid = benchmark_grid(stock_returns, benchmark_returns, rf, self.interval, pairwise=self.pairwise)
+        return self.benchmark_grid
+
+    #Compact copy of returns_data (contiguous array, optionally float32), the beta engines accept it in place of the df
+    def returns_store(self, dtype=np.float64):
+        if self.returns_data is None:
+            print("No return data available. Please run returns_all_tickers() first.")
+            return None
+        return ReturnsStore.from_frame(self.returns_data, self.index_name, dtype=dtype)
+
+    #Publishing returns_data as a read-only snapshot that every worker process can map (see returns_snapshot.py)
+    def publish_returns_snapshot(self, snapshot_dir=SNAPSHOT_DIR, dtype=np.float64):
+        store = self.returns_store(dtype=dtype)
+        if store is None:
+            return None
+        metadata = {"period": self.period, "interval": self.interval}
+        return publish_snapshot(store, snapshot_dir, metadata=metadata)
+
+    #Using a published snapshot as returns_data, the DataFrame is a view on the mapped file (no copy for float64)
+    def load_returns_snapshot(self, snapshot_dir=SNAPSHOT_DIR, version=None):
+        store = open_snapshot(snapshot_dir, version)
+        self.index_name = store.index_name
+        self.period = self.index_processor.period = store.metadata.get("period", self.period)
+        self.interval = self.index_processor.interval = store.metadata.get("interval", self.interval)
+        self.returns_data = store.to_frame()
+        self.get_stock_ticker_names()
+        #One column per ticker after the index column, like the selection of a live run
+        self.number_of_tickers = self.index_processor.number_of_tickers = len(store.tickers) - 1
+        return self.returns_data
+
+    #Beta time series of every ticker, window and half-life are in years and converted to bars of the current interval
+    #mode: "rolling" (window of window_years), "expanding" (all bars up to each date) or "ewma" (half-life of halflife_years)
+    @timed("rolling_beta_all")
+    def rolling_beta_all(self, mode="rolling", window_years=3, halflife_years=1):
+        if self.returns_data is None:
+            print("No return data available. Please run returns_all_tickers() first.")
+            return None
+
+        bars_per_year = BARS_PER_YEAR.get(self.interval, 12)
+        index_column = f"{self.index_name} Returns"
+
+        if mode == "rolling":
+            self.rolling_betas = rolling_betas(self.returns_data, index_column, window=int(window_years * bars_per_year))
+        elif mode == "expanding":
+            #Expanding betas only start once there is a year of data
+            self.rolling_betas = rolling_betas(self.returns_data, index_column, window=None, min_periods=bars_per_year)
+        elif mode == "ewma":
+            self.rolling_betas = ewma_betas(self.returns_data, index_column, halflife=halflife_years * bars_per_year, min_periods=bars_per_year)
+        else:
+            raise ValueError(f"Unknown rolling beta mode: {mode}")
+
+        return self.rolling_betas
+
+    #Fama-French style exposures of every ticker (one row per ticker, unrounded) for model "ff3" or "ff5"
+    #Factor returns come from the local factor file of the interval (see factor_engine.py) unless given as a df
+    @timed("factor_model_all")
+    def factor_model_all(self, model="ff3", factors=None):
         if not self.ticker_names:
             self.get_stock_ticker_names()
-        
+
         if not self.ticker_names:
-            print("No ticker names available. Cannot calculate betas.")
+            print("No ticker names available. Cannot calculate factor exposures.")
+            return None
+
+        if factors is None:
+            factors = load_factors(factors_file_for(self.interval))
+
+        stock_columns = [f"{ticker} Returns" for ticker in self.ticker_names]
+        self.factor_stats = factor_stats(self.returns_data, stock_columns, self.ticker_names, factors, self.interval,
+                                         model=model, pairwise=self.pairwise)
+        return self.factor_stats
+
+    #Full covariance of the stock returns ("pairwise" or "ledoit-wolf" shrinkage) with the index betas,
+    #self.risk_model.portfolio(weights) then gives the beta, volatility and risk contributions of any portfolio
+    @timed("risk_model_all")
+    def risk_model_all(self, estimator="ledoit-wolf"):
+        if self.returns_data is None:
+            print("No return data available. Please run returns_all_tickers() first.")
             return None
-        
-        capm_df = pd.DataFrame(self.ticker_names, columns=["Ticker"])
 
-        market_returns = self.returns_data[f"{self.index_name} Returns"]
-        expected_market_returns = market_returns.mean() #Arithmetic mean of the past 5y monthly returns - E[rm]
+        self.risk_model = RiskModel.from_returns(self.returns_data, f"{self.index_name} Returns", self.interval,
+                                                 estimator=estimator, pairwise=self.pairwise)
+        return self.risk_model
 
-        annual_risk_free_rate = 0.042
-        #Using the 5year treasury bill (^FVX), which is around 4,2% today
+    #Using the yields of a treasury ticker (^IRX, ^FVX, ^TNX) as the risk-free rate instead of the constant
+    def use_risk_free_series(self, ticker="^IRX"):
+        self.risk_free = load_risk_free_rates(self.index_processor, ticker)
+        return self.risk_free
 
-        monthly_risk_free_rate = (1 + annual_risk_free_rate)**(1/12) - 1
+    #CAPM statistics of the tickers of a returns df (index column first) for betas in the order of its columns
+    def capm_stats_of(self, returns_data, betas):
+        rm, ri, stock_columns = split_returns(returns_data, f"{self.index_name} Returns")
+        rf = risk_free_per_bar(self.risk_free, returns_data.index, self.interval)
+        return capm_stats_arrays(rm, ri, rf, betas, [ticker_from_column(column) for column in stock_columns], self.interval, pairwise=self.pairwise)
 
-        #CAPM formula is: E[rA] = rf + βA × (E[rm] - rf)
-        for i in range(len(capm_df)):
-            beta_each_asset = self.beta_all_df.iloc[i,1]
-            expected_return = (monthly_risk_free_rate + beta_each_asset*(expected_market_returns-monthly_risk_free_rate))*100
-            rounded_capm = np.round(expected_return, decimals=3)
-            capm_df.at[i,"Expected Monthly Returns (%)"] = rounded_capm
+    @timed("capm_all")
+    def capm_all(self):
+        if not self.ticker_names:
+            self.get_stock_ticker_names()
         
-        print("capm_all finished --- %s seconds ---" % (time.time() - start_time))
+        if not self.ticker_names:
+            print("No ticker names available. Cannot calculate betas.")
+            return None
+
+        #Expected returns and ratios of every ticker in one array pass, from the betas of the table
+        betas = self.beta_all_df.set_index("Ticker").iloc[:, 0].reindex(self.ticker_names).to_numpy()
+        self.capm_stats = self.capm_stats_of(self.returns_data, betas)
+
+        capm_df = pd.DataFrame(self.ticker_names, columns=["Ticker"])
+        capm_df[EXPECTED_RETURN_COLUMN] = np.round(self.capm_stats[EXPECTED_RETURN_COLUMN].to_numpy(), decimals=3)
 
         return capm_df
+
+    #Jensen's alpha, Treynor and Sharpe ratios of capm_stats, rounded for the table
+    def capm_ratios(self, capm_stats):
+        ratios = capm_stats[["Ticker"] + RATIO_COLUMNS].copy()
+        ratios[RATIO_COLUMNS] = ratios[RATIO_COLUMNS].round(3)
+        return ratios
     
+    #Market cap, Yahoo beta, name and sector of every ticker, fetched concurrently and only once per set of tickers
+    def fundamentals_all(self):
+        if self.fundamentals_df is None or list(self.fundamentals_df["Ticker"]) != self.ticker_names:
+            self.fundamentals_df = self.fundamentals_fetcher.fetch(self.ticker_names, progress_callback=self.progress_callback)
+        return self.fundamentals_df
+
+    @timed("mcap_all")
     def mcap_all(self):
-        start_time = time.time()
-        
         if not self.ticker_names:
             self.get_stock_ticker_names()
         
@@ -188,27 +413,13 @@ class analyzer:
             print("No ticker names available. Cannot calculate betas.")
             return None
         
-        mcap_df = pd.DataFrame(self.ticker_names, columns=["Ticker"])
-
-        #Getting the market cap of the tickers
-        for i in range(len(mcap_df)):
-            ticker = mcap_df.iloc[i,0]
-            ticker_info = yf.Ticker(ticker).info
-            market_cap = ticker_info.get("marketCap",None)
-            if market_cap is not None:
-                mcap = yf.Ticker(ticker).info["marketCap"]/1000000000
-                rounded_mcap = np.round(mcap, decimals=3)
-                mcap_df.at[i,"Market Cap (in $B)"] = rounded_mcap
-            else:
-                mcap_df.at[i, "Market Cap (in $B)"] = None
-        
-        print("mcap_all finished --- %s seconds ---" % (time.time() - start_time))
+        #Getting the market cap of the tickers (one .info call per ticker, shared with the Yahoo beta)
+        mcap_df = self.fundamentals_all()[["Ticker", "Market Cap (in $B)"]]
 
         return mcap_df
     
+    @timed("run_all_analysis")
     def run_all_analysis(self):
-        start_time = time.time()
-        
         if not self.ticker_names:
             self.get_stock_ticker_names()
         
@@ -221,32 +432,206 @@ class analyzer:
         capm_calculated = self.capm_all()
         
         merged_df = pd.merge(capm_calculated,beta_calculated,on="Ticker",how="left")
+        merged_df = pd.merge(merged_df,self.capm_ratios(self.capm_stats),on="Ticker",how="left")
 
-        yfinance_beta_df = pd.DataFrame(self.ticker_names, columns=["Ticker"])
-        
-        for i in range(len(yfinance_beta_df)):
-            ticker = yfinance_beta_df.iloc[i,0]
-            ticker_info = yf.Ticker(ticker).info
-            beta_yf = ticker_info.get("beta",None)
-            yfinance_beta_df.at[i,"Beta YF"] = beta_yf
+        #Adding market cap and the Yahoo beta (one .info call per ticker)
+        merged_df = pd.merge(merged_df,self.fundamentals_all(),on="Ticker",how="left")
 
         merged_df.set_index("Ticker",inplace=True)
 
         self.all_info = merged_df
 
-        print("run_all_analysis finished --- %s seconds ---" % (time.time() - start_time))
-
         return self.all_info
     
+    #Streaming version of returns_all_tickers + run_all_analysis: yields the all_info rows batch by batch
+    #Each batch is downloaded, analyzed (beta, CAPM, market cap) and yielded before the next one starts
+    #Once exhausted, returns_data, ticker_names, beta_stats, beta_all_df and all_info hold the same as a full run
+    #Pairwise only: with pairwise=False the dates kept depend on every ticker, so no batch can be analyzed before the last one
+    @timed("iter_analysis")
+    def iter_analysis(self, selected_tickers=None, batch_size=25):
+        if not self.pairwise:
+            raise ValueError("iter_analysis needs pairwise=True, use returns_all_tickers and run_all_analysis for listwise dates")
+        all_tickers = list(self.tickers_to_analyze(selected_tickers)["Ticker"])
+        index_column = f"{self.index_name} Returns"
+
+        #Progress is reported per batch here, not per download chunk
+        self.index_processor.progress_callback = None
+        self.fetch_errors = {}
+
+        #The index comes first, every batch is regressed against it
+        index_closes = self.index_processor.close_prices_bulk([])
+        if self.index_name in index_closes.errors:
+            raise ValueError(f"Could not download the index {self.index_name}: {index_closes.errors[self.index_name]}")
+        index_closes = index_closes.closes[[self.index_name]]
+        index_returns = clean_returns(index_closes, self.index_name, [], self.interval, self.returns_method)[0][index_column]
+
+        stock_returns = {}
+        quality_batches = []
+        stats_batches = []
+        capm_batches = []
+        fundamentals_batches = []
+        info_batches = []
+
+        for start in range(0, len(all_tickers), batch_size):
+            batch = all_tickers[start:start + batch_size]
+
+            #Downloading the batch (the index is already there)
+            batch_closes = self.index_processor.close_prices_bulk(batch, include_index=False)
+            self.fetch_errors.update(batch_closes.errors)
+
+            if self.progress_callback is not None:
+                self.progress_callback("prices", start + len(batch), len(all_tickers))
+
+            batch_tickers = [ticker for ticker in dict.fromkeys(batch) if ticker not in batch_closes.errors]
+            if not batch_tickers:
+                continue
+
+            #Returns of the batch on the calendar of the index
+            closes_batch = pd.concat([index_closes, batch_closes.closes[batch_tickers]], axis=1)
+            returns_batch, batch_quality = clean_returns(closes_batch, self.index_name, batch_tickers, self.interval, self.returns_method)
+            quality_batches.append(batch_quality)
+            stock_returns.update({ticker: returns_batch[f"{ticker} Returns"] for ticker in batch_tickers})
+
+            #Betas and CAPM of the batch
+            batch_stats = beta_stats(returns_batch, index_column, pairwise=self.pairwise)
+            stats_batches.append(batch_stats)
+
+            batch_info = pd.DataFrame({"Ticker": batch_stats["Ticker"]})
+            rounded_betas = np.round(batch_stats["Beta"].to_numpy(), decimals=3)
+            batch_capm = self.capm_stats_of(returns_batch, rounded_betas)
+            capm_batches.append(batch_capm)
+            batch_info[EXPECTED_RETURN_COLUMN] = np.round(batch_capm[EXPECTED_RETURN_COLUMN].to_numpy(), decimals=3)
+            batch_info[f"Beta {self.period} {self.interval}"] = rounded_betas
+            batch_info = pd.merge(batch_info, self.capm_ratios(batch_capm), on="Ticker", how="left")
+
+            if self.progress_callback is not None:
+                self.progress_callback("betas", start + len(batch), len(all_tickers))
+
+            #Market cap and Yahoo beta of the batch
+            batch_fundamentals = self.fundamentals_fetcher.fetch(list(batch_info["Ticker"]))
+            fundamentals_batches.append(batch_fundamentals)
+            batch_info = pd.merge(batch_info, batch_fundamentals, on="Ticker", how="left").set_index("Ticker")
+            info_batches.append(batch_info)
+
+            if self.progress_callback is not None:
+                self.progress_callback("fundamentals", start + len(batch), len(all_tickers))
+
+            yield batch_info
+
+        if self.fetch_errors:
+            print(f"Failed downloads ({len(self.fetch_errors)}): {', '.join(self.fetch_errors)}")
+
+        #Storing the same state as returns_all_tickers + run_all_analysis
+        self.returns_data = build_returns_matrix(index_returns, stock_returns)
+        self.get_stock_ticker_names()
+        if quality_batches:
+            self.data_quality = pd.concat(quality_batches, ignore_index=True)
+            self.report_data_quality()
+        if info_batches:
+            self.beta_stats = pd.concat(stats_batches, ignore_index=True)
+            self.capm_stats = pd.concat(capm_batches, ignore_index=True)
+            self.fundamentals_df = pd.concat(fundamentals_batches, ignore_index=True)
+            self.all_info = pd.concat(info_batches)
+            self.beta_all_df = self.all_info[f"Beta {self.period} {self.interval}"].reset_index()
+
+    #Betas and CAPM of every (period, interval) combination in one pass, as a tidy cube (one row per period, interval, ticker)
+    #The longest daily history is downloaded once, weekly/monthly bars are resampled locally and each period is a slice
+    @timed("run_all_combinations")
+    def run_all_combinations(self, selected_tickers=None, periods=PERIODS, intervals=INTERVALS):
+        all_tickers = list(self.tickers_to_analyze(selected_tickers)["Ticker"])
+
+        #Downloading the daily closes of the longest period once
+        longest_period = min(periods, key=lambda period: period_start(period) or pd.Timestamp.min)
+
+        saved_settings = self.index_processor.period, self.index_processor.interval
+        self.index_processor.period, self.index_processor.interval = longest_period, "1d"
+        try:
+            bulk_closes = self.index_processor.close_prices_bulk(all_tickers)
+        finally:
+            self.index_processor.period, self.index_processor.interval = saved_settings
+
+        self.fetch_errors = bulk_closes.errors
+        if self.index_name in bulk_closes.errors:
+            raise ValueError(f"Could not download the index {self.index_name}: {bulk_closes.errors[self.index_name]}")
+        if self.fetch_errors:
+            print(f"Failed downloads ({len(self.fetch_errors)}): {', '.join(self.fetch_errors)}")
+
+        tickers = [ticker for ticker in dict.fromkeys(all_tickers) if ticker not in bulk_closes.errors and ticker != self.index_name]
+        daily_closes = align_to_calendar(bulk_closes.closes[[self.index_name] + tickers], self.index_name, "1d")
+
+        cube_parts = []
+        self.combination_returns = {}
+        for interval in intervals:
+            #Bars of the interval and their returns, only the dates where the index has a return (like the left merge)
+            closes = resample_closes(daily_closes, interval)
+            returns = wide_returns(closes)
+            if self.returns_method == "log":
+                returns = np.log1p(returns)
+            index_rows = returns[self.index_name].notna().to_numpy()
+            returns = returns[index_rows]
+
+            #Bar (row of closes) of the previous close behind each return, and bar of each return row
+            #A return whose previous close is older than the first bar of a period is not part of that period
+            close_rows = np.where(closes[tickers].notna().to_numpy(), np.arange(len(closes))[:, None], np.nan)
+            previous_rows = pd.DataFrame(close_rows).ffill().shift(1).to_numpy()[index_rows]
+            return_rows = np.flatnonzero(index_rows)
+
+            #Shared arrays of the interval, every period is a slice of the most recent rows
+            rm_all = returns[self.index_name].to_numpy(dtype=np.float64)
+            ri_all = returns[tickers].to_numpy(dtype=np.float64)
+            rf_all = risk_free_per_bar(self.risk_free, returns.index, interval)
+            bar_dates = closes.index[closes[self.index_name].notna()]
+            interval_store = ReturnsStore(np.column_stack([rm_all, ri_all]), returns.index.to_numpy(), [self.index_name] + tickers, self.index_name)
+            interval_store.metadata = {"interval": interval, "first_bar": bar_dates[0].isoformat()}
+            self.combination_returns[interval] = interval_store
+
+            for period in periods:
+                first_row = period_first_row(returns.index, period, bar_dates[0], interval=interval, trading_days=daily_closes.index)
+                first_bar_row = return_rows[first_row - 1] if first_row > 0 else closes.index.get_loc(bar_dates[0])
+                #The first bar of a download only holds the days from the period start on, a ticker without a close on
+                #those days has no first close, so its first return must come after it
+                first_close_rows = np.full(len(tickers), first_bar_row)
+                if first_row > 0 and interval != "1d":
+                    first_days = daily_closes.loc[period_first_day(period, trading_days=daily_closes.index):].iloc[:31]
+                    first_days = first_days[normalize_bar_dates(first_days.index, interval) == closes.index[first_bar_row]]
+                    first_close_rows[~first_days[tickers].notna().any().to_numpy()] += 1
+                rm = rm_all[first_row:]
+                ri = np.where(previous_rows[first_row:] >= first_close_rows, ri_all[first_row:], np.nan)
+                period_stats = beta_stats_arrays(rm, ri, tickers, pairwise=self.pairwise)
+
+                #Expected returns and ratios with the interval's own annualization
+                period_capm = capm_stats_arrays(rm, ri, rf_all[first_row:], np.round(period_stats["Beta"].to_numpy(), decimals=3),
+                                                tickers, interval, pairwise=self.pairwise)
+                period_stats[EXPECTED_RETURN_COLUMN] = np.round(period_capm[EXPECTED_RETURN_COLUMN].to_numpy(), decimals=3)
+                period_stats[RATIO_COLUMNS] = period_capm[RATIO_COLUMNS].to_numpy()
+                period_stats.insert(0, "Interval", interval)
+                period_stats.insert(0, "Period", period)
+                cube_parts.append(period_stats)
+
+        self.combinations_df = pd.concat(cube_parts, ignore_index=True)
+
+        return self.combinations_df
+
+    #all_info-style frame (Ticker index, expected return, beta and CAPM ratio columns) of one combination of the cube
+    def all_info_from_cube(self, cube, period, interval):
+        selection = cube[(cube["Period"] == period) & (cube["Interval"] == interval)]
+        all_info = pd.DataFrame({
+            "Ticker": selection["Ticker"].to_numpy(),
+            EXPECTED_RETURN_COLUMN: selection[EXPECTED_RETURN_COLUMN].to_numpy(),
+            f"Beta {period} {interval}": np.round(selection["Beta"].to_numpy(), decimals=3),
+        })
+        #Cubes of older snapshots have no ratio columns
+        for column in RATIO_COLUMNS:
+            if column in selection.columns:
+                all_info[column] = np.round(selection[column].to_numpy(), decimals=3)
+        return all_info.set_index("Ticker")
+
+    @timed("saving_all_analysis")
     def saving_all_analysis(self):
-        start_time = time.time()
-        
         all_info_filename = f"all_info_{self.number_of_tickers}_tickers_{self.index_name}_index.csv"
 
         self.all_info.to_csv(all_info_filename)
 
         print(f"Saved all analysis to {all_info_filename}")
-
-        print("saving_all_analysis finished --- %s seconds ---" % (time.time() - start_time))
         
         return all_info_filename
\ No newline at end of file
@@ -0,0 +1,59 @@
+#Ticker universes (S&P 500 by default), loaded once and memoized
+#Other universes can be registered: another index from a JSON file, or a custom CSV
+
+import csv
+import json
+import os
+from functools import lru_cache
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+DEFAULT_UNIVERSE = "sp500"
+
+#Used when the universe file cannot be read
+FALLBACK_TICKERS = ["AAPL", "NVDA", "TSLA", "AMZN", "MSFT", "GOOG", "INTC"]
+
+#Dash dropdown options [{"label": ..., "value": ...}] or a plain list of tickers
+def load_json_universe(path):
+    with open(path) as universe_file:
+        constituents = json.load(universe_file)
+    return [item["value"] if isinstance(item, dict) else item for item in constituents]
+
+#CSV with one ticker per row in the given column
+def load_csv_universe(path, column="Ticker"):
+    with open(path, newline="") as universe_file:
+        return [row[column].strip() for row in csv.DictReader(universe_file) if row.get(column, "").strip()]
+
+#{universe name: function returning the list of tickers}
+_UNIVERSE_LOADERS = {
+    "sp500": lambda: load_json_universe(os.path.join(DATA_DIR, "sp500_tickers.json")),
+}
+
+def register_universe(name, loader):
+    _UNIVERSE_LOADERS[name] = loader
+    load_universe.cache_clear()
+
+def register_json_universe(name, path):
+    register_universe(name, lambda: load_json_universe(path))
+
+def register_csv_universe(name, path, column="Ticker"):
+    register_universe(name, lambda: load_csv_universe(path, column))
+
+def available_universes():
+    return list(_UNIVERSE_LOADERS)
+
+#Tickers of a universe (tuple, read from disk only the first time)
+@lru_cache(maxsize=None)
+def load_universe(name=DEFAULT_UNIVERSE):
+    if name not in _UNIVERSE_LOADERS:
+        raise ValueError(f"Unknown universe: {name}. Available: {', '.join(available_universes())}")
+    return tuple(dict.fromkeys(_UNIVERSE_LOADERS[name]()))
+
+#Dropdown options of a universe, falling back to a few large caps when it cannot be loaded
+def ticker_options(name=DEFAULT_UNIVERSE):
+    try:
+        tickers = load_universe(name)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading tickers: {e}")
+        tickers = FALLBACK_TICKERS
+    return [{'label': ticker, 'value': ticker} for ticker in tickers]